@@ -0,0 +1,276 @@
+"""
+Замеры фаз calc.py: перечисление состояний, построение переходов, ретроградный анализ
+(и без хранимого графа, и на диске), достижимость со старта, правила чёрных, вывод, экспорт
+и самоигра. Для каждой фазы — время, пиковая память и счётчики (состояния, ходы,
+правила); результаты пишутся в JSON и сравниваются с сохранёнными.
+
+    python bench.py                                  # classic и original, таблица на экран
+    python bench.py -o bench.json                    # плюс результаты в файл
+    python bench.py --baseline bench.json            # сравнить с прошлым замером
+    python bench.py --phases enumerate transitions solve --repeat 3
+    python bench.py --phases transitions --workers 8  # параллельное построение графа
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import calc
+import selfplay
+
+
+def _phase_enumerate(rules, context):
+    index = calc.StateIndex(rules)
+    return {"states": len(index)}
+
+
+def _phase_transitions(rules, context):
+    solver = context["solver"] = calc.Solver(rules=rules, workers=context["workers"])
+    red, black = solver.transitions[:2]
+    return {"states": len(solver), "edges": red.edge_count() + black.edge_count()}
+
+
+def _phase_solve(rules, context):
+    status = context["solver"].retro_status
+    return {"decided": sum(len(status[color]) - status[color].count(0) for color in (calc.COLOR_RED, calc.COLOR_BLACK))}
+
+
+def _phase_solve_numpy(rules, context):
+    solver = context["solver"]
+    status, _ = calc.run_retrograde_analysis_numpy(solver.index, solver.transitions)
+    return {"decided": sum(int(calc.np.count_nonzero(status[color])) for color in (calc.COLOR_RED, calc.COLOR_BLACK))}
+
+
+def _phase_solve_unmoves(rules, context):
+    status = calc.Solver(rules=rules, unmoves=True).retro_status
+    return {"decided": sum(len(status[color]) - status[color].count(0) for color in (calc.COLOR_RED, calc.COLOR_BLACK))}
+
+
+def _phase_solve_disk(rules, context):
+    with tempfile.TemporaryDirectory() as directory:
+        store = calc.solve_on_disk(calc.StateIndex(rules, keep_states=False), directory)
+        status, _ = store.gather()
+        store.close()
+    return {"decided": sum(len(status[color]) - status[color].count(0) for color in (calc.COLOR_RED, calc.COLOR_BLACK))}
+
+
+def _phase_reachable(rules, context):
+    reachable = context["solver"].reachable
+    return {color: reachable[color].count(1) for color in (calc.COLOR_RED, calc.COLOR_BLACK)}
+
+
+def _phase_black_rules(rules, context):
+    context["rules"] = calc.build_black_transition_rules(context["solver"])
+    return {"rules": len(context["rules"])}
+
+
+def _phase_print_rules(rules, context):
+    with open(os.devnull, "w") as out:
+        calc.print_black_transition_rules(context["rules"], out)
+    return {}
+
+
+def _phase_print_numeric(rules, context):
+    with open(os.devnull, "w") as out:
+        calc.print_black_transition_rules_numeric(context["solver"], context["rules"], out)
+    return {}
+
+
+def _phase_print_positions(rules, context):
+    with open(os.devnull, "w") as out:
+        calc.print_all_positions(context["solver"], out)
+    return {}
+
+
+def _phase_export_packed(rules, context):
+    with open(os.devnull, "w") as out:
+        calc.print_packed_rule_table(context["solver"], out)
+    return {}
+
+
+def _phase_export_status(rules, context):
+    solver = context["solver"]
+    return {"bytes": len(calc.serialize_status_table(calc.pack_status_table(solver.retro_status), rules))}
+
+
+def _phase_export_minimal(rules, context):
+    return {"rules": sum(1 for _ in calc.minimize_transition_rules(context["solver"]))}
+
+
+def _phase_selfplay(rules, context):
+    solver = context["solver"]
+    results = selfplay.run_tournament(selfplay.build_play_tables(solver, solver.reachable), games=10000)
+    return {"games": sum(result["games"] for result in results),
+            "moves": sum(sum(result["moves"]) for result in results)}
+
+
+# Фазы по порядку: (имя, функция, от каких фаз зависит)
+PHASES = (
+    ("enumerate", _phase_enumerate, ()),
+    ("transitions", _phase_transitions, ()),
+    ("solve", _phase_solve, ("transitions",)),
+    ("solve_numpy", _phase_solve_numpy, ("transitions",)),
+    ("solve_unmoves", _phase_solve_unmoves, ()),
+    ("solve_disk", _phase_solve_disk, ()),
+    ("reachable", _phase_reachable, ("transitions",)),
+    ("black_rules", _phase_black_rules, ("solve",)),
+    ("print_rules", _phase_print_rules, ("black_rules",)),
+    ("print_numeric", _phase_print_numeric, ("black_rules",)),
+    ("print_positions", _phase_print_positions, ("transitions",)),
+    ("export_packed", _phase_export_packed, ("solve",)),
+    ("export_status", _phase_export_status, ("solve",)),
+    ("export_minimal", _phase_export_minimal, ("solve",)),
+    ("selfplay", _phase_selfplay, ("solve",)),
+)
+PHASE_NAMES = tuple(name for name, _, _ in PHASES)
+
+
+def _with_dependencies(selected):
+    """Выбранные фазы вместе с теми, от которых они зависят, в порядке PHASES."""
+    needed = set(selected)
+    for name, _, requires in reversed(PHASES):
+        if name in needed:
+            needed.update(requires)
+    return [phase for phase in PHASES if phase[0] in needed]
+
+
+def _peak_rss_kb():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage // 1024 if sys.platform == "darwin" else usage
+
+
+def run_phases(rules, phases, trace_memory=False, workers=1):
+    """
+    Один прогон фаз для набора правил: {фаза: {"seconds", "peak_bytes", "rss_kb", "counts"}}.
+    Кэши таблиц ходов сбрасываются, чтобы каждый прогон начинался с нуля.
+    peak_bytes — пик tracemalloc за фазу (None без trace_memory), rss_kb — пик RSS процесса.
+    workers — процессов для построения графа переходов (RSS процессов пула не учитывается).
+    """
+    calc._move_tables_cache.clear()
+    calc._stone_sets_cache.clear()
+    context = {"workers": workers}
+    results = {}
+    for name, phase, _ in phases:
+        gc.collect()
+        if trace_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        counts = phase(rules, context)
+        seconds = time.perf_counter() - started
+        peak = None
+        if trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        results[name] = {"seconds": seconds, "peak_bytes": peak, "rss_kb": _peak_rss_kb(), "counts": counts}
+    return results
+
+
+def run_benchmarks(rule_names, selected=PHASE_NAMES, repeat=1, trace_memory=False, workers=1):
+    """
+    Замеры для наборов правил rule_names: из repeat прогонов берётся лучшее время.
+    С trace_memory пик памяти фаз берётся из отдельного прогона под tracemalloc —
+    под ним всё заметно медленнее, поэтому время этого прогона не учитывается.
+    Возвращает словарь, готовый для JSON.
+    """
+    # фазы на NumPy без numpy пропускаются
+    selected = [name for name in selected if name not in ("solve_numpy", "selfplay") or calc.np is not None]
+    phases = _with_dependencies(selected)
+    results = {}
+    for rule_name in rule_names:
+        rules = calc.RULESETS[rule_name]
+        best = {}
+        for _ in range(repeat):
+            for name, run in run_phases(rules, phases, workers=workers).items():
+                if name in best:
+                    run["seconds"] = min(best[name]["seconds"], run["seconds"])
+                best[name] = run
+        if trace_memory:
+            for name, run in run_phases(rules, phases, True, workers).items():
+                best[name]["peak_bytes"] = run["peak_bytes"]
+        results[rule_name] = {name: best[name] for name in selected}
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": calc.np is not None,
+        "repeat": repeat,
+        "tracemalloc": trace_memory,
+        "workers": workers,
+        "results": results,
+    }
+
+
+def compare_with_baseline(current, baseline, max_slowdown=None):
+    """
+    Строки сравнения с baseline и признак провала: фаза медленнее в max_slowdown раз
+    или разошлись счётчики (состояния, ходы, правила).
+    """
+    lines = []
+    failed = False
+    for rule_name, phases in current["results"].items():
+        old_phases = baseline.get("results", {}).get(rule_name, {})
+        for name, run in phases.items():
+            old = old_phases.get(name)
+            if old is None:
+                continue
+            ratio = run["seconds"] / old["seconds"] if old["seconds"] else float("inf")
+            mark = ""
+            if old["counts"] != run["counts"]:
+                mark = f"  счётчики: было {old['counts']}, стало {run['counts']}"
+                failed = True
+            elif max_slowdown is not None and ratio > max_slowdown:
+                mark = "  медленнее допустимого"
+                failed = True
+            lines.append(f"{rule_name:>14} {name:<16} {old['seconds']:8.3f} -> {run['seconds']:8.3f} с"
+                         f"  x{ratio:5.2f}{mark}")
+    return lines, failed
+
+
+def print_results(report):
+    for rule_name, phases in report["results"].items():
+        print(f"\n[{rule_name}]")
+        for name, run in phases.items():
+            peak = "" if run["peak_bytes"] is None else f"  пик {run['peak_bytes'] / 2 ** 20:7.1f} МБ"
+            counts = "  ".join(f"{key} {value}" for key, value in run["counts"].items())
+            print(f"  {name:<16} {run['seconds']:8.3f} с  RSS {run['rss_kb'] / 1024:7.1f} МБ{peak}  {counts}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замеры фаз calc.py.")
+    parser.add_argument("--rules", nargs="+", choices=sorted(calc.RULESETS), default=["classic", "original"],
+                        help="наборы правил (по умолчанию classic и original)")
+    parser.add_argument("--phases", nargs="+", choices=PHASE_NAMES, default=list(PHASE_NAMES),
+                        help="какие фазы мерить (нужные им фазы выполняются, но не выводятся)")
+    parser.add_argument("--repeat", type=int, default=1, help="прогонов на набор правил (берётся лучшее время)")
+    parser.add_argument("--tracemalloc", action="store_true",
+                        help="мерить пиковую память фаз через tracemalloc (заметно медленнее)")
+    parser.add_argument("--workers", type=int, default=1, metavar="N",
+                        help="процессов для построения графа переходов (фаза transitions)")
+    parser.add_argument("-o", "--output", metavar="PATH", help="записать результаты в JSON")
+    parser.add_argument("--baseline", metavar="PATH", help="сравнить с сохранёнными результатами")
+    parser.add_argument("--max-slowdown", type=float, metavar="X",
+                        help="с --baseline: код 1, если фаза медленнее в X раз")
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.rules, args.phases, args.repeat, args.tracemalloc, args.workers)
+    print_results(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as out:
+            json.dump(report, out, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as source:
+            lines, failed = compare_with_baseline(report, json.load(source), args.max_slowdown)
+        print("\nСравнение с", args.baseline)
+        print("\n".join(lines))
+        return 1 if failed else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,31 @@
-from collections import deque
-from itertools import combinations
+import argparse
+import base64
+import cProfile
+import hashlib
+import io
+import json
+import mmap
+import os
+import pstats
+import struct
+import sys
+import time
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
+from itertools import accumulate, chain, combinations, repeat, zip_longest
+from math import comb
+from multiprocessing.shared_memory import SharedMemory
+from operator import add, and_, eq, lshift, lt, or_, rshift, sub
+
+try:
+    import numpy as np
+except ImportError:  # numpy нужен только для движка "numpy"
+    np = None
 
 # ========================
 #  Константы + линии
@@ -17,11 +43,38 @@ cell_to_label = {
     B1: "B1", B2: "B2", B3: "B3",
     C1: "C1", C2: "C2", C3: "C3"
 }
+label_to_cell = {label: cell for cell, label in cell_to_label.items()}
 
 cells = [A1, A2, A3,
          B1, B2, B3,
          C1, C2, C3]
 
+# Битборд: клетка cells[pos] соответствует биту 1 << pos
+CELL_COUNT = len(cells)
+STONE_COUNT = 3
+
+cell_to_pos = {cell: pos for pos, cell in enumerate(cells)}
+cell_to_bit = {cell: 1 << pos for pos, cell in enumerate(cells)}
+
+
+def cells_to_mask(stones):
+    mask = 0
+    for cell in stones:
+        mask |= cell_to_bit[cell]
+    return mask
+
+
+def mask_to_cells(mask):
+    return tuple(cell for pos, cell in enumerate(cells) if mask >> pos & 1)
+
+
+def iter_bits(mask):
+    """Номера установленных битов маски по возрастанию."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
 winning_lines = [
     [A1, A2, A3],
     [B1, B2, B3],
@@ -49,19 +102,37 @@ RED_FIRST_MOVE_POSITIONS = {
     )
 }
 
-def has_valid_mill(player, color):
-    """Проверяет, что у игрока есть настоящая (не стартовая) линия."""
-    s = set(player)
-    base = any(all(x in s for x in line) for line in winning_lines)
-    if not base:
-        return False
+# Маски линий и таблица мельниц по маске камней:
+# бит RED_MILL / BLACK_MILL — у красных / чёрных есть настоящая (не стартовая) линия.
+MILL_MASKS = [cells_to_mask(line) for line in winning_lines]
+RED_FORBIDDEN_MASK = cells_to_mask(RED_FORBIDDEN)
+BLACK_FORBIDDEN_MASK = cells_to_mask(BLACK_FORBIDDEN)
+
+RED_MILL = 1
+BLACK_MILL = 2
+
+
+def build_mill_flags(mill_masks, red_start_mask, black_start_mask, cell_count=CELL_COUNT, masks=None):
+    """
+    Таблица флагов RED_MILL / BLACK_MILL по маске камней.
+    masks — какие маски заполнять (по умолчанию все 2**cell_count).
+    """
+    flags = bytearray(1 << cell_count)
+    for mask in range(1 << cell_count) if masks is None else masks:
+        if any(mask & line == line for line in mill_masks):
+            if mask != red_start_mask:
+                flags[mask] |= RED_MILL
+            if mask != black_start_mask:
+                flags[mask] |= BLACK_MILL
+    return flags
+
+
+MILL_FLAGS = build_mill_flags(MILL_MASKS, RED_FORBIDDEN_MASK, BLACK_FORBIDDEN_MASK)
 
-    if color == COLOR_RED and tuple(player) == RED_FORBIDDEN:
-        return False
-    if color == COLOR_BLACK and tuple(player) == BLACK_FORBIDDEN:
-        return False
 
-    return True
+def has_valid_mill(player, color):
+    """Проверяет, что у игрока есть настоящая (не стартовая) линия."""
+    return bool(MILL_FLAGS[cells_to_mask(player)] & (RED_MILL if color == COLOR_RED else BLACK_MILL))
 
 
 # ========================
@@ -69,20 +140,20 @@ def has_valid_mill(player, color):
 # ========================
 
 # Original
-# neighbors = {
-#     A1: [A2, B1, B2],
-#     A2: [A1, A3, B1, B2, B3],
-#     A3: [A2, B2, B3],
-#     B1: [A1, A2, B2, C1, C2],
-#     B2: [A1, A2, A3, B1, B3, C1, C2, C3],
-#     B3: [A2, A3, B2, C2, C3],
-#     C1: [B1, B2, C2],
-#     C2: [B1, B2, B3, C1, C3],
-#     C3: [B2, B3, C2]
-# }
+ORIGINAL_NEIGHBORS = {
+    A1: [A2, B1, B2],
+    A2: [A1, A3, B1, B2, B3],
+    A3: [A2, B2, B3],
+    B1: [A1, A2, B2, C1, C2],
+    B2: [A1, A2, A3, B1, B3, C1, C2, C3],
+    B3: [A2, A3, B2, C2, C3],
+    C1: [B1, B2, C2],
+    C2: [B1, B2, B3, C1, C3],
+    C3: [B2, B3, C2]
+}
 
 # Classic
-neighbors = {
+CLASSIC_NEIGHBORS = {
     A1: [A2, B1, B2],
     A2: [A1, A3, B2],
     A3: [A2, B2, B3],
@@ -94,21 +165,30 @@ neighbors = {
     C3: [B2, B3, C2]
 }
 
+# Соседство по умолчанию (см. CLASSIC_RULES)
+neighbors = CLASSIC_NEIGHBORS
+
+# Соседи каждой клетки в виде маски (индекс — номер бита клетки)
+NEIGHBOR_MASKS = [cells_to_mask(neighbors[cell]) for cell in cells]
+
 
 # =====================================
 #  Формирование словаря (с фильтрацией)
 # =====================================
 
-def generate_forbidden_options(stones, allow_none=False):
+def generate_forbidden_options(stones, allow_none=False, adjacency=None):
     """
     Возвращает список допустимых запрещённых ходов для данного набора камней.
     None (отсутствие запрета) включается, если allow_none=True.
+    adjacency — таблица соседей (по умолчанию neighbors).
     """
+    if adjacency is None:
+        adjacency = neighbors
     options = [None] if allow_none else []
     seen = set()
     stone_set = set(stones)
     for cur in stones:
-        for prev in neighbors[cur]:
+        for prev in adjacency[cur]:
             if prev in stone_set:
                 continue
             pair = (cur, prev)
@@ -118,569 +198,5048 @@ def generate_forbidden_options(stones, allow_none=False):
     return options
 
 
-position_to_index = {}
-index_to_position = []
+# ========================
+#  Доска
+# ========================
+
+# Индексы состояний вычисляются арифметически, без словаря:
+#   индекс = смещение пары (красные, чёрные) + номер запрета красных * ширина + номер запрета чёрных.
+# Наборы камней ранжируются как сочетания в лексикографическом порядке, поэтому
+# нумерация совпадает с порядком перебора combinations(cells, 3).
+
+class Board:
+    """
+    Геометрия доски: клетки 1..n (клетка cells[pos] — бит 1 << pos) и их метки.
+    Для прямоугольной сетки rows × cols метки идут по рядам (A1, A2, …, B1, …)
+    и известны зеркала доски (mirror_cells / flip_cells).
+
+    Состояние упаковывается в одно целое (pack_state): маски красных и чёрных
+    и коды запретов; код запрета — 0 (запрета нет) или 1 + pos(cur) * n + pos(prev).
+    """
 
-idx = 0
+    def __init__(self, labels, rows=None, cols=None):
+        self.labels = tuple(labels)
+        self.cells = tuple(range(1, len(self.labels) + 1))
+        self.cell_count = len(self.cells)
+        self.rows = rows
+        self.cols = cols
+        self.cell_to_label = dict(zip(self.cells, self.labels))
+        self.label_to_cell = {label: cell for cell, label in self.cell_to_label.items()}
+        self.cell_to_pos = {cell: pos for pos, cell in enumerate(self.cells)}
+        self.cell_to_bit = {cell: 1 << pos for pos, cell in enumerate(self.cells)}
+        self.forbidden_code_limit = self.cell_count * self.cell_count + 1
+        self.forbidden_code_bits = (self.forbidden_code_limit - 1).bit_length()
+        if 2 * (self.cell_count + self.forbidden_code_bits) > 64:
+            raise ValueError(f"состояние доски из {self.cell_count} клеток не упаковывается в 64 бита")
+
+    def definition(self):
+        return (self.labels, self.rows, self.cols)
+
+    def cells_to_mask(self, stones):
+        mask = 0
+        for cell in stones:
+            mask |= self.cell_to_bit[cell]
+        return mask
+
+    def mask_to_cells(self, mask):
+        return tuple(cell for pos, cell in enumerate(self.cells) if mask >> pos & 1)
+
+    def forbidden_to_code(self, forbidden):
+        if forbidden is None:
+            return 0
+        return 1 + self.cell_to_pos[forbidden[0]] * self.cell_count + self.cell_to_pos[forbidden[1]]
+
+    def code_to_forbidden(self, code):
+        if not code:
+            return None
+        cur, prev = divmod(code - 1, self.cell_count)
+        return (self.cells[cur], self.cells[prev])
+
+    def pack_state(self, red_mask, black_mask, red_code, black_code):
+        """Упаковывает состояние в одно целое: маски камней и коды запретов."""
+        n = self.cell_count
+        return red_mask | black_mask << n | red_code << (2 * n) | black_code << (2 * n + self.forbidden_code_bits)
+
+    def unpack_state(self, packed):
+        """Обратное к pack_state: (red_mask, black_mask, red_code, black_code)."""
+        n = self.cell_count
+        cell_mask = (1 << n) - 1
+        code_mask = (1 << self.forbidden_code_bits) - 1
+        return (packed & cell_mask,
+                packed >> n & cell_mask,
+                packed >> (2 * n) & code_mask,
+                packed >> (2 * n + self.forbidden_code_bits) & code_mask)
+
+    def _grid_map(self, transform):
+        if self.rows is None:
+            return None
+        return {cell: self.cells[transform(*divmod(pos, self.cols))] for pos, cell in enumerate(self.cells)}
+
+    def mirror_cells(self):
+        """Зеркало слева направо (None, если доска не сетка)."""
+        return self._grid_map(lambda row, col: row * self.cols + self.cols - 1 - col)
+
+    def flip_cells(self):
+        """Переворот сверху вниз (None, если доска не сетка)."""
+        return self._grid_map(lambda row, col: (self.rows - 1 - row) * self.cols + col)
+
+
+def grid_board(rows, cols):
+    """Прямоугольная сетка: ряды A, B, C, …, столбцы 1, 2, 3, …"""
+    return Board([f"{chr(ord('A') + row)}{col + 1}" for row in range(rows) for col in range(cols)], rows, cols)
+
+
+DEFAULT_BOARD = grid_board(3, 3)
+
+# Функции и константы модуля относятся к доске 3×3 по умолчанию
+FORBIDDEN_CODE_LIMIT = DEFAULT_BOARD.forbidden_code_limit
+FORBIDDEN_CODE_BITS = DEFAULT_BOARD.forbidden_code_bits
+forbidden_to_code = DEFAULT_BOARD.forbidden_to_code
+code_to_forbidden = DEFAULT_BOARD.code_to_forbidden
+pack_state = DEFAULT_BOARD.pack_state
+unpack_state = DEFAULT_BOARD.unpack_state
+
+
+def combination_rank(mask, n=CELL_COUNT, k=STONE_COUNT):
+    """Лексикографический номер k-сочетания (заданного маской) среди всех сочетаний из n."""
+    rank = 0
+    start = 0
+    i = 0
+    for pos in range(n):
+        if not mask >> pos & 1:
+            continue
+        for skipped in range(start, pos):
+            rank += comb(n - 1 - skipped, k - 1 - i)
+        start = pos + 1
+        i += 1
+    return rank
 
-for red in combinations(cells, 3):
-    red_set = set(red)
-    remaining = set(cells) - red_set
 
-    for black in combinations(remaining, 3):
-        black_set = set(black)
+class _RankTable(dict):
+    """Ранги наборов для больших досок: словарь вместо массива на 2**n элементов."""
 
-        r = tuple(sorted(red_set))
-        b = tuple(sorted(black_set))
+    def __missing__(self, mask):
+        return -1
 
-        red_m   = has_valid_mill(r, "R")
-        black_m = has_valid_mill(b, "B")
 
-        # impossible: оба выиграли
-        if red_m and black_m:
-            continue
+class StoneSets:
+    """
+    Все наборы из stones камней на доске из cell_count клеток в лексикографическом
+    порядке (как combinations): masks[ранг] и обратная таблица rank[маска] (-1 — не набор).
+    """
 
-        allow_red_none = (r == RED_FORBIDDEN and b == BLACK_FORBIDDEN)
-        allow_black_none = (b == BLACK_FORBIDDEN and (r == RED_FORBIDDEN or r in RED_FIRST_MOVE_POSITIONS))
+    def __init__(self, cell_count, stones):
+        self.cell_count = cell_count
+        self.stones = stones
+        self.masks = [sum(1 << pos for pos in combo) for combo in combinations(range(cell_count), stones)]
+        self.count = len(self.masks)
+        self.pair_count = self.count * self.count
+        self.rank = array("i", [-1]) * (1 << cell_count) if cell_count <= 16 else _RankTable()
+        for rank, mask in enumerate(self.masks):
+            self.rank[mask] = rank
 
-        red_forbidden_options = generate_forbidden_options(r, allow_none=allow_red_none)
-        black_forbidden_options = generate_forbidden_options(b, allow_none=allow_black_none)
 
-        for red_forbidden in red_forbidden_options:
-            for black_forbidden in black_forbidden_options:
-                state = (r, b, red_forbidden, black_forbidden)
-                position_to_index[state] = idx
-                index_to_position.append(state)
-                idx += 1
+_stone_sets_cache = {}
 
 
-def lookup_state_index(red_cells, black_cells, red_forbidden=None, black_forbidden=None):
-    r = tuple(sorted(red_cells))
-    b = tuple(sorted(black_cells))
-    state = (r, b, red_forbidden, black_forbidden)
-    return position_to_index.get(state)
+def stone_sets(cell_count, stones):
+    """StoneSets для (cell_count, stones); таблицы общие для всех наборов правил."""
+    key = (cell_count, stones)
+    if key not in _stone_sets_cache:
+        _stone_sets_cache[key] = StoneSets(cell_count, stones)
+    return _stone_sets_cache[key]
 
-print("Размер словаря после фильтрации:", len(position_to_index))
 
+_DEFAULT_SETS = stone_sets(CELL_COUNT, STONE_COUNT)
+COMBINATION_MASKS = _DEFAULT_SETS.masks
+COMBINATION_COUNT = _DEFAULT_SETS.count
+COMBINATION_RANK = _DEFAULT_SETS.rank
+PAIR_COUNT = _DEFAULT_SETS.pair_count
 
 
 # ========================
-#  Генерация ходов
+#  Наборы правил
 # ========================
 
-def generate_moves_for_color(r, b, red_forbidden, black_forbidden, color, position_to_index):
+class Ruleset:
     """
-    r, b — кортежи позиций камней красных и чёрных (например (1,4,7))
-    color — COLOR_RED или COLOR_BLACK
-    Возвращает список индексов позиций, достижимых одним ходом.
+    Правила одним значением: доска (Board), соседство клеток, выигрышные линии,
+    стартовые ряды (не считаются мельницей; их размер — число камней у каждого),
+    позиции красных после первого хода (у чёрных в них ещё нет запрета) и правило
+    запрета отмены хода (no_undo). Без запрета отмены запреты не записываются
+    вовсе: у всех состояний код запрета 0.
+
+    Производные таблицы (маски соседей, флаги мельниц, наборы камней) строятся
+    в конструкторе. Значения сравниваются и хэшируются по определению правил,
+    а при передаче в другой процесс пересылается только определение.
     """
 
-    moves = []
+    def __init__(self, name, neighbors, winning_lines, red_start, black_start,
+                 first_move_positions=None, no_undo=True, board=None):
+        """first_move_positions=None — все расстановки красных после одного хода со старта."""
+        self.name = name
+        self.board = DEFAULT_BOARD if board is None else board
+        self.neighbors = {cell: tuple(sorted(neighbors[cell])) for cell in self.board.cells}
+        self.winning_lines = tuple(sorted(tuple(sorted(line)) for line in winning_lines))
+        self.red_start = tuple(sorted(red_start))
+        self.black_start = tuple(sorted(black_start))
+        if len(self.red_start) != len(self.black_start):
+            raise ValueError("у красных и чёрных должно быть поровну камней")
+        self.stones = len(self.red_start)
+        if first_move_positions is None:
+            first_move_positions = self._first_moves()
+        self.first_move_positions = frozenset(tuple(sorted(position)) for position in first_move_positions)
+        self.no_undo = bool(no_undo)
+
+        board = self.board
+        self.sets = stone_sets(board.cell_count, self.stones)
+        self.neighbor_masks = [board.cells_to_mask(self.neighbors[cell]) for cell in board.cells]
+        self.red_start_mask = board.cells_to_mask(self.red_start)
+        self.black_start_mask = board.cells_to_mask(self.black_start)
+        self.mill_flags = build_mill_flags([board.cells_to_mask(line) for line in self.winning_lines],
+                                           self.red_start_mask, self.black_start_mask, board.cell_count,
+                                           self.sets.masks)
+
+    def _first_moves(self):
+        occupied = set(self.red_start) | set(self.black_start)
+        return {tuple(sorted(set(self.red_start) - {src} | {dst}))
+                for src in self.red_start for dst in self.neighbors[src] if dst not in occupied}
+
+    def definition(self):
+        """Всё, что влияет на набор состояний, переходы и статусы (имя не входит)."""
+        return (
+            self.board.definition(),
+            self.stones,
+            tuple((cell, self.neighbors[cell]) for cell in self.board.cells),
+            self.winning_lines,
+            self.red_start,
+            self.black_start,
+            tuple(sorted(self.first_move_positions)),
+            self.no_undo,
+        )
+
+    def fingerprint(self):
+        """SHA-256 от definition(): любая правка правил меняет хэш."""
+        return hashlib.sha256(repr(self.definition()).encode("utf-8")).digest()
+
+    def replace(self, **changes):
+        """Копия правил с заменёнными полями, например rules.replace(no_undo=False)."""
+        fields = dict(name=self.name, neighbors=self.neighbors, winning_lines=self.winning_lines,
+                      red_start=self.red_start, black_start=self.black_start,
+                      first_move_positions=self.first_move_positions, no_undo=self.no_undo, board=self.board)
+        fields.update(changes)
+        return Ruleset(**fields)
+
+    def __eq__(self, other):
+        return isinstance(other, Ruleset) and self.definition() == other.definition()
+
+    def __hash__(self):
+        return hash(self.definition())
+
+    def __reduce__(self):
+        return (Ruleset, (self.name, self.neighbors, self.winning_lines, self.red_start, self.black_start,
+                          self.first_move_positions, self.no_undo, self.board))
+
+    def __repr__(self):
+        return f"Ruleset({self.name!r})"
+
+    def forbidden_options(self, stones):
+        """Допустимые запреты набора камней (пусто, если правила запрета отмены нет)."""
+        if not self.no_undo:
+            return []
+        return generate_forbidden_options(stones, adjacency=self.neighbors)
+
+    def has_valid_mill(self, player, color):
+        return bool(self.mill_flags[self.board.cells_to_mask(player)]
+                    & (RED_MILL if color == COLOR_RED else BLACK_MILL))
+
+
+def grid_rules(rows, cols, stones=None, line_length=3, king_moves=False, no_undo=True, name=None):
+    """
+    Правила на сетке rows × cols: линии — все отрезки из line_length клеток по рядам,
+    столбцам и диагоналям; ходят на соседнюю клетку вдоль линии (как в Classic)
+    или на любую из восьми соседних (king_moves, как в Original). Красные стоят
+    в первых stones клетках верхнего ряда, чёрные — в последних stones клетках
+    нижнего (по умолчанию stones = cols). grid_rules(3, 3) совпадает с CLASSIC_RULES.
+    """
+    board = grid_board(rows, cols)
+    stones = cols if stones is None else stones
+
+    def cell(row, col):
+        return board.cells[row * cols + col]
+
+    lines = []
+    for row in range(rows):
+        for col in range(cols):
+            for d_row, d_col in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                end_row, end_col = row + d_row * (line_length - 1), col + d_col * (line_length - 1)
+                if 0 <= end_row < rows and 0 <= end_col < cols:
+                    lines.append([cell(row + d_row * i, col + d_col * i) for i in range(line_length)])
+
+    adjacency = {cell_id: set() for cell_id in board.cells}
+    if king_moves:
+        for row in range(rows):
+            for col in range(cols):
+                for d_row in (-1, 0, 1):
+                    for d_col in (-1, 0, 1):
+                        if (d_row or d_col) and 0 <= row + d_row < rows and 0 <= col + d_col < cols:
+                            adjacency[cell(row, col)].add(cell(row + d_row, col + d_col))
+    else:
+        for line in lines:
+            for first, second in zip(line, line[1:]):
+                adjacency[first].add(second)
+                adjacency[second].add(first)
+
+    if name is None:
+        name = f"grid-{rows}x{cols}-{stones}" + ("-king" if king_moves else "") + ("" if no_undo else "-free")
+    return Ruleset(name, adjacency, lines, board.cells[:stones], board.cells[-stones:],
+                   no_undo=no_undo, board=board)
+
+
+CLASSIC_RULES = Ruleset("classic", CLASSIC_NEIGHBORS, winning_lines, RED_FORBIDDEN, BLACK_FORBIDDEN,
+                        RED_FIRST_MOVE_POSITIONS)
+ORIGINAL_RULES = CLASSIC_RULES.replace(name="original", neighbors=ORIGINAL_NEIGHBORS)
+
+# Именованные наборы правил (для --rules и пакетного режима)
+RULESETS = {
+    "classic": CLASSIC_RULES,
+    "original": ORIGINAL_RULES,
+    "classic-free": CLASSIC_RULES.replace(name="classic-free", no_undo=False),
+    "original-free": ORIGINAL_RULES.replace(name="original-free", no_undo=False),
+}
 
-    red_set = set(r)
-    black_set = set(b)
+DEFAULT_RULES = CLASSIC_RULES
 
-    if color == COLOR_RED:
-        my_stones = red_set
-        opp_stones = black_set
-        forbidden_move = red_forbidden
-    else:
-        my_stones = black_set
-        opp_stones = red_set
-        forbidden_move = black_forbidden
 
-    for src in my_stones:
-        for dst in neighbors[src]:
+# Флаги пары (красные, чёрные): «запрета может не быть»
+PAIR_RED_NONE = 1
+PAIR_BLACK_NONE = 2
 
-            # если занято — пропустить
-            if dst in red_set or dst in black_set:
-                continue
 
-            # запрещаем немедленно отменять предыдущий ход
-            if forbidden_move and src == forbidden_move[0] and dst == forbidden_move[1]:
-                continue
+def expand_pair_steps(steps, my_code, opp_code, opp_slot):
+    """
+    Индексы позиций после хода: steps — из StateIndex.pair_steps, my_code — запрет ходящего,
+    opp_code/opp_slot — запрет соперника и его номер в наборе соперника.
+    """
+    if opp_code:
+        return [base + (opp_slot + shift) * mult
+                for undo_code, base, mult, shift, _ in steps if undo_code != my_code]
+    return [base for undo_code, base, _, _, none_ok in steps if none_ok and undo_code != my_code]
 
-            # перемещаем src → dst
-            new_my = set(my_stones)
-            new_my.remove(src)
-            new_my.add(dst)
 
-            # формируем новую позицию
-            if color == COLOR_RED:
-                new_r = tuple(sorted(new_my))
-                new_b = tuple(sorted(opp_stones))
-                new_red_forbidden = (dst, src)
-                new_black_forbidden = black_forbidden
-            else:
-                new_r = tuple(sorted(opp_stones))
-                new_b = tuple(sorted(new_my))
-                new_red_forbidden = red_forbidden
-                new_black_forbidden = (dst, src)
+# Таблицы ходов зависят только от соседства и правила запрета отмены —
+# наборы правил с разными линиями или стартовыми рядами делят их между собой.
+_move_tables_cache = {}
+
+
+def build_move_tables(rules):
+    """
+    Возвращает (forbidden_options, forbidden_slot, step_table) для правил rules:
+      - forbidden_options / forbidden_slot — для каждого набора камней (по рангу) коды
+        допустимых запретов (в порядке generate_forbidden_options) и обратная таблица
+        «ранг * forbidden_code_limit + код -> номер»;
+      - step_table — ходы набора камней (по рангу): (код хода src→dst, бит dst, ранг нового
+        набора, номер запрета dst→src в новом наборе; -1 — запрет не записывается).
+    Занятость клеток соперником и запрет отмены проверяются при генерации.
+    """
+    board = rules.board
+    sets = rules.sets
+    key = (board.definition(), sets.stones, tuple(rules.neighbor_masks), rules.no_undo)
+    if key in _move_tables_cache:
+        return _move_tables_cache[key]
+
+    n = board.cell_count
+    limit = board.forbidden_code_limit
+    forbidden_options = []
+    forbidden_slot = array("h", [-1]) * (sets.count * limit)
+    for rank, mask in enumerate(sets.masks):
+        codes = tuple(board.forbidden_to_code(pair) for pair in rules.forbidden_options(board.mask_to_cells(mask)))
+        forbidden_options.append(codes)
+        for slot, code in enumerate(codes):
+            forbidden_slot[rank * limit + code] = slot
+
+    step_table = []
+    for mask in sets.masks:
+        steps = []
+        for src in iter_bits(mask):
+            for dst in iter_bits(rules.neighbor_masks[src] & ~mask):
+                new_rank = sets.rank[mask ^ (1 << src) ^ (1 << dst)]
+                new_slot = forbidden_slot[new_rank * limit + 1 + dst * n + src]
+                if new_slot < 0 and rules.no_undo:
+                    continue
+                steps.append((1 + src * n + dst, 1 << dst, new_rank, new_slot))
+        step_table.append(tuple(steps))
+
+    _move_tables_cache[key] = forbidden_options, forbidden_slot, step_table
+    return _move_tables_cache[key]
+
+
+class StateIndex:
+    """
+    Перечень состояний с арифметической индексацией и таблицами ходов.
+
+    Таблицы:
+      - board / sets — доска и наборы камней правил (Board, StoneSets);
+      - forbidden_options / forbidden_slot / step_table — см. build_move_tables;
+      - pair_offset / pair_black_width / pair_flags — для каждой пары (красные, чёрные)
+        смещение первого состояния, число вариантов запрета чёрных (0 — пара отфильтрована)
+        и флаги PAIR_RED_NONE / PAIR_BLACK_NONE;
+      - pair_steps — ходы каждого цвета из пары, см. build_pair_steps;
+      - packed_states — все состояния в порядке индексов (см. Board.pack_state);
+        None, если индекс построен без списка состояний (keep_states=False).
+
+    Сами состояния перебираются потоком по частям (iter_partitions): без взятий число
+    камней не меняется, и состояния делятся по расстановке красных. Часть занимает
+    непрерывный отрезок индексов, так что в памяти нужна только одна часть.
+    """
+
+    def __init__(self, rules=None, tables=None, keep_states=True):
+        """
+        rules — набор правил (Ruleset), по умолчанию DEFAULT_RULES.
+        tables — готовые (pair_offset, pair_black_width, pair_flags, packed_states),
+        например из файла таблицы; тогда перебор состояний не выполняется.
+        keep_states=False — не хранить packed_states: состояния восстанавливаются
+        арифметически (unrank_state) или перебираются потоком (iter_packed_states).
+        """
+        self.rules = DEFAULT_RULES if rules is None else rules
+        self.board = self.rules.board
+        self.sets = self.rules.sets
+        self.pair_count = self.sets.pair_count
+        self.forbidden_options, self.forbidden_slot, self.step_table = build_move_tables(self.rules)
+
+        # отброшенные состояния «мельница у обоих» (пар и состояний); из файла таблицы — неизвестно
+        self.filtered_pairs = None
+        self.filtered_states = None
+        if tables is None:
+            self.pair_offset = array("q", [0]) * (self.pair_count + 1)
+            self.pair_black_width = array("h", [0]) * self.pair_count
+            self.pair_flags = array("b", [0]) * self.pair_count
+            self._build_pair_tables()
+            self.packed_states = None
+            if keep_states:
+                packed_states = array("Q")
+                for _, _, part in self.iter_partitions():
+                    packed_states.extend(part)
+                self.packed_states = packed_states
+        else:
+            self.pair_offset, self.pair_black_width, self.pair_flags, self.packed_states = tables
+
+        self._pair_steps = None
+        self._step_cache = {}
+
+    def __len__(self):
+        return self.pair_offset[-1]
+
+    @property
+    def pair_steps(self):
+        if self._pair_steps is None:
+            pair_steps = {COLOR_RED: [()] * self.pair_count, COLOR_BLACK: [()] * self.pair_count}
+            for pair in range(self.pair_count):
+                if self.pair_black_width[pair]:
+                    pair_steps[COLOR_RED][pair] = self.build_pair_steps(pair, COLOR_RED)
+                    pair_steps[COLOR_BLACK][pair] = self.build_pair_steps(pair, COLOR_BLACK)
+            self._pair_steps = pair_steps
+        return self._pair_steps
+
+    def steps_for(self, pair, color):
+        """
+        Ходы цвета color из пары (см. build_pair_steps). Пока общая таблица pair_steps
+        не построена, ходы строятся по одной паре и кэшируются: поиску по отдельным
+        позициям не нужен проход по всем парам.
+        """
+        if self._pair_steps is not None:
+            return self._pair_steps[color][pair]
+        key = pair << 1 | (color == COLOR_BLACK)
+        steps = self._step_cache.get(key)
+        if steps is None:
+            steps = self.build_pair_steps(pair, color) if self.pair_black_width[pair] else ()
+            self._step_cache[key] = steps
+        return steps
+
+    def _build_pair_tables(self):
+        pair_offset = self.pair_offset
+        rules = self.rules
+        mill_flags = rules.mill_flags
+        masks = self.sets.masks
+        count = self.sets.count
+        self.filtered_pairs = self.filtered_states = 0
+
+        for red_rank, red_mask in enumerate(masks):
+            r = self.board.mask_to_cells(red_mask)
+            red_m = mill_flags[red_mask] & RED_MILL
+
+            for black_rank, black_mask in enumerate(masks):
+                pair = red_rank * count + black_rank
+                pair_offset[pair + 1] = pair_offset[pair]
+
+                if red_mask & black_mask:
+                    continue
 
-            pos = (new_r, new_b, new_red_forbidden, new_black_forbidden)
+                # без правила запрета отмены запретов нет ни у кого
+                red_start = red_mask == rules.red_start_mask
+                black_start = black_mask == rules.black_start_mask
+                allow_red_none = not rules.no_undo or (red_start and black_start)
+                allow_black_none = not rules.no_undo or (
+                    black_start and (red_start or r in rules.first_move_positions))
+
+                red_width = len(self.forbidden_options[red_rank]) + (1 if allow_red_none else 0)
+                black_width = len(self.forbidden_options[black_rank]) + (1 if allow_black_none else 0)
+                if not red_width or not black_width:
+                    continue
 
-            # позиция должна существовать в словаре
-            idx = position_to_index.get(pos)
-            if idx is not None:
-                moves.append(idx)
+                # impossible: оба выиграли
+                if red_m and mill_flags[black_mask] & BLACK_MILL:
+                    self.filtered_pairs += 1
+                    self.filtered_states += red_width * black_width
+                    continue
 
-    return moves
+                self.pair_black_width[pair] = black_width
+                self.pair_flags[pair] = ((PAIR_RED_NONE if allow_red_none else 0)
+                                         | (PAIR_BLACK_NONE if allow_black_none else 0))
+                pair_offset[pair + 1] += red_width * black_width
+
+    def iter_partitions(self):
+        """
+        Поток частей: (ранг набора красных, индекс первого состояния, массив упакованных
+        состояний части). Пустые части пропускаются.
+        """
+        count = self.sets.count
+        masks = self.sets.masks
+        pack_state = self.board.pack_state
+        for red_rank in range(count):
+            first_pair = red_rank * count
+            start = self.pair_offset[first_pair]
+            if self.packed_states is not None:
+                part = self.packed_states[start:self.pair_offset[first_pair + count]]
+            else:
+                part = array("Q")
+                red_mask = masks[red_rank]
+                for pair in range(first_pair, first_pair + count):
+                    if not self.pair_black_width[pair]:
+                        continue
+                    black_mask = masks[pair - first_pair]
+                    red_codes, black_codes = self.pair_codes(pair)
+                    part.extend([pack_state(red_mask, black_mask, red_code, black_code)
+                                 for red_code in red_codes for black_code in black_codes])
+            if len(part):
+                yield red_rank, start, part
+
+    def iter_packed_states(self):
+        """Все состояния в порядке индексов, даже если packed_states не хранится."""
+        for _, _, part in self.iter_partitions():
+            yield from part
+
+    def pair_codes(self, pair):
+        """Коды запретов красных и чёрных для состояний пары — в порядке индексов."""
+        red_rank, black_rank = divmod(pair, self.sets.count)
+        flags = self.pair_flags[pair]
+        red_codes = ((0,) if flags & PAIR_RED_NONE else ()) + self.forbidden_options[red_rank]
+        black_codes = ((0,) if flags & PAIR_BLACK_NONE else ()) + self.forbidden_options[black_rank]
+        return red_codes, black_codes
+
+    def rank_state(self, red_mask, black_mask, red_code, black_code):
+        """
+        Возвращает индекс состояния или None, если такого состояния нет.
+        """
+        rank = self.sets.rank
+        limit = self.board.forbidden_code_limit
+        red_rank = rank[red_mask]
+        black_rank = rank[black_mask]
+        if red_rank < 0 or black_rank < 0:
+            return None
+
+        pair = red_rank * self.sets.count + black_rank
+        width = self.pair_black_width[pair]
+        if not width:
+            return None
+        flags = self.pair_flags[pair]
+
+        if red_code:
+            red_slot = self.forbidden_slot[red_rank * limit + red_code]
+            if red_slot < 0:
+                return None
+            if flags & PAIR_RED_NONE:
+                red_slot += 1
+        elif flags & PAIR_RED_NONE:
+            red_slot = 0
+        else:
+            return None
+
+        if black_code:
+            black_slot = self.forbidden_slot[black_rank * limit + black_code]
+            if black_slot < 0:
+                return None
+            if flags & PAIR_BLACK_NONE:
+                black_slot += 1
+        elif flags & PAIR_BLACK_NONE:
+            black_slot = 0
+        else:
+            return None
+
+        return self.pair_offset[pair] + red_slot * width + black_slot
+
+    def unrank_state(self, index):
+        """
+        Восстанавливает упакованное состояние по индексу (обратное к rank_state).
+        """
+        pair = bisect_right(self.pair_offset, index) - 1
+        red_rank, black_rank = divmod(pair, self.sets.count)
+        red_codes, black_codes = self.pair_codes(pair)
+        red_slot, black_slot = divmod(index - self.pair_offset[pair], self.pair_black_width[pair])
+        return self.board.pack_state(self.sets.masks[red_rank], self.sets.masks[black_rank],
+                                     red_codes[red_slot], black_codes[black_slot])
+
+    def state_at(self, index):
+        """
+        Возвращает состояние в виде кортежа (r, b, red_forbidden, black_forbidden).
+        """
+        board = self.board
+        packed = self.packed_states[index] if self.packed_states is not None else self.unrank_state(index)
+        red_mask, black_mask, red_code, black_code = board.unpack_state(packed)
+        return (board.mask_to_cells(red_mask), board.mask_to_cells(black_mask),
+                board.code_to_forbidden(red_code), board.code_to_forbidden(black_code))
+
+    def lookup_state_index(self, red_cells, black_cells, red_forbidden=None, black_forbidden=None):
+        board = self.board
+        stones = self.sets.stones
+        if len(set(red_cells)) != stones or len(set(black_cells)) != stones:
+            return None
+        if any(cell not in board.cell_to_bit for cell in (*red_cells, *black_cells)):
+            return None
+        return self.rank_state(board.cells_to_mask(red_cells), board.cells_to_mask(black_cells),
+                               board.forbidden_to_code(red_forbidden), board.forbidden_to_code(black_forbidden))
+
+    # ========================
+    #  Генерация ходов
+    # ========================
+
+    def build_pair_steps(self, pair, color):
+        """
+        Ходы цвета color из всех состояний пары (красные, чёрные) в виде
+        (код хода src→dst, база, множитель, сдвиг, разрешён ли у цели пустой запрет соперника).
+        Индекс цели = база + (номер запрета соперника + сдвиг) * множитель,
+        а при отсутствии запрета у соперника — просто база.
+        """
+        count = self.sets.count
+        red_rank, black_rank = divmod(pair, count)
+        red_mask = self.sets.masks[red_rank]
+        black_mask = self.sets.masks[black_rank]
+        steps = []
+
+        if color == COLOR_RED:
+            for undo_code, dst_bit, new_rank, new_slot in self.step_table[red_rank]:
+                if dst_bit & black_mask:
+                    continue
+                target = new_rank * count + black_rank
+                width = self.pair_black_width[target]
+                if not width:
+                    continue
+                flags = self.pair_flags[target]
+                red_shift = 1 if flags & PAIR_RED_NONE else 0
+                black_shift = 1 if flags & PAIR_BLACK_NONE else 0
+                steps.append((undo_code, self.pair_offset[target] + (new_slot + red_shift) * width,
+                              1, black_shift, bool(black_shift)))
+        else:
+            for undo_code, dst_bit, new_rank, new_slot in self.step_table[black_rank]:
+                if dst_bit & red_mask:
+                    continue
+                target = red_rank * count + new_rank
+                width = self.pair_black_width[target]
+                if not width:
+                    continue
+                flags = self.pair_flags[target]
+                red_shift = 1 if flags & PAIR_RED_NONE else 0
+                black_shift = 1 if flags & PAIR_BLACK_NONE else 0
+                steps.append((undo_code, self.pair_offset[target] + new_slot + black_shift,
+                              width, red_shift, bool(red_shift)))
+
+        return tuple(steps)
+
+    def generate_moves_for_color(self, r, b, red_forbidden, black_forbidden, color):
+        """
+        r, b — кортежи позиций камней красных и чёрных (например (1,4,7))
+        color — COLOR_RED или COLOR_BLACK
+        Возвращает список индексов позиций, достижимых одним ходом.
+        """
+        board = self.board
+        return self.generate_moves_from_masks(board.cells_to_mask(r), board.cells_to_mask(b),
+                                              board.forbidden_to_code(red_forbidden),
+                                              board.forbidden_to_code(black_forbidden), color)
+
+    def generate_moves_from_masks(self, red_mask, black_mask, red_code, black_code, color):
+        """
+        То же, что generate_moves_for_color, но для упакованного представления:
+        только битовые операции и чтение таблиц, без промежуточных множеств и кортежей.
+        """
+        rank = self.sets.rank
+        limit = self.board.forbidden_code_limit
+        red_rank = rank[red_mask]
+        black_rank = rank[black_mask]
+        if red_rank < 0 or black_rank < 0:
+            return []
+        pair = red_rank * self.sets.count + black_rank
+
+        if color == COLOR_RED:
+            opp_slot = self.forbidden_slot[black_rank * limit + black_code] if black_code else 0
+            return expand_pair_steps(self.steps_for(pair, COLOR_RED), red_code, black_code, opp_slot)
+
+        opp_slot = self.forbidden_slot[red_rank * limit + red_code] if red_code else 0
+        return expand_pair_steps(self.steps_for(pair, COLOR_BLACK), black_code, red_code, opp_slot)
+
+    def generate_unmoves_from_masks(self, red_mask, black_mask, red_code, black_code, color):
+        """
+        Обратные ходы: индексы позиций, из которых ход цвета color ведёт в данную
+        (то же, что строка predecessor_map цвета color, но без хранимого графа).
+        С запретом отмены последний ход ходившего однозначен: запрет (cur, prev) пишется
+        ходом prev→cur, а без запрета у ходившего хода ещё не было. Без правила запрета
+        перебираются все его камни и свободные соседние клетки. Запрет ходившего до хода —
+        любой допустимый в той паре, кроме запрещающего сам этот ход; запрет соперника
+        ход не меняет.
+        """
+        n = self.board.cell_count
+        rank = self.sets.rank
+        count = self.sets.count
+        limit = self.board.forbidden_code_limit
+        occupied = red_mask | black_mask
+        if color == COLOR_RED:
+            own_mask, own_code, opp_mask, opp_code = red_mask, red_code, black_mask, black_code
+        else:
+            own_mask, own_code, opp_mask, opp_code = black_mask, black_code, red_mask, red_code
+        opp_rank = rank[opp_mask]
+        if opp_rank < 0:
+            return []
+
+        if self.rules.no_undo:
+            if not own_code:
+                return []
+            cur, prev = divmod(own_code - 1, n)
+            if occupied >> prev & 1:
+                return []
+            moves = ((cur, prev),)
+        else:
+            neighbor_masks = self.rules.neighbor_masks
+            moves = [(cur, prev) for cur in iter_bits(own_mask) for prev in iter_bits(neighbor_masks[cur] & ~occupied)]
+
+        sources = []
+        for cur, prev in moves:
+            own_rank = rank[own_mask ^ (1 << cur) ^ (1 << prev)]
+            pair = own_rank * count + opp_rank if color == COLOR_RED else opp_rank * count + own_rank
+            width = self.pair_black_width[pair]
+            if not width:
+                continue
+            flags = self.pair_flags[pair]
+            if color == COLOR_RED:
+                own_none, opp_none = flags & PAIR_RED_NONE, flags & PAIR_BLACK_NONE
+            else:
+                own_none, opp_none = flags & PAIR_BLACK_NONE, flags & PAIR_RED_NONE
+            if opp_code:
+                opp_slot = self.forbidden_slot[opp_rank * limit + opp_code] + (1 if opp_none else 0)
+            elif opp_none:
+                opp_slot = 0
+            else:
+                continue
+            # код хода prev→cur: с таким запретом ход был бы невозможен
+            move_code = 1 + prev * n + cur
+            codes = ((0,) if own_none else ()) + self.forbidden_options[own_rank]
+            base = self.pair_offset[pair]
+            if color == COLOR_RED:
+                sources.extend([base + own_slot * width + opp_slot
+                                for own_slot, code in enumerate(codes) if code != move_code])
+            else:
+                sources.extend([base + opp_slot * width + own_slot
+                                for own_slot, code in enumerate(codes) if code != move_code])
+        return sources
 
 
 # ==================================
 #  Переходы (вперёд и назад)
 # ==================================
 
-def build_transition_maps(index_to_position, position_to_index):
+class TransitionTable:
     """
-    Возвращает кортеж словарей:
-      - исходящие ходы для красных и чёрных;
-      - входящие ходы (откуда пришли) для красных и чёрных.
+    Граф переходов в формате CSR: ходы из позиции idx —
+    targets[offsets[idx]:offsets[idx + 1]].
     """
-    outgoing_red = {idx: [] for idx in range(len(index_to_position))}
-    outgoing_black = {idx: [] for idx in range(len(index_to_position))}
-    incoming_red = {idx: [] for idx in range(len(index_to_position))}
-    incoming_black = {idx: [] for idx in range(len(index_to_position))}
 
-    for idx, (r, b, red_forbidden, black_forbidden) in enumerate(index_to_position):
-        red_moves = generate_moves_for_color(r, b, red_forbidden, black_forbidden, COLOR_RED, position_to_index)
-        outgoing_red[idx] = red_moves
-        for next_idx in red_moves:
-            incoming_red[next_idx].append(idx)
+    __slots__ = ("offsets", "targets")
 
-        black_moves = generate_moves_for_color(r, b, red_forbidden, black_forbidden, COLOR_BLACK, position_to_index)
-        outgoing_black[idx] = black_moves
-        for next_idx in black_moves:
-            incoming_black[next_idx].append(idx)
+    def __init__(self, offsets, targets):
+        self.offsets = offsets
+        self.targets = targets
 
-    return outgoing_red, outgoing_black, incoming_red, incoming_black
+    def __len__(self):
+        return len(self.offsets) - 1
 
+    def __getitem__(self, idx):
+        return self.targets[self.offsets[idx]:self.offsets[idx + 1]]
 
-outgoing_red, outgoing_black, predecessor_map_red, predecessor_map_black = build_transition_maps(index_to_position, position_to_index)
+    def degree(self, idx):
+        return self.offsets[idx + 1] - self.offsets[idx]
 
+    def edge_count(self):
+        return len(self.targets)
 
-def forbidden_to_labels(forbidden):
-    if forbidden is None:
-        return None
-    return (cell_to_label[forbidden[0]], cell_to_label[forbidden[1]])
+    def inverted(self):
+        """
+        Строит обратный граф (откуда пришли) двумя проходами:
+        подсчёт входящих рёбер, затем раскладка по смещениям.
+        """
+        total = len(self)
+        offsets = self.offsets
+        targets = self.targets
 
+        counts = [0] * (total + 1)
+        for target in targets:
+            counts[target + 1] += 1
+        for idx in range(total):
+            counts[idx + 1] += counts[idx]
 
-def format_forbidden_field(forbidden_labels):
-    if forbidden_labels is None:
-        return "null"
-    return f"[{forbidden_labels[0]}, {forbidden_labels[1]}]"
+        cursor = counts[:]
+        sources = array(targets.typecode, bytes(len(targets) * targets.itemsize))
+        start = 0
+        for idx, end in enumerate(offsets[1:]):
+            for target in targets[start:end]:
+                sources[cursor[target]] = idx
+                cursor[target] += 1
+            start = end
 
+        counts = array("Q", counts)
+        return TransitionTable(counts, sources)
 
-def print_sources_for_position(index):
+
+def extend_pair_transitions(index, pair, red, black, red_base=0, black_base=0):
     """
-    Показывает, из каких позиций можно попасть в указанную (раздельно по цветам).
+    Дописывает ходы состояний пары (красные, чёрные) по порядку индексов: red и black —
+    пары массивов (смещения, цели) CSR, смещения считаются от red_base / black_base.
+    Ходы пары считаются один раз, для каждого состояния остаётся только подстановка
+    запретов (то же, что expand_pair_steps, но без вызова функции на каждое состояние).
     """
-    r, b, red_forbidden, black_forbidden = index_to_position[index]
-    r_labels = tuple(cell_to_label[c] for c in r)
-    b_labels = tuple(cell_to_label[c] for c in b)
-    red_forbidden_labels = forbidden_to_labels(red_forbidden)
-    black_forbidden_labels = forbidden_to_labels(black_forbidden)
+    red_offsets, red_targets = red
+    black_offsets, black_targets = black
+    flags = index.pair_flags[pair]
+    red_codes, black_codes = index.pair_codes(pair)
+    red_shift = 1 if flags & PAIR_RED_NONE else 0
+    black_shift = 1 if flags & PAIR_BLACK_NONE else 0
+    red_steps = index.steps_for(pair, COLOR_RED)
+    black_steps = index.steps_for(pair, COLOR_BLACK)
+
+    for red_slot, red_code in enumerate(red_codes, -red_shift):
+        if red_code:
+            black_moves = [(base + (red_slot + shift) * mult, undo_code)
+                           for undo_code, base, mult, shift, _ in black_steps]
+        else:
+            black_moves = [(base, undo_code)
+                           for undo_code, base, _, _, none_ok in black_steps if none_ok]
 
-    print(f"\nПозиция #{index}:  Red={r_labels}  Black={b_labels}")
-    print(f"   Запрет красных: {red_forbidden_labels}")
-    print(f"   Запрет чёрных: {black_forbidden_labels}")
+        for black_slot, black_code in enumerate(black_codes, -black_shift):
+            if black_code:
+                red_targets.extend([base + black_slot + shift
+                                    for undo_code, base, _, shift, _ in red_steps if undo_code != red_code])
+            else:
+                red_targets.extend([base
+                                    for undo_code, base, _, _, none_ok in red_steps
+                                    if none_ok and undo_code != red_code])
+            red_offsets.append(red_base + len(red_targets))
+            black_targets.extend([target for target, undo_code in black_moves if undo_code != black_code])
+            black_offsets.append(black_base + len(black_targets))
 
-    red_sources = predecessor_map_red.get(index, [])
-    black_sources = predecessor_map_black.get(index, [])
 
-    if not red_sources and not black_sources:
-        print("   В эту позицию нельзя попасть одним ходом")
-        return
+def count_moves(index):
+    """
+    Число ходов красных и чёрных из каждой позиции (два списка по индексам) —
+    ходы строятся по парам (extend_pair_transitions) и сразу выбрасываются.
+    """
+    red_degrees = []
+    black_degrees = []
+    for pair in range(index.pair_count):
+        if not index.pair_black_width[pair]:
+            continue
+        red = (array("Q", [0]), array("I"))
+        black = (array("Q", [0]), array("I"))
+        extend_pair_transitions(index, pair, red, black)
+        red_degrees.extend(map(sub, red[0][1:], red[0][:-1]))
+        black_degrees.extend(map(sub, black[0][1:], black[0][:-1]))
+    return red_degrees, black_degrees
 
-    if red_sources:
-        print(f"   <- Красные ({len(red_sources)}):")
-        for src_idx in red_sources:
-            sr = tuple(cell_to_label[c] for c in index_to_position[src_idx][0])
-            sb = tuple(cell_to_label[c] for c in index_to_position[src_idx][1])
-            print(f"      #{src_idx}: Red={sr} Black={sb}")
 
-    if black_sources:
-        print(f"   <- Чёрные ({len(black_sources)}):")
-        for src_idx in black_sources:
-            sr = tuple(cell_to_label[c] for c in index_to_position[src_idx][0])
-            sb = tuple(cell_to_label[c] for c in index_to_position[src_idx][1])
-            print(f"      #{src_idx}: Red={sr} Black={sb}")
+def build_generated_transitions(index):
+    """
+    То же, что build_transition_maps, но без хранимого графа: ходы (GeneratedMoves)
+    и предшественники (GeneratedUnmoves) генерируются на лету по индексу позиции.
+    """
+    return (GeneratedMoves(index, COLOR_RED), GeneratedMoves(index, COLOR_BLACK),
+            GeneratedUnmoves(index, COLOR_RED), GeneratedUnmoves(index, COLOR_BLACK))
 
 
-def print_all_positions():
+def build_transition_maps(index, workers=1):
+    """
+    Возвращает кортеж таблиц TransitionTable:
+      - исходящие ходы для красных и чёрных;
+      - входящие ходы (откуда пришли) для красных и чёрных.
+    workers > 1 — строить в пуле процессов (build_transition_maps_parallel).
     """
-    Полный вывод всех позиций и их индексов.
+    if workers > 1:
+        return build_transition_maps_parallel(index, workers)
+    index_type = "I" if len(index) < 1 << 32 else "Q"
+    red_offsets = array("Q", [0])
+    black_offsets = array("Q", [0])
+    red_targets = array(index_type)
+    black_targets = array(index_type)
+
+    # Состояния одной пары (красные, чёрные) идут подряд: запрет красных × запрет чёрных.
+    for pair in range(index.pair_count):
+        if index.pair_black_width[pair]:
+            extend_pair_transitions(index, pair, (red_offsets, red_targets), (black_offsets, black_targets))
+
+    outgoing_red = TransitionTable(red_offsets, red_targets)
+    outgoing_black = TransitionTable(black_offsets, black_targets)
+    return outgoing_red, outgoing_black, outgoing_red.inverted(), outgoing_black.inverted()
+
+
+# ----- Параллельное построение -----
+#
+# Части — отрезки пар (а значит, и индексов состояний) примерно поровну состояний.
+# Все массивы лежат в multiprocessing.shared_memory; процессы пишут в свои участки, родитель
+# получает обратно только счётчики. Проходы:
+#   1. число ходов каждой части — отсюда её смещение в массивах целей;
+#   2. цели и смещения CSR, а рёбра — в участок части ключами цель << shift | источник,
+#      отсортированными (так они сразу разложены по корзинам — отрезкам индексов целей);
+#   3. каждая корзина сливает свои доли из всех частей и строит свой кусок обратного графа.
+# Сортировка ключей ставит источники одной цели по возрастанию, поэтому результат
+# совпадает с TransitionTable.inverted() байт в байт.
+
+_worker_index = None
+_worker_memory = {}
+
+
+def _init_transition_worker(rules, tables):
+    global _worker_index
+    _worker_index = StateIndex(rules, tables=(*tables, None))
+
+
+@contextmanager
+def _shared_views(blocks):
+    """blocks — {ключ: (имя SharedMemory, typecode)}: представления массивов на время задачи."""
+    views = {}
+    try:
+        for key, (name, typecode) in blocks.items():
+            shm = _worker_memory.get(name)
+            if shm is None:
+                shm = _worker_memory[name] = SharedMemory(name=name)
+            views[key] = shm.buf.cast(typecode)
+        yield views
+    finally:
+        for view in views.values():
+            view.release()
+
+
+def _pair_edge_counts(index, pair):
+    """(ходов красных, ходов чёрных) из всех состояний пары — без построения списков целей."""
+    red_codes, black_codes = index.pair_codes(pair)
+    red_steps = index.steps_for(pair, COLOR_RED)
+    black_steps = index.steps_for(pair, COLOR_BLACK)
+    # ход, отменяющий предыдущий, запрещён; при пустом запрете соперника годятся не все ходы
+    red_any = Counter(step[0] for step in red_steps)
+    red_none = Counter(step[0] for step in red_steps if step[4])
+    black_any = Counter(step[0] for step in black_steps)
+    black_none = Counter(step[0] for step in black_steps if step[4])
+    red_with = sum(1 for code in red_codes if code)
+    black_with = sum(1 for code in black_codes if code)
+    red_total = sum(black_with * (len(red_steps) - red_any[code])
+                    + (len(black_codes) - black_with) * (sum(red_none.values()) - red_none[code])
+                    for code in red_codes)
+    black_total = sum(red_with * (len(black_steps) - black_any[code])
+                      + (len(red_codes) - red_with) * (sum(black_none.values()) - black_none[code])
+                      for code in black_codes)
+    return red_total, black_total
+
+
+def _shard_edge_counts(task):
+    pair_start, pair_end = task
+    index = _worker_index
+    red_total = black_total = 0
+    for pair in range(pair_start, pair_end):
+        if index.pair_black_width[pair]:
+            red_edges, black_edges = _pair_edge_counts(index, pair)
+            red_total += red_edges
+            black_total += black_edges
+    return red_total, black_total
+
+
+def _shard_targets(task):
     """
-    print("\nПолный список позиций:")
-    for idx, (r, b, red_forbidden, black_forbidden) in enumerate(index_to_position):
-        r_labels = tuple(cell_to_label[c] for c in r)
-        b_labels = tuple(cell_to_label[c] for c in b)
-        print(f"#{idx}: Red={r_labels}  Black={b_labels}  R-ban={forbidden_to_labels(red_forbidden)}  B-ban={forbidden_to_labels(black_forbidden)}")
+    Проход 2: цели и смещения части, а в массив раскладки — её рёбра ключами
+    цель << shift | источник по возрастанию. Возвращает число рёбер части в каждой корзине.
+    """
+    pair_start, pair_end, bases, shift, bucket_width, buckets, blocks = task
+    index = _worker_index
+    start = index.pair_offset[pair_start]
+    end = index.pair_offset[pair_end]
+    offsets = {color: array("Q", [bases[color]]) for color in ("red", "black")}
+    targets = {color: array(blocks["red_targets"][1]) for color in ("red", "black")}
+    for pair in range(pair_start, pair_end):
+        if index.pair_black_width[pair]:
+            extend_pair_transitions(index, pair, (offsets["red"], targets["red"]),
+                                    (offsets["black"], targets["black"]), bases["red"], bases["black"])
+
+    histograms = {}
+    with _shared_views(blocks) as views:
+        for color, base in bases.items():
+            views[color + "_offsets"][start + 1:end + 1] = offsets[color][1:]
+            views[color + "_targets"][base:base + len(targets[color])] = targets[color]
+            degrees = map(sub, offsets[color][1:], offsets[color][:-1])
+            sources = chain.from_iterable(map(repeat, range(start, end), degrees))
+            keys = array("Q", sorted(map(or_, map(lshift, targets[color], repeat(shift)), sources)))
+            views[color + "_scatter"][base:base + len(keys)] = keys
+            bounds = [bisect_left(keys, bucket * bucket_width << shift) for bucket in range(buckets)] + [len(keys)]
+            histograms[color] = list(map(sub, bounds[1:], bounds[:-1]))
+    return histograms
+
+
+def _bucket_invert(task):
+    """
+    Проход 3: обратный граф для целей [first, last). pieces — участки корзины в массиве
+    раскладки по частям, region_start — сколько рёбер ведут в цели до first.
+    Ключи сортируются (участки уже упорядочены, сортировка их только сливает).
+    """
+    first, last, pieces, region_start, shift, blocks = task
+    mask = (1 << shift) - 1
+    with _shared_views(blocks) as views:
+        for color in ("red", "black"):
+            keys = array("Q")
+            for piece_start, piece_end in pieces[color]:
+                keys.extend(views[color + "_scatter"][piece_start:piece_end])
+            keys = sorted(keys)
+            start = region_start[color]
+            views[color + "_in_sources"][start:start + len(keys)] = array(blocks["red_targets"][1],
+                                                                          map(and_, keys, repeat(mask)))
+            counts = Counter(map(rshift, keys, repeat(shift)))
+            views[color + "_in_offsets"][first + 1:last + 1] = array(
+                "Q", accumulate(map(counts.get, range(first, last), repeat(0)), initial=start))[1:]
+
+
+def _transition_shards(index, shards):
+    """Части для пула: отрезки пар [начало, конец) примерно поровну состояний."""
+    total = len(index)
+    bounds = []
+    start = 0
+    for part in range(1, shards + 1):
+        end = index.pair_count if part == shards else bisect_left(index.pair_offset, total * part // shards)
+        if end > start:
+            bounds.append((start, end))
+            start = end
+    return bounds
+
+
+def build_transition_maps_parallel(index, workers):
+    """
+    То же, что build_transition_maps (результат совпадает байт в байт), но в пуле из
+    workers процессов: массивы пишутся прямо в shared_memory, в родителя возвращаются
+    только счётчики, обратный граф строится параллельным подсчётом по корзинам индексов.
+    Процессы получают правила и таблицы пар индекса, состояния восстанавливают сами.
+    """
+    total = len(index)
+    shift = max(1, total.bit_length())
+    if 2 * shift > 64:
+        # ключ раскладки (цель, источник) должен помещаться в 64 бита
+        return build_transition_maps(index)
+    shards = _transition_shards(index, workers * 4)
+    buckets = max(1, len(shards))
+    bucket_width = max(1, -(-total // buckets))
+    memory = {}
+    blocks = {}
+
+    def allocate(key, typecode, length):
+        shm = SharedMemory(create=True, size=max(1, length * array(typecode).itemsize))
+        memory[key] = (shm, typecode, length)
+        blocks[key] = (shm.name, typecode)
+
+    def collect(key):
+        shm, typecode, length = memory[key]
+        values = array(typecode)
+        with shm.buf[:length * values.itemsize] as chunk:
+            values.frombytes(chunk)
+        return values
+
+    tables = (index.pair_offset, index.pair_black_width, index.pair_flags)
+    try:
+        # смещения выделяются до запуска пула: процессы наследуют уже запущенный трекер
+        # ресурсов родителя и не удаляют сегменты, открытые ими, при своём завершении
+        for color in ("red", "black"):
+            allocate(color + "_offsets", "Q", total + 1)
+            allocate(color + "_in_offsets", "Q", total + 1)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_transition_worker,
+                                 initargs=(index.rules, tables)) as pool:
+            counts = list(pool.map(_shard_edge_counts, shards))
+            bases = [{"red": 0, "black": 0}]
+            for red_edges, black_edges in counts:
+                bases.append({"red": bases[-1]["red"] + red_edges, "black": bases[-1]["black"] + black_edges})
+            for color in ("red", "black"):
+                edges = bases[-1][color]
+                allocate(color + "_targets", "I", edges)
+                allocate(color + "_in_sources", "I", edges)
+                allocate(color + "_scatter", "Q", edges)
+
+            histograms = list(pool.map(_shard_targets, [
+                (start, end, bases[part], shift, bucket_width, buckets, blocks)
+                for part, (start, end) in enumerate(shards)]))
+
+            # участок корзины — её доли во всех частях по порядку частей
+            tasks = []
+            region_start = {"red": 0, "black": 0}
+            piece_start = [dict(base) for base in bases]
+            for bucket in range(buckets):
+                pieces = {"red": [], "black": []}
+                for part in range(len(shards)):
+                    for color in ("red", "black"):
+                        size = histograms[part][color][bucket]
+                        pieces[color].append((piece_start[part][color], piece_start[part][color] + size))
+                        piece_start[part][color] += size
+                first = bucket * bucket_width
+                if first < total:
+                    tasks.append((first, min(total, first + bucket_width), pieces, dict(region_start), shift, blocks))
+                for color in ("red", "black"):
+                    region_start[color] += sum(end - start for start, end in pieces[color])
+            list(pool.map(_bucket_invert, tasks))
+
+        return (TransitionTable(collect("red_offsets"), collect("red_targets")),
+                TransitionTable(collect("black_offsets"), collect("black_targets")),
+                TransitionTable(collect("red_in_offsets"), collect("red_in_sources")),
+                TransitionTable(collect("black_in_offsets"), collect("black_in_sources")))
+    finally:
+        for shm, _, _ in memory.values():
+            shm.close()
+            shm.unlink()
 
 
 # ==============================
 #  Ретроградный анализ
 # ==============================
 
-def run_retrograde_analysis():
+def run_retrograde_analysis(index, transitions, stats=None):
     """
     Вычисляет статусы позиций для каждого игрока, который должен ходить.
     1 = гарантированная победа, -1 = гарантированное поражение, 0 = не определено/ничья.
+    Статусы хранятся в массивах int8, счётчики оставшихся ходов — в массивах малых целых.
+    transitions — результат build_transition_maps(index) или build_generated_transitions(index):
+    без хранимого графа счётчики ходов считает count_moves, а предшественников решённой
+    позиции даёт generate_unmoves_from_masks — в памяти только статусы, расстояния и счётчики.
+
+    Возвращает (status, distance): для каждого цвета статусы и число полуходов до
+    конца партии при лучшей игре (быстрейшая победа, самое долгое поражение;
+    для неопределённых позиций — 0). Очередь обрабатывается слоями по расстоянию,
+    поэтому победа получает расстояние первого найденного проигрышного продолжения,
+    а поражение — последнего (самого далёкого) выигрышного продолжения соперника.
+    stats — SolverStats для счётчиков initial_queue и queue_high_water (или None).
     """
-    total = len(index_to_position)
-    status = {
-        COLOR_RED: [0] * total,
-        COLOR_BLACK: [0] * total
-    }
-
-    remaining = {
-        COLOR_RED: [len(outgoing_red[idx]) for idx in range(total)],
-        COLOR_BLACK: [len(outgoing_black[idx]) for idx in range(total)]
-    }
+    outgoing_red, outgoing_black, predecessor_map_red, predecessor_map_black = transitions
+    total = len(index)
+    red_status = array("b", bytes(total))
+    black_status = array("b", bytes(total))
+    red_distance = array("H", bytes(2 * total))
+    black_distance = array("H", bytes(2 * total))
+
+    stored = isinstance(predecessor_map_red, TransitionTable)
+    if isinstance(outgoing_red, TransitionTable):
+        red_degrees = [outgoing_red.degree(idx) for idx in range(total)]
+        black_degrees = [outgoing_black.degree(idx) for idx in range(total)]
+    else:
+        red_degrees, black_degrees = count_moves(index)
+    counter_type = "B" if max(red_degrees + black_degrees, default=0) < 256 else "H"
+    red_remaining = array(counter_type, red_degrees)
+    black_remaining = array(counter_type, black_degrees)
+    del red_degrees, black_degrees
 
+    # Элемент очереди: idx << 1 | сторона (0 — ходят красные, 1 — чёрные)
     queue = deque()
+    mill_flags = index.rules.mill_flags
+    unpack_state = index.board.unpack_state
 
-    for idx, (r, b, _, _) in enumerate(index_to_position):
-        red_win = has_valid_mill(r, COLOR_RED)
-        black_win = has_valid_mill(b, COLOR_BLACK)
+    for idx, packed in enumerate(index.iter_packed_states()):
+        red_mask, black_mask, _, _ = unpack_state(packed)
+        red_win = mill_flags[red_mask] & RED_MILL
+        black_win = mill_flags[black_mask] & BLACK_MILL
 
         if red_win:
-            if status[COLOR_RED][idx] == 0:
-                status[COLOR_RED][idx] = 1
-                queue.append((idx, COLOR_RED))
-            if status[COLOR_BLACK][idx] == 0:
-                status[COLOR_BLACK][idx] = -1
-                queue.append((idx, COLOR_BLACK))
+            red_status[idx] = 1
+            black_status[idx] = -1
+            queue.append(idx << 1)
+            queue.append(idx << 1 | 1)
             continue
 
         if black_win:
-            if status[COLOR_RED][idx] == 0:
-                status[COLOR_RED][idx] = -1
-                queue.append((idx, COLOR_RED))
-            if status[COLOR_BLACK][idx] == 0:
-                status[COLOR_BLACK][idx] = 1
-                queue.append((idx, COLOR_BLACK))
+            red_status[idx] = -1
+            black_status[idx] = 1
+            queue.append(idx << 1)
+            queue.append(idx << 1 | 1)
             continue
 
-        if remaining[COLOR_RED][idx] == 0 and status[COLOR_RED][idx] == 0:
-            status[COLOR_RED][idx] = -1
-            queue.append((idx, COLOR_RED))
+        if red_remaining[idx] == 0:
+            red_status[idx] = -1
+            queue.append(idx << 1)
 
-        if remaining[COLOR_BLACK][idx] == 0 and status[COLOR_BLACK][idx] == 0:
-            status[COLOR_BLACK][idx] = -1
-            queue.append((idx, COLOR_BLACK))
+        if black_remaining[idx] == 0:
+            black_status[idx] = -1
+            queue.append(idx << 1 | 1)
 
-    while queue:
-        idx, turn = queue.popleft()
-        current_status = status[turn][idx]
+    if stored:
+        red_in_offsets, red_in_sources = predecessor_map_red.offsets, predecessor_map_red.targets
+        black_in_offsets, black_in_sources = predecessor_map_black.offsets, predecessor_map_black.targets
+    else:
+        unmoves = index.generate_unmoves_from_masks
+        unrank_state = index.unrank_state
+    popleft = queue.popleft
+    if stats is not None:
+        # отслеживание длины очереди — только со статистикой, в обычном прогоне push без обёртки
+        high_water = [len(queue)]
+        stats.set("initial_queue", len(queue))
+
+        def tracked_push(item, append=queue.append):
+            append(item)
+            if len(queue) > high_water[0]:
+                high_water[0] = len(queue)
+    push = tracked_push if stats is not None else queue.append
 
-        if turn == COLOR_RED:
-            predecessors = predecessor_map_black[idx]
-            prev_turn = COLOR_BLACK
+    while queue:
+        item = popleft()
+        idx = item >> 1
+
+        if item & 1:
+            # ходят чёрные — сюда пришли ходом красных
+            current_status = black_status[idx]
+            next_distance = black_distance[idx] + 1
+            if stored:
+                predecessors = red_in_sources[red_in_offsets[idx]:red_in_offsets[idx + 1]]
+            else:
+                predecessors = unmoves(*unpack_state(unrank_state(idx)), COLOR_RED)
+            prev_status = red_status
+            prev_distance = red_distance
+            prev_remaining = red_remaining
+            prev_side = 0
         else:
-            predecessors = predecessor_map_red[idx]
-            prev_turn = COLOR_RED
+            current_status = red_status[idx]
+            next_distance = red_distance[idx] + 1
+            if stored:
+                predecessors = black_in_sources[black_in_offsets[idx]:black_in_offsets[idx + 1]]
+            else:
+                predecessors = unmoves(*unpack_state(unrank_state(idx)), COLOR_BLACK)
+            prev_status = black_status
+            prev_distance = black_distance
+            prev_remaining = black_remaining
+            prev_side = 1
 
         for prev_idx in predecessors:
-            if status[prev_turn][prev_idx] != 0:
+            if prev_status[prev_idx]:
                 continue
 
             if current_status == -1:
-                status[prev_turn][prev_idx] = 1
-                queue.append((prev_idx, prev_turn))
+                prev_status[prev_idx] = 1
+                prev_distance[prev_idx] = next_distance
+                push(prev_idx << 1 | prev_side)
             else:  # current_status == 1
-                remaining[prev_turn][prev_idx] -= 1
-                if remaining[prev_turn][prev_idx] == 0:
-                    status[prev_turn][prev_idx] = -1
-                    queue.append((prev_idx, prev_turn))
+                left = prev_remaining[prev_idx] - 1
+                prev_remaining[prev_idx] = left
+                if not left:
+                    prev_status[prev_idx] = -1
+                    prev_distance[prev_idx] = next_distance
+                    push(prev_idx << 1 | prev_side)
+
+    if stats is not None:
+        stats.set("queue_high_water", high_water[0])
+    return ({COLOR_RED: red_status, COLOR_BLACK: black_status},
+            {COLOR_RED: red_distance, COLOR_BLACK: black_distance})
+
+
+def _gather_csr(offsets, targets, rows):
+    """Все элементы строк rows графа CSR одним массивом (с повторами)."""
+    starts = offsets[rows]
+    lengths = offsets[rows + 1] - starts
+    count = int(lengths.sum())
+    if not count:
+        return targets[:0]
+    # элемент j строки k лежит в targets[starts[k] + j]
+    shifts = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    return targets[shifts + np.arange(count)]
+
+
+def run_retrograde_analysis_numpy(index, transitions, stats=None):
+    """
+    Тот же ретроградный анализ, что run_retrograde_analysis, но целыми слоями на NumPy:
+    слой — все позиции, решённые на одном расстоянии. Предшественники проигрышных
+    позиций слоя становятся выигрышными, а счётчики оставшихся ходов у предшественников
+    выигрышных уменьшаются разом (np.unique с подсчётом повторов).
+    Статусы и расстояния совпадают с очередной версией бит в бит.
+    stats — SolverStats: initial_queue и queue_high_water здесь считаются по фронту слоя.
+    """
+    if np is None:
+        raise RuntimeError("движок numpy недоступен: модуль numpy не установлен")
 
-    return status
+    total = len(index)
+    if index.packed_states is not None:
+        packed = np.frombuffer(index.packed_states, dtype=np.uint64)
+    else:
+        packed = np.fromiter(index.iter_packed_states(), dtype=np.uint64, count=total)
+    mills = np.frombuffer(bytes(index.rules.mill_flags), dtype=np.uint8)
+    cell_count = index.board.cell_count
+    cell_mask = np.uint64((1 << cell_count) - 1)
+    red_win = (mills[(packed & cell_mask).astype(np.intp)] & RED_MILL) != 0
+    black_win = (mills[(packed >> np.uint64(cell_count) & cell_mask).astype(np.intp)] & BLACK_MILL) != 0
+    terminal = red_win | black_win
+
+    def as_numpy(values, dtype):
+        return np.frombuffer(values, dtype=dtype).astype(np.int64)
+
+    # сторона 0 — ходят красные, 1 — чёрные
+    outgoing = transitions[:2]
+    incoming = transitions[2:]
+    in_offsets = [as_numpy(table.offsets, np.uint64) for table in incoming]
+    in_sources = [np.frombuffer(table.targets, dtype=np.dtype(_typecode(table.targets))) for table in incoming]
+    remaining = [np.diff(as_numpy(table.offsets, np.uint64)) for table in outgoing]
+
+    status = [np.zeros(total, dtype=np.int8), np.zeros(total, dtype=np.int8)]
+    distance = [np.zeros(total, dtype=np.uint16), np.zeros(total, dtype=np.uint16)]
+
+    status[0][red_win] = 1
+    status[0][black_win] = -1
+    status[0][~terminal & (remaining[0] == 0)] = -1
+    status[1][black_win] = 1
+    status[1][red_win] = -1
+    status[1][~terminal & (remaining[1] == 0)] = -1
+
+    frontier = [np.flatnonzero(status[0]), np.flatnonzero(status[1])]
+    layer = 0
+    if stats is not None:
+        stats.set("initial_queue", frontier[0].size + frontier[1].size)
+        stats.set("queue_high_water", frontier[0].size + frontier[1].size)
+
+    while frontier[0].size or frontier[1].size:
+        if stats is not None:
+            stats.maximum("queue_high_water", frontier[0].size + frontier[1].size)
+        layer += 1
+        next_frontier = [None, None]
+
+        for side in (0, 1):
+            # в позицию стороны side пришли ходом соперника prev_side
+            prev_side = 1 - side
+            prev_status = status[prev_side]
+            decided = frontier[side]
+            decided_status = status[side][decided]
+
+            winners = _gather_csr(in_offsets[prev_side], in_sources[prev_side], decided[decided_status == -1])
+            winners = np.unique(winners[prev_status[winners] == 0])
+            prev_status[winners] = 1
+            distance[prev_side][winners] = layer
+
+            hits = _gather_csr(in_offsets[prev_side], in_sources[prev_side], decided[decided_status == 1])
+            touched, counts = np.unique(hits[prev_status[hits] == 0], return_counts=True)
+            remaining[prev_side][touched] -= counts
+            losers = touched[remaining[prev_side][touched] == 0]
+            prev_status[losers] = -1
+            distance[prev_side][losers] = layer
+
+            next_frontier[prev_side] = np.concatenate((winners, losers))
+
+        frontier = next_frontier
+
+    return ({COLOR_RED: array("b", status[0].tobytes()), COLOR_BLACK: array("b", status[1].tobytes())},
+            {COLOR_RED: array("H", distance[0].tobytes()), COLOR_BLACK: array("H", distance[1].tobytes())})
+
+
+RETROGRADE_ENGINES = {
+    "queue": run_retrograde_analysis,
+    "numpy": run_retrograde_analysis_numpy,
+}
 
 
-retro_status = run_retrograde_analysis()
+# Нет хода в таблице лучших ходов
+NO_MOVE = 0xFF
 
 
-def print_retrograde_summary(status_map):
-    print("\nРезультаты ретроградного анализа:")
-    for label, turn in (("Красные ходят", COLOR_RED), ("Чёрные ходят", COLOR_BLACK)):
-        data = status_map[turn]
-        wins = sum(1 for val in data if val == 1)
-        losses = sum(1 for val in data if val == -1)
-        draws = len(data) - wins - losses
-        print(f" - {label}: победа {wins}, поражение {losses}, не определено {draws}")
+def build_best_moves(transitions, status, distance):
+    """
+    Таблица лучших ходов: для каждого цвета и позиции — номер хода в списке
+    исходящих переходов (один байт) или NO_MOVE, если ходов нет.
+    Выигрывающий берёт быстрейшую победу, проигрывающий — самое долгое поражение,
+    в неопределённой позиции — любой ход, не ведущий к поражению.
+    """
+    best_moves = {}
+    for color, moves in ((COLOR_RED, transitions[0]), (COLOR_BLACK, transitions[1])):
+        opponent = COLOR_BLACK if color == COLOR_RED else COLOR_RED
+        my_status = status[color]
+        my_distance = distance[color]
+        next_status = status[opponent]
+        next_distance = distance[opponent]
+        offsets = moves.offsets
+        targets = moves.targets
+        total = len(moves)
+
+        best = array("B", [NO_MOVE]) * total
+        for idx in range(total):
+            options = targets[offsets[idx]:offsets[idx + 1]]
+            current = my_status[idx]
+            # партия окончена (мельница или нет ходов) — ходить некуда
+            if not options or (current and not my_distance[idx]):
+                continue
 
-    # показать по нескольку позиций
-    for turn in (COLOR_RED, COLOR_BLACK):
-        wins = [idx for idx, val in enumerate(status_map[turn]) if val == 1][:5]
-        losses = [idx for idx, val in enumerate(status_map[turn]) if val == -1][:5]
-        print(f"\nПримеры для {'красных' if turn == COLOR_RED else 'чёрных'} (ход):")
-        print(f"   Победа: {wins}")
-        print(f"   Поражение: {losses}")
+            best[idx] = choose_best_move(options, current, next_status, next_distance)
+        best_moves[color] = best
+    return best_moves
 
 
-def print_move_outcomes(index, color):
+def choose_best_move(options, current, next_status, next_distance):
     """
-    Показывает статусы всех продолжений из позиции для заданного игрока.
+    Номер лучшего хода в списке options (непустом) для позиции со статусом current;
+    next_status / next_distance — таблицы соперника, который ходит после хода.
     """
-    moves = outgoing_red if color == COLOR_RED else outgoing_black
-    next_turn = COLOR_BLACK if color == COLOR_RED else COLOR_RED
-    label = 'красных' if color == COLOR_RED else 'чёрных'
-
-    r_tuple, b_tuple, red_forbidden, black_forbidden = index_to_position[index]
-    r = tuple(cell_to_label[c] for c in r_tuple)
-    b = tuple(cell_to_label[c] for c in b_tuple)
-    print(f"\nАнализ ходов для позиции #{index} (ход {label}): Red={r} Black={b}")
-    print(f"   Запрет красных: {forbidden_to_labels(red_forbidden)}")
-    print(f"   Запрет чёрных: {forbidden_to_labels(black_forbidden)}")
+    positions = range(len(options))
+    if current == 1:
+        return min((pos for pos in positions if next_status[options[pos]] == -1),
+                   key=lambda pos: next_distance[options[pos]])
+    if current == -1:
+        return max(positions, key=lambda pos: next_distance[options[pos]])
+    return next(pos for pos in positions if next_status[options[pos]] == 0)
 
-    options = moves.get(index, [])
-    if not options:
-        print("   Ходов нет.")
-        return
 
-    best_win = []
-    forced_loss = []
-    undecided = []
+# ==============================
+#  Симметрии доски
+# ==============================
 
-    for target in options:
-        status_next = retro_status[next_turn][target]
-        target_state = index_to_position[target]
-        tr = tuple(cell_to_label[c] for c in target_state[0])
-        tb = tuple(cell_to_label[c] for c in target_state[1])
-        if status_next == -1:
-            best_win.append((target, tr, tb))
-        elif status_next == 1:
-            forced_loss.append((target, tr, tb))
-        else:
-            undecided.append((target, tr, tb))
+# Зеркало слева направо: A1↔A3, B1↔B3, C1↔C3
+MIRROR_CELLS = {A1: A3, A2: A2, A3: A1, B1: B3, B2: B2, B3: B1, C1: C3, C2: C2, C3: C1}
+# Переворот сверху вниз: ряд A ↔ ряд C (вместе с обменом цветов)
+FLIP_CELLS = {A1: C1, A2: C2, A3: C3, B1: B1, B2: B2, B3: B3, C1: A1, C2: A2, C3: A3}
 
-    if best_win:
-        print("   Гарантированная победа при ходе в:")
-        for idx, tr, tb in best_win:
-            print(f"      #{idx}: Red={tr} Black={tb}")
+# (перестановка клеток, меняются ли цвета местами)
+CANDIDATE_SYMMETRIES = (
+    (MIRROR_CELLS, False),
+    (FLIP_CELLS, True),
+    ({cell: FLIP_CELLS[MIRROR_CELLS[cell]] for cell in cells}, True),
+)
 
-    if forced_loss:
-        print("   Ходы, ведущие к поражению:")
-        for idx, tr, tb in forced_loss:
-            print(f"      #{idx}: Red={tr} Black={tb}")
 
-    if undecided:
-        print("   Ходы с неопределённым исходом:")
-        for idx, tr, tb in undecided:
-            print(f"      #{idx}: Red={tr} Black={tb}")
+def candidate_symmetries(board):
+    """То же, что CANDIDATE_SYMMETRIES, для любой сетки; у доски не-сетки симметрий нет."""
+    mirror, flip = board.mirror_cells(), board.flip_cells()
+    if mirror is None:
+        return ()
+    return ((mirror, False), (flip, True), ({cell: flip[mirror[cell]] for cell in board.cells}, True))
 
 
-def show_forced_win_moves(index, color):
+def symmetry_preserves_rules(mapping, swap_colors, rules=None):
     """
-    Если позиция выигрышна для текущего игрока, выводит ходы, сохраняющие победу.
-    color — кто должен ходить в позиции index.
+    Проверяет, что перестановка клеток сохраняет соседство, линии и стартовые ряды
+    (при обмене цветов ряд красных должен переходить в ряд чёрных).
+    Позиции первого хода красных важны только без обмена цветов: обмен применяется
+    лишь к состояниям, где запрет есть у обоих (или правила запрета отмены нет).
     """
-    status_val = retro_status[color][index]
-    if status_val != 1:
-        print(f"\nПозиция #{index} не является гарантированной победой для {color}.")
-        return
-
-    moves = outgoing_red if color == COLOR_RED else outgoing_black
-    opponent = COLOR_BLACK if color == COLOR_RED else COLOR_RED
-    label = 'красных' if color == COLOR_RED else 'чёрных'
+    if rules is None:
+        rules = DEFAULT_RULES
 
-    state = index_to_position[index]
-    r = tuple(cell_to_label[c] for c in state[0])
-    b = tuple(cell_to_label[c] for c in state[1])
-    print(f"\nПозиция #{index}: Red={r} Black={b}")
-    print(f"Запрет красных: {forbidden_to_labels(state[2])}")
-    print(f"Запрет чёрных: {forbidden_to_labels(state[3])}")
-    print(f"Ходы {label}, сохраняющие форсированную победу:")
-
-    for target in moves[index]:
-        if retro_status[opponent][target] == -1:
-            target_state = index_to_position[target]
-            tr = tuple(cell_to_label[c] for c in target_state[0])
-            tb = tuple(cell_to_label[c] for c in target_state[1])
-            print(f"   -> #{target}: Red={tr} Black={tb}  R-ban={forbidden_to_labels(target_state[2])}  B-ban={forbidden_to_labels(target_state[3])}")
+    def image(group):
+        return frozenset(mapping[cell] for cell in group)
 
+    if any(image(rules.neighbors[cell]) != frozenset(rules.neighbors[mapping[cell]]) for cell in rules.board.cells):
+        return False
+    lines = {frozenset(line) for line in rules.winning_lines}
+    if {image(line) for line in lines} != lines:
+        return False
+    red_start, black_start = frozenset(rules.red_start), frozenset(rules.black_start)
+    if swap_colors:
+        return image(red_start) == black_start and image(black_start) == red_start
+    first_moves = {frozenset(position) for position in rules.first_move_positions}
+    return (image(red_start) == red_start and image(black_start) == black_start
+            and {image(position) for position in first_moves} == first_moves)
 
-# ==============================
-#  Удобная функция для проверки
-# ==============================
 
-def print_moves_for_position(index, color):
+class BoardSymmetry:
     """
-    Показывает все ходы для позиции с данным индексом.
-    color = COLOR_RED или COLOR_BLACK.
+    Симметрия в виде таблиц: образ маски камней (для наборов камней правил) и образ
+    кода запрета. При swap_colors красные и чёрные меняются местами, а с ними и сторона,
+    которая ходит.
     """
 
-    r, b, red_forbidden, black_forbidden = index_to_position[index]
-    r_labels = tuple(cell_to_label[c] for c in r)
-    b_labels = tuple(cell_to_label[c] for c in b)
-    print(f"\nПозиция #{index}:  Red={r_labels}  Black={b_labels}")
-    print(f"Запрет красных: {forbidden_to_labels(red_forbidden)}")
-    print(f"Запрет чёрных: {forbidden_to_labels(black_forbidden)}")
-    print(f"Ходы для {color}:")
+    __slots__ = ("swap_colors", "mask_map", "code_map")
 
-    result = generate_moves_for_color(r, b, red_forbidden, black_forbidden, color, position_to_index)
+    def __init__(self, mapping, swap_colors, rules=None):
+        if rules is None:
+            rules = DEFAULT_RULES
+        board = rules.board
+        n = board.cell_count
+        pos_map = [board.cell_to_pos[mapping[cell]] for cell in board.cells]
+        self.swap_colors = swap_colors
+        self.mask_map = {mask: sum(1 << pos_map[pos] for pos in iter_bits(mask)) for mask in rules.sets.masks}
+        self.code_map = array("H", [0]) * board.forbidden_code_limit
+        for cur in range(n):
+            for prev in range(n):
+                self.code_map[1 + cur * n + prev] = 1 + pos_map[cur] * n + pos_map[prev]
 
-    if not result:
-        print("   Нет доступных ходов")
-        return
 
-    for idx in result:
-        st = index_to_position[idx]
-        r2 = tuple(cell_to_label[c] for c in st[0])
-        b2 = tuple(cell_to_label[c] for c in st[1])
-        print(f"   -> #{idx}: Red={r2} Black={b2}  R-ban={forbidden_to_labels(st[2])}  B-ban={forbidden_to_labels(st[3])}")
+def board_symmetries(rules=None):
+    """Симметрии доски правил (candidate_symmetries), которые выполняются при правилах rules."""
+    if rules is None:
+        rules = DEFAULT_RULES
+    return [BoardSymmetry(mapping, swap_colors, rules) for mapping, swap_colors in candidate_symmetries(rules.board)
+            if symmetry_preserves_rules(mapping, swap_colors, rules)]
 
 
-def build_black_transition_rules():
-    """
-    Формирует список правил переходов для чёрных, исключая ходы,
-    после которых красные получают форсированную победу.
+class SymmetryReduction:
     """
-    rules = []
+    Состояния с точностью до симметрий доски. Каноническое состояние — образ
+    с наименьшим индексом; хранятся только канонические состояния (states — их
+    индексы в StateIndex по возрастанию, packed_states — упакованные состояния).
 
-    for r, b, red_forbidden, black_forbidden in index_to_position:
-        transitions = []
-        red_set = set(r)
-        black_set = set(b)
+    Симметрии с обменом цветов применяются только к состояниям, где запрет есть
+    у обоих: из таких состояний ходы ведут только в такие же, а состояния без
+    запрета несимметричны (красные ходят первыми). Без правила запрета отмены
+    запретов нет ни у кого, и обмен цветов применяется ко всем состояниям.
 
-        for src in sorted(black_set):
-            for dst in neighbors[src]:
-                if dst in red_set or dst in black_set:
-                    continue
+    Граф ретроградного анализа строится на узлах «состояние + кто ходит»:
+    узел = номер канонического состояния << 1 | сторона (0 — красные, 1 — чёрные).
+    """
 
-                if black_forbidden and src == black_forbidden[0] and dst == black_forbidden[1]:
+    def __init__(self, index, symmetries=None):
+        self.index = index
+        self.symmetries = board_symmetries(index.rules) if symmetries is None else symmetries
+        # для каждой пары: (меняются ли цвета, база, вклад номера запрета красных, вклад чёрных)
+        # по симметриям, переводящим пару в пару с не большим номером
+        self.pair_plans = [()] * index.pair_count
+        self._pair_skipped = bytearray(index.pair_count)
+        self.states = array("I" if len(index) < 1 << 32 else "Q")
+        self.packed_states = array("Q")
+        self._build_pair_plans()
+        self._enumerate_states()
+
+    def __len__(self):
+        return len(self.states)
+
+    def _build_pair_plans(self):
+        index = self.index
+        # без правила запрета отмены у всех код 0, и обмен цветов применим всегда
+        swap_any = not index.rules.no_undo
+
+        def slot(rank, code, none_flag):
+            if not code:
+                return 0 if none_flag else None
+            found = index.forbidden_slot[rank * index.board.forbidden_code_limit + code]
+            if found < 0:
+                return None
+            return found + (1 if none_flag else 0)
+
+        sets = index.sets
+        for pair in range(index.pair_count):
+            if not index.pair_black_width[pair]:
+                continue
+            red_rank, black_rank = divmod(pair, sets.count)
+            red_codes, black_codes = index.pair_codes(pair)
+            plans = []
+
+            for symmetry in self.symmetries:
+                mask_map = symmetry.mask_map
+                code_map = symmetry.code_map
+                image_red = sets.rank[mask_map[sets.masks[red_rank]]]
+                image_black = sets.rank[mask_map[sets.masks[black_rank]]]
+                if symmetry.swap_colors:
+                    image_red, image_black = image_black, image_red
+                target = image_red * sets.count + image_black
+                if target > pair:
                     continue
+                width = index.pair_black_width[target]
+                flags = index.pair_flags[target]
+
+                if symmetry.swap_colors:
+                    # запрет красных становится запретом чёрных и наоборот; без запрета — не применяется
+                    red_part = tuple(slot(image_black, code_map[code], flags & PAIR_BLACK_NONE)
+                                     if code or swap_any else None for code in red_codes)
+                    black_part = tuple(slot(image_red, code_map[code], flags & PAIR_RED_NONE)
+                                       if code or swap_any else None for code in black_codes)
+                    black_part = tuple(None if value is None else value * width for value in black_part)
+                else:
+                    red_part = tuple(slot(image_red, code_map[code], flags & PAIR_RED_NONE) for code in red_codes)
+                    red_part = tuple(None if value is None else value * width for value in red_part)
+                    black_part = tuple(slot(image_black, code_map[code], flags & PAIR_BLACK_NONE)
+                                       for code in black_codes)
+                    if target < pair:
+                        # зеркало без обмена цветов применимо ко всем состояниям пары
+                        self._pair_skipped[pair] = 1
+                plans.append((symmetry.swap_colors, index.pair_offset[target], red_part, black_part))
+
+            self.pair_plans[pair] = tuple(plans)
+
+    @staticmethod
+    def _smallest_image(plans, idx, red_slot, black_slot):
+        best, swapped = idx, False
+        for swap_colors, base, red_part, black_part in plans:
+            red_value = red_part[red_slot]
+            black_value = black_part[black_slot]
+            if red_value is None or black_value is None:
+                continue
+            image = base + red_value + black_value
+            if image < best:
+                best, swapped = image, swap_colors
+        return best, swapped
+
+    def _enumerate_states(self):
+        index = self.index
+        sets = index.sets
+        pack_state = index.board.pack_state
+        for pair in range(index.pair_count):
+            width = index.pair_black_width[pair]
+            if not width or self._pair_skipped[pair]:
+                continue
+            red_rank, black_rank = divmod(pair, sets.count)
+            red_mask = sets.masks[red_rank]
+            black_mask = sets.masks[black_rank]
+            red_codes, black_codes = index.pair_codes(pair)
+            plans = self.pair_plans[pair]
+            idx = index.pair_offset[pair]
+
+            for red_slot, red_code in enumerate(red_codes):
+                for black_slot, black_code in enumerate(black_codes):
+                    if not plans or self._smallest_image(plans, idx, red_slot, black_slot)[0] == idx:
+                        self.states.append(idx)
+                        self.packed_states.append(pack_state(red_mask, black_mask, red_code, black_code))
+                    idx += 1
+
+    def canonical(self, idx):
+        """
+        Каноническое состояние для индекса idx: (его индекс в StateIndex, меняются ли цвета).
+        При обмене цветов ход красных в idx соответствует ходу чёрных в каноническом.
+        """
+        index = self.index
+        pair = bisect_right(index.pair_offset, idx) - 1
+        plans = self.pair_plans[pair]
+        if not plans:
+            return idx, False
+        red_slot, black_slot = divmod(idx - index.pair_offset[pair], index.pair_black_width[pair])
+        return self._smallest_image(plans, idx, red_slot, black_slot)
+
+    def node(self, idx, color):
+        """Узел графа для позиции idx, в которой ходит color."""
+        canonical, swapped = self.canonical(idx)
+        side = (0 if color == COLOR_RED else 1) ^ swapped
+        return bisect_left(self.states, canonical) << 1 | side
+
+    def build_graph(self):
+        """
+        Возвращает (исходящие, входящие) таблицы TransitionTable по узлам.
+        Ходы в симметричные позиции склеиваются в одно ребро.
+        """
+        index = self.index
+        canonical = self.canonical
+        states = self.states
+        offsets = array("Q", [0])
+        targets = array("I" if 2 * len(states) < 1 << 32 else "Q")
+        unpack_state = index.board.unpack_state
+
+        for packed in self.packed_states:
+            red_mask, black_mask, red_code, black_code = unpack_state(packed)
+            for color, next_side in ((COLOR_RED, 1), (COLOR_BLACK, 0)):
+                nodes = set()
+                for target in index.generate_moves_from_masks(red_mask, black_mask, red_code, black_code, color):
+                    image, swapped = canonical(target)
+                    nodes.add(bisect_left(states, image) << 1 | (next_side ^ swapped))
+                targets.extend(sorted(nodes))
+                offsets.append(len(targets))
+
+        outgoing = TransitionTable(offsets, targets)
+        return outgoing, outgoing.inverted()
+
+
+def run_symmetric_retrograde_analysis(reduction, graph):
+    """
+    Ретроградный анализ на узлах SymmetryReduction; graph — результат build_graph().
+    Возвращает (status, distance) по узлам в тех же единицах, что run_retrograde_analysis.
+    """
+    outgoing, incoming = graph
+    total = len(outgoing)
+    mill_flags = reduction.index.rules.mill_flags
+    unpack_state = reduction.index.board.unpack_state
+    status = array("b", bytes(total))
+    distance = array("H", bytes(2 * total))
 
-                new_black = sorted((black_set - {src}) | {dst})
-                pos = (
-                    tuple(sorted(red_set)),
-                    tuple(new_black),
-                    red_forbidden,
-                    (dst, src)
-                )
-                idx = position_to_index.get(pos)
-                if idx is None:
-                    continue
+    degrees = [outgoing.degree(node) for node in range(total)]
+    remaining = array("B" if max(degrees, default=0) < 256 else "H", degrees)
+    del degrees
 
-                # После хода чёрных ходят красные; пропускаем,
-                # если для них позиция является гарантированной победой.
-                if retro_status[COLOR_RED][idx] == 1:
-                    continue
+    queue = deque()
+    for number, packed in enumerate(reduction.packed_states):
+        red_mask, black_mask, _, _ = unpack_state(packed)
+        node = number << 1
+        if mill_flags[red_mask] & RED_MILL:
+            status[node], status[node | 1] = 1, -1
+        elif mill_flags[black_mask] & BLACK_MILL:
+            status[node], status[node | 1] = -1, 1
+        else:
+            if not remaining[node]:
+                status[node] = -1
+            if not remaining[node | 1]:
+                status[node | 1] = -1
+        if status[node]:
+            queue.append(node)
+        if status[node | 1]:
+            queue.append(node | 1)
+
+    in_offsets, in_sources = incoming.offsets, incoming.targets
+    popleft = queue.popleft
+    push = queue.append
 
-                transitions.append((cell_to_label[src], cell_to_label[dst]))
+    while queue:
+        node = popleft()
+        current_status = status[node]
+        next_distance = distance[node] + 1
 
-        if transitions:
-            rule = {
-                "red": [cell_to_label[c] for c in r],
-                "black": [cell_to_label[c] for c in b],
-                "red_forbidden": forbidden_to_labels(red_forbidden),
-                "black_forbidden": forbidden_to_labels(black_forbidden),
-                "transitions": sorted(transitions)
-            }
-            rules.append(rule)
+        for prev in in_sources[in_offsets[node]:in_offsets[node + 1]]:
+            if status[prev]:
+                continue
+
+            if current_status == -1:
+                status[prev] = 1
+                distance[prev] = next_distance
+                push(prev)
+            else:  # current_status == 1
+                left = remaining[prev] - 1
+                remaining[prev] = left
+                if not left:
+                    status[prev] = -1
+                    distance[prev] = next_distance
+                    push(prev)
 
-    return rules
+    return status, distance
 
 
-def print_black_transition_rules(rules):
+class SymmetricTable:
     """
-    Выводит правила переходов для чёрных в виде вызовов addRule({...}).
+    Таблица по индексам полного StateIndex поверх таблицы по узлам SymmetryReduction:
+    table[idx] — значение для позиции idx, в которой ходит color.
     """
-    print("\n// Чёрные: безопасные переходы")
-    for rule in rules:
-        red_line = ", ".join(rule["red"])
-        black_line = ", ".join(rule["black"])
-        print("addRule({")
-        print(f"  red: [{red_line}],")
-        print(f"  black: [{black_line}],")
-        print(f"  redForbidden: {format_forbidden_field(rule['red_forbidden'])},")
-        print(f"  blackForbidden: {format_forbidden_field(rule['black_forbidden'])},")
-        print("  transitions: [")
-        for src, dst in rule["transitions"]:
-            print(f"    [{src}, {dst}],")
-        print("  ],")
-        print("});\n")
 
+    __slots__ = ("reduction", "values", "color")
 
-def print_black_transition_rules_numeric(rules, position_to_index):
-    """
-    Выводит правила в числовом формате.
-    """
-    print("\n// Чёрные: безопасные переходы (числовой формат)")
-    # Create a reverse mapping from label to cell number
-    label_to_cell = {v: k for k, v in cell_to_label.items()}
+    def __init__(self, reduction, values, color):
+        self.reduction = reduction
+        self.values = values
+        self.color = color
 
-    numeric_rules = {}
+    def __len__(self):
+        return len(self.reduction.index)
 
-    for rule in rules:
-        r = tuple(sorted([label_to_cell[c] for c in rule["red"]]))
-        b = tuple(sorted([label_to_cell[c] for c in rule["black"]]))
+    def __getitem__(self, idx):
+        return self.values[self.reduction.node(idx, self.color)]
 
-        rf_labels = rule["red_forbidden"]
-        if rf_labels:
-            rf = (label_to_cell[rf_labels[0]], label_to_cell[rf_labels[1]])
-        else:
-            rf = None
+    def __iter__(self):
+        # канонические пары (без планов) лежат в states подряд — читаем их срезом
+        reduction = self.reduction
+        index = reduction.index
+        side = 0 if self.color == COLOR_RED else 1
+        for pair in range(index.pair_count):
+            if not index.pair_black_width[pair]:
+                continue
+            start, end = index.pair_offset[pair], index.pair_offset[pair + 1]
+            if reduction.pair_plans[pair]:
+                for idx in range(start, end):
+                    yield self.values[reduction.node(idx, self.color)]
+            else:
+                first = bisect_left(reduction.states, start)
+                yield from self.values[first << 1 | side:(first + end - start) << 1:2]
 
-        bf_labels = rule["black_forbidden"]
-        if bf_labels:
-            bf = (label_to_cell[bf_labels[0]], label_to_cell[bf_labels[1]])
-        else:
-            bf = None
 
-        state = (r, b, rf, bf)
-        state_index = position_to_index.get(state)
+class GeneratedMoves:
+    """Ходы цвета color по индексу позиции, без хранимой таблицы переходов."""
 
-        if state_index is None:
-            continue
+    __slots__ = ("index", "color")
 
-        numeric_transitions = []
-        for src_label, dst_label in rule["transitions"]:
-            numeric_transitions.append([label_to_cell[src_label], label_to_cell[dst_label]])
+    def __init__(self, index, color):
+        self.index = index
+        self.color = color
 
-        if numeric_transitions:
-            numeric_rules[state_index] = numeric_transitions
+    def __len__(self):
+        return len(self.index)
 
-    print("{")
-    # sort keys to have deterministic output
-    for idx in sorted(numeric_rules.keys()):
-        print(f"  {idx}: {numeric_rules[idx]},")
-    print("}")
+    def __getitem__(self, idx):
+        red_mask, black_mask, red_code, black_code = self.index.board.unpack_state(self.index.unrank_state(idx))
+        return self.index.generate_moves_from_masks(red_mask, black_mask, red_code, black_code, self.color)
 
+    def degree(self, idx):
+        return len(self[idx])
 
-# ==============================
-#  Пример использования
-# ==============================
 
-# Проверить ходы для позиции №0 красных:
-#print_moves_for_position(1670, COLOR_RED)
+class GeneratedUnmoves:
+    """
+    Предшественники по индексу позиции без хранимого обратного графа: откуда ходом
+    цвета color приходят в позицию (как строки predecessor_map, по возрастанию).
+    """
+
+    __slots__ = ("index", "color")
+
+    def __init__(self, index, color):
+        self.index = index
+        self.color = color
+
+    def __len__(self):
+        return len(self.index)
 
-# Проверить ходы для позиции №0 чёрных:
-#print_moves_for_position(1670, COLOR_BLACK)
+    def __getitem__(self, idx):
+        red_mask, black_mask, red_code, black_code = self.index.board.unpack_state(self.index.unrank_state(idx))
+        return sorted(self.index.generate_unmoves_from_masks(red_mask, black_mask, red_code, black_code, self.color))
 
-# Посмотреть, из каких позиций достижима позиция:
-#print_sources_for_position(1670)
+    def degree(self, idx):
+        return len(self[idx])
 
-# Вывести первые 10 элементов словаря входящих переходов для красных:
-#print("\nПервые 10 записей словаря для хода красных:")
-#for idx in range(min(10, len(index_to_position))):
-#    print(f"#{idx}: {predecessor_map_red.get(idx, [])}")
 
-# Печать результатов ретроградного анализа:
-#print_retrograde_summary(retro_status)
+# ==============================
+#  Файл таблицы
+# ==============================
 
-# Анализ стартовой позиции (Red=(1,2,3) vs Black=(7,8,9)):
-# start_index = lookup_state_index((A1, A2, A3), (C1, C2, C3))
-# if start_index is not None:
-#     print_move_outcomes(start_index, COLOR_RED)
+# Файл: заголовок, каталог секций, затем данные секций (каждая выровнена на 8 байт).
+# Данные записаны в порядке байтов машины; файл с другим порядком считается устаревшим.
+TABLEBASE_MAGIC = b"MILLCALC"
+TABLEBASE_VERSION = 2
+TABLEBASE_SECTIONS = (
+    "pair_offset", "pair_black_width", "pair_flags", "packed_states",
+    "red_offsets", "red_targets", "black_offsets", "black_targets",
+    "red_in_offsets", "red_in_sources", "black_in_offsets", "black_in_sources",
+    "red_status", "black_status", "red_distance", "black_distance", "red_best", "black_best",
+)
 
-# Полный список ходов чёрных, которые не приводят к немедленному поражению:
-#black_rules = build_black_transition_rules()
-#print(f"\nTotal rules for black: {len(black_rules)}")
+_TABLEBASE_HEADER = struct.Struct("<8sHB5x32sQ")  # сигнатура, версия, порядок байтов, хэш правил, число секций
+_TABLEBASE_SECTION = struct.Struct("<24sc7xQQ")   # имя, тип элементов, смещение, число элементов
 
-# print_black_transition_rules(black_rules)
-#print_black_transition_rules_numeric(black_rules, position_to_index)
+
+def rules_fingerprint(rules=None):
+    """
+    SHA-256 от всего, что влияет на набор состояний, переходы и статусы (Ruleset.fingerprint).
+    Любая правка правил меняет хэш, и старый файл таблицы перестаёт подходить.
+    """
+    return (DEFAULT_RULES if rules is None else rules).fingerprint()
+
+
+def _typecode(values):
+    return values.typecode if isinstance(values, array) else values.format
+
+
+def save_tablebase(solver, path):
+    """
+    Записывает решённую таблицу (индекс, переходы, статусы, расстояния и лучшие ходы) в файл path.
+    Запись идёт во временный файл, который затем атомарно заменяет старый.
+    """
+    index = solver.index
+    outgoing_red, outgoing_black, predecessor_map_red, predecessor_map_black = solver.transitions
+    status = solver.retro_status
+    distance = solver.retro_distance
+    best_moves = solver.best_moves
+    packed_states = index.packed_states
+    if packed_states is None:
+        packed_states = array("Q")
+        for _, _, part in index.iter_partitions():
+            packed_states.extend(part)
+    sections = (
+        index.pair_offset, index.pair_black_width, index.pair_flags, packed_states,
+        outgoing_red.offsets, outgoing_red.targets, outgoing_black.offsets, outgoing_black.targets,
+        predecessor_map_red.offsets, predecessor_map_red.targets,
+        predecessor_map_black.offsets, predecessor_map_black.targets,
+        status[COLOR_RED], status[COLOR_BLACK], distance[COLOR_RED], distance[COLOR_BLACK],
+        best_moves[COLOR_RED], best_moves[COLOR_BLACK],
+    )
+
+    position = _TABLEBASE_HEADER.size + _TABLEBASE_SECTION.size * len(sections)
+    directory = []
+    for name, values in zip(TABLEBASE_SECTIONS, sections):
+        position = (position + 7) & ~7
+        directory.append(_TABLEBASE_SECTION.pack(name.encode("ascii"), _typecode(values).encode("ascii"),
+                                                 position, len(values)))
+        position += len(values) * memoryview(values).itemsize
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_TABLEBASE_HEADER.pack(TABLEBASE_MAGIC, TABLEBASE_VERSION, sys.byteorder == "little",
+                                       rules_fingerprint(index.rules), len(sections)))
+        for entry in directory:
+            f.write(entry)
+        for values in sections:
+            f.write(b"\0" * (-f.tell() & 7))
+            f.write(memoryview(values).cast("B"))
+    os.replace(tmp_path, path)
+
+
+def open_tablebase(path, rules=None):
+    """
+    Открывает файл таблицы через mmap и возвращает словарь секций — memoryview
+    нужного типа прямо поверх отображённого файла, без копирования.
+    Возвращает None, если файла нет или он записан другой версией, на другой
+    архитектуре или для других правил (rules, по умолчанию DEFAULT_RULES).
+    """
+    try:
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    if len(mapped) < _TABLEBASE_HEADER.size:
+        return None
+    magic, version, little_endian, fingerprint, count = _TABLEBASE_HEADER.unpack_from(mapped, 0)
+    if (magic != TABLEBASE_MAGIC or version != TABLEBASE_VERSION
+            or bool(little_endian) != (sys.byteorder == "little")
+            or fingerprint != rules_fingerprint(rules) or count != len(TABLEBASE_SECTIONS)):
+        return None
+
+    view = memoryview(mapped)
+    sections = {}
+    for number, name in enumerate(TABLEBASE_SECTIONS):
+        raw_name, typecode, offset, length = _TABLEBASE_SECTION.unpack_from(
+            mapped, _TABLEBASE_HEADER.size + number * _TABLEBASE_SECTION.size)
+        if raw_name.rstrip(b"\0").decode("ascii") != name:
+            return None
+        typecode = typecode.decode("ascii")
+        end = offset + length * array(typecode).itemsize
+        if end > len(mapped):
+            return None
+        sections[name] = view[offset:end].cast(typecode)
+    return sections
+
+
+# ==============================
+#  Решение на диске
+# ==============================
+
+# Каталог решения: файлы частей part-NNNNN.bin, фронты слоёв layer-NNNNN.bin и checkpoint.json.
+# Часть — несколько пар (красные, чёрные) подряд, то есть непрерывный отрезок индексов.
+# Файл части — массивы по её состояниям: расстояния красных и чёрных ("H"), счётчики
+# оставшихся ходов красных и чёрных (тип по наибольшему числу ходов), статусы ("b").
+SOLVE_DIR_VERSION = 1
+PARTITION_STATES = 1 << 20
+LAYER_CHUNK = 1 << 16
+
+
+class PartitionStore:
+    """
+    Массивы ретроградного анализа по частям на диске (см. solve_on_disk). Часть
+    набирается из целых пар, пока в ней меньше partition_states состояний. Файл части
+    отображается через mmap при первом обращении; открыто не больше max_open частей,
+    сверх того закрывается открытая раньше всех (изменения остаются в файле), так что
+    в памяти — только части, которых касается фронт.
+    arrays(part) — (расстояния красных, чёрных, счётчики красных, чёрных, статусы
+    красных, чёрных) по локальным номерам состояний части; opened — те же кортежи
+    уже открытых частей (горячим циклам хватает opened.get, arrays — при промахе).
+    """
+
+    def __init__(self, directory, index, partition_states=PARTITION_STATES, max_open=64, counter_type="B"):
+        self.directory = directory
+        self.index = index
+        self.max_open = max_open
+        self.counter_type = counter_type
+        # начало каждой части и её первая пара; последняя часть кончается концом индекса
+        self.starts = array("q")
+        self.first_pairs = array("q")
+        offsets = index.pair_offset
+        for pair in range(index.pair_count):
+            if index.pair_black_width[pair] and (not self.starts or offsets[pair] - self.starts[-1] >= partition_states):
+                self.starts.append(offsets[pair])
+                self.first_pairs.append(pair)
+        self.ends = self.starts[1:] + array("q", [len(index)])
+        self.opened = {}
+        self._mapped = {}
+
+    def __len__(self):
+        return len(self.starts)
+
+    def path(self, part):
+        return os.path.join(self.directory, f"part-{part:05d}.bin")
+
+    def pairs(self, part):
+        """Пары части по порядку индексов."""
+        end = self.first_pairs[part + 1] if part + 1 < len(self.first_pairs) else self.index.pair_count
+        return range(self.first_pairs[part], end)
+
+    def create(self, part):
+        """Новый файл части, заполненный нулями (прежний, если был, теряется)."""
+        self._release(part)
+        states = self.ends[part] - self.starts[part]
+        with open(self.path(part), "wb") as f:
+            f.truncate(states * (6 + 2 * array(self.counter_type).itemsize))
+
+    def arrays(self, part):
+        arrays = self.opened.get(part)
+        if arrays is not None:
+            return arrays
+        if len(self.opened) >= self.max_open:
+            self._release(next(iter(self.opened)))
+        states = self.ends[part] - self.starts[part]
+        with open(self.path(part), "r+b") as f:
+            mapped = mmap.mmap(f.fileno(), 0)
+        view = memoryview(mapped)
+        width = array(self.counter_type).itemsize * states
+        bounds = (0, 2 * states, 4 * states, 4 * states + width, 4 * states + 2 * width,
+                  5 * states + 2 * width, 6 * states + 2 * width)
+        types = ("H", "H", self.counter_type, self.counter_type, "b", "b")
+        arrays = self.opened[part] = tuple(view[start:end].cast(typecode)
+                                           for start, end, typecode in zip(bounds, bounds[1:], types))
+        self._mapped[part] = (mapped, view)
+        return arrays
+
+    def _release(self, part):
+        arrays = self.opened.pop(part, None)
+        if arrays is not None:
+            mapped, view = self._mapped.pop(part)
+            for values in arrays:
+                values.release()
+            view.release()
+            mapped.close()
+
+    def flush(self):
+        """Сбрасывает открытые части на диск."""
+        for mapped, _ in self._mapped.values():
+            mapped.flush()
+
+    def close(self):
+        for part in list(self.opened):
+            self._release(part)
+
+    def gather(self):
+        """Статусы и расстояния всех позиций в памяти — как у run_retrograde_analysis."""
+        status = {COLOR_RED: array("b"), COLOR_BLACK: array("b")}
+        distance = {COLOR_RED: array("H"), COLOR_BLACK: array("H")}
+        for part in range(len(self)):
+            values = self.arrays(part)
+            for side, color in enumerate((COLOR_RED, COLOR_BLACK)):
+                distance[color].frombytes(values[side].cast("B"))
+                status[color].frombytes(values[4 + side].cast("B"))
+        return status, distance
+
+
+def _layer_path(directory, layer):
+    return os.path.join(directory, f"layer-{layer:05d}.bin")
+
+
+def _layer_numbers(directory):
+    return sorted(int(name[6:-4]) for name in os.listdir(directory)
+                  if name.startswith("layer-") and name.endswith(".bin") and name[6:-4].isdigit())
+
+
+def _read_layer(path):
+    """Фронт слоя из файла пачками по LAYER_CHUNK элементов."""
+    with open(path, "rb") as f:
+        while True:
+            items = array("Q")
+            try:
+                items.fromfile(f, LAYER_CHUNK)
+            except EOFError:
+                pass  # последняя пачка неполная — прочитанное уже в items
+            if not items:
+                return
+            yield items
+
+
+def _write_checkpoint(directory, fields):
+    """checkpoint.json целиком или никак: пишется рядом и подменяется атомарно."""
+    path = os.path.join(directory, "checkpoint.json")
+    with open(path + ".tmp", "w", encoding="utf-8") as out:
+        json.dump(fields, out, indent=2)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def _pair_moves(index, pair):
+    """Ходы красных и чёрных из состояний пары: два CSR (смещения, цели) с нуля."""
+    red = (array("Q", [0]), array("I"))
+    black = (array("Q", [0]), array("I"))
+    extend_pair_transitions(index, pair, red, black)
+    return red, black
+
+
+def _init_partitions(store, out):
+    """
+    Файлы частей с начальными статусами и счётчиками ходов; начальный фронт (позиции
+    с мельницей и без ходов) пишется в out в том же порядке, что и очередь
+    run_retrograde_analysis. Возвращает длину фронта.
+    """
+    index = store.index
+    masks = index.sets.masks
+    count = index.sets.count
+    mill_flags = index.rules.mill_flags
+    queued = 0
+    for part in range(len(store)):
+        store.create(part)
+        red_distance, black_distance, red_remaining, black_remaining, red_status, black_status = store.arrays(part)
+        base = store.starts[part]
+        front = array("Q")
+        push = front.append
+        for pair in store.pairs(part):
+            if not index.pair_black_width[pair]:
+                continue
+            red_rank, black_rank = divmod(pair, count)
+            red_win = mill_flags[masks[red_rank]] & RED_MILL
+            black_win = mill_flags[masks[black_rank]] & BLACK_MILL
+            (red_offsets, _), (black_offsets, _) = _pair_moves(index, pair)
+            first = index.pair_offset[pair] - base
+            for slot in range(len(red_offsets) - 1):
+                local = first + slot
+                idx = base + local
+                red_remaining[local] = red_offsets[slot + 1] - red_offsets[slot]
+                black_remaining[local] = black_offsets[slot + 1] - black_offsets[slot]
+                if red_win or black_win:
+                    red_status[local] = 1 if red_win else -1
+                    black_status[local] = -red_status[local]
+                    push(idx << 1)
+                    push(idx << 1 | 1)
+                    continue
+                if not red_remaining[local]:
+                    red_status[local] = -1
+                    push(idx << 1)
+                if not black_remaining[local]:
+                    black_status[local] = -1
+                    push(idx << 1 | 1)
+        front.tofile(out)
+        queued += len(front)
+    return queued
+
+
+def _repair_partitions(store, layer):
+    """
+    Откат к контрольной точке слоя layer (фронт layer ещё не обработан): позиции,
+    решённые после неё (расстояние больше layer), снова не решены, а счётчик ходов
+    нерешённой позиции — число ходов минус ходы в позиции, уже выигранные соперником
+    на расстоянии меньше layer (их предшественников обработка слоёв до layer уже учла).
+    """
+    index = store.index
+    parts = range(len(store))
+    for part in parts:
+        values = store.arrays(part)
+        for side in (0, 1):
+            distance, status = values[side], values[4 + side]
+            for local in range(len(status)):
+                if status[local] and distance[local] > layer:
+                    status[local] = 0
+                    distance[local] = 0
+
+    arrays = store.arrays
+    starts = store.starts
+    for part in parts:
+        base = store.starts[part]
+        for pair in store.pairs(part):
+            if not index.pair_black_width[pair]:
+                continue
+            moves = _pair_moves(index, pair)
+            first = index.pair_offset[pair] - base
+            for side in (0, 1):
+                offsets, targets = moves[side]
+                for slot in range(len(offsets) - 1):
+                    values = arrays(part)
+                    local = first + slot
+                    if values[4 + side][local]:
+                        continue
+                    left = 0
+                    for target in targets[offsets[slot]:offsets[slot + 1]]:
+                        target_part = bisect_right(starts, target) - 1
+                        opponent = arrays(target_part)
+                        target -= starts[target_part]
+                        if not (opponent[5 - side][target] == 1 and opponent[1 - side][target] < layer):
+                            left += 1
+                    arrays(part)[2 + side][local] = left
+
+
+def _expand_layer(store, items, push):
+    """
+    Обработка пачки фронта — то же, что тело цикла run_retrograde_analysis без хранимого
+    графа: предшественники генерируются, их статусы и счётчики меняются в файлах частей,
+    решённые дописываются через push.
+    """
+    index = store.index
+    unmoves = index.generate_unmoves_from_masks
+    unrank_state = index.unrank_state
+    unpack_state = index.board.unpack_state
+    arrays = store.arrays
+    opened = store.opened.get
+    starts = store.starts
+    for item in items:
+        idx = item >> 1
+        side = item & 1
+        part = bisect_right(starts, idx) - 1
+        values = arrays(part)
+        current_status = values[4 + side][idx - starts[part]]
+        next_distance = values[side][idx - starts[part]] + 1
+        # в позицию с ходом чёрных пришли ходом красных, и наоборот
+        prev_side = side ^ 1
+        predecessors = unmoves(*unpack_state(unrank_state(idx)), COLOR_RED if side else COLOR_BLACK)
+
+        for prev_idx in predecessors:
+            part = bisect_right(starts, prev_idx) - 1
+            values = opened(part) or arrays(part)
+            local = prev_idx - starts[part]
+            prev_status = values[4 + prev_side]
+            if prev_status[local]:
+                continue
+
+            if current_status == -1:
+                prev_status[local] = 1
+                values[prev_side][local] = next_distance
+                push(prev_idx << 1 | prev_side)
+            else:  # current_status == 1
+                remaining = values[2 + prev_side]
+                left = remaining[local] - 1
+                remaining[local] = left
+                if not left:
+                    prev_status[local] = -1
+                    values[prev_side][local] = next_distance
+                    push(prev_idx << 1 | prev_side)
+
+
+def _open_solve_dir(index, directory, partition_states, max_open):
+    """PartitionStore каталога, поля его checkpoint.json и сам checkpoint (None, если решения ещё нет)."""
+    rules = index.rules
+    # ходов из позиции не больше, чем камней, умноженных на соседей клетки
+    counter_type = "B" if rules.stones * max(map(len, rules.neighbors.values())) < 256 else "H"
+    store = PartitionStore(directory, index, partition_states, max_open, counter_type)
+    fields = {"version": SOLVE_DIR_VERSION, "rules": rules.fingerprint().hex(), "states": len(index),
+              "partition_states": partition_states, "counter_type": counter_type}
+    checkpoint = None
+    try:
+        with open(os.path.join(directory, "checkpoint.json"), encoding="utf-8") as source:
+            checkpoint = json.load(source)
+    except FileNotFoundError:
+        pass
+    if checkpoint is not None and any(checkpoint.get(key) != value for key, value in fields.items()):
+        raise ValueError(f"в каталоге {directory} решение других правил или с другим делением на части")
+    return store, fields, checkpoint
+
+
+def open_solve_dir(index, directory, max_open=64):
+    """
+    Каталог solve_on_disk без продолжения решения: (PartitionStore, слой последней
+    контрольной точки, решение закончено). Позиции с расстоянием не больше этого слоя
+    решены окончательно, даже если решение прервано. Деление на части берётся из
+    checkpoint.json; ValueError, если решения нет или оно для других правил.
+    """
+    try:
+        with open(os.path.join(directory, "checkpoint.json"), encoding="utf-8") as source:
+            partition_states = json.load(source).get("partition_states")
+    except FileNotFoundError:
+        raise ValueError(f"в каталоге {directory} нет решения") from None
+    store, _, checkpoint = _open_solve_dir(index, directory, partition_states, max_open)
+    return store, checkpoint["layer"], checkpoint["done"]
+
+
+def solve_on_disk(index, directory, partition_states=PARTITION_STATES, checkpoint_every=60.0, max_open=64,
+                  stats=None):
+    """
+    Ретроградный анализ, как run_retrograde_analysis, но для досок, чьи массивы не
+    помещаются в память: статусы, расстояния и счётчики ходов лежат по частям
+    в каталоге directory (PartitionStore), а графа переходов нет вовсе — ходы
+    и предшественники генерируются на лету. Очередь разбита на слои (позиции,
+    решённые на одном расстоянии, — FIFO обходит их подряд), фронт каждого слоя
+    пишется в файл и читается пачками.
+
+    После слоя, если с прошлой контрольной точки прошло checkpoint_every секунд
+    (0 — после каждого слоя), части сбрасываются на диск и пишется checkpoint.json.
+    Повторный вызов с тем же каталогом продолжает прерванное решение с последней
+    точки, а законченное просто открывает. Каталог с решением других правил
+    или другого деления на части — ValueError.
+    stats — SolverStats: initial_queue и queue_high_water считаются по фронту слоя,
+    плюс partitions, checkpoints и resumed_layer.
+    Возвращает PartitionStore; статусы и расстояния совпадают с run_retrograde_analysis.
+    """
+    os.makedirs(directory, exist_ok=True)
+    store, fields, checkpoint = _open_solve_dir(index, directory, partition_states, max_open)
+    if stats is not None:
+        stats.set("partitions", len(store))
+
+    if checkpoint is None:
+        layer = 0
+        with open(_layer_path(directory, 0), "wb") as out:
+            frontier = _init_partitions(store, out)
+        store.flush()
+        _write_checkpoint(directory, dict(fields, layer=0, frontier=frontier, done=False))
+        if stats is not None:
+            stats.set("initial_queue", frontier)
+    else:
+        layer, frontier = checkpoint["layer"], checkpoint["frontier"]
+        if checkpoint["done"]:
+            return store
+        # файл следующего слоя создаётся до первой правки частей: он есть — правки были
+        numbers = _layer_numbers(directory)
+        if any(number > layer for number in numbers):
+            _repair_partitions(store, layer)
+        for number in numbers:
+            if number != layer:
+                os.remove(_layer_path(directory, number))
+        if stats is not None:
+            stats.set("resumed_layer", layer)
+
+    saved = layer
+    saved_at = time.perf_counter()
+    checkpoints = 0
+    front = array("Q")
+    while frontier:
+        if stats is not None:
+            stats.maximum("queue_high_water", frontier)
+        if layer != saved and time.perf_counter() - saved_at >= checkpoint_every:
+            store.flush()
+            _write_checkpoint(directory, dict(fields, layer=layer, frontier=frontier, done=False))
+            os.remove(_layer_path(directory, saved))
+            saved = layer
+            saved_at = time.perf_counter()
+            checkpoints += 1
+
+        frontier = 0
+        with open(_layer_path(directory, layer + 1), "wb") as out:
+            for items in _read_layer(_layer_path(directory, layer)):
+                _expand_layer(store, items, front.append)
+                frontier += len(front)
+                front.tofile(out)
+                del front[:]
+        if layer != saved:
+            os.remove(_layer_path(directory, layer))
+        layer += 1
+
+    store.flush()
+    _write_checkpoint(directory, dict(fields, layer=layer, frontier=0, done=True))
+    for number in _layer_numbers(directory):
+        os.remove(_layer_path(directory, number))
+    if stats is not None:
+        stats.set("checkpoints", checkpoints)
+    return store
+
+
+# ==============================
+#  Статистика
+# ==============================
+
+class SolverStats:
+    """
+    Таймеры фаз и счётчики решателя (Solver(stats=SolverStats())). Всё, что можно
+    посчитать по готовым таблицам, считается только в Solver.statistics(), а в горячих
+    циклах ничего не проверяется: без stats решатель работает как обычно.
+    profile — запускать каждую фазу под cProfile и сохранять верх профиля;
+    profile_dir — ещё и писать профили фаз в файлы <фаза>.prof.
+    """
+
+    def __init__(self, profile=False, profile_dir=None, profile_lines=20):
+        self.phases = {}
+        self.counters = {}
+        self.profiles = {}
+        self.profile = profile or profile_dir is not None
+        self.profile_dir = profile_dir
+        self.profile_lines = profile_lines
+        self._profiling = False
+
+    @contextmanager
+    def phase(self, name):
+        """Замер фазы name (время суммируется при повторных входах)."""
+        profiler = None
+        if self.profile and not self._profiling:
+            # вложенные фазы попадают в профиль внешней
+            profiler = cProfile.Profile()
+            self._profiling = True
+            profiler.enable()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - started
+            if profiler is not None:
+                profiler.disable()
+                self._profiling = False
+                self._save_profile(name, profiler)
+
+    def _save_profile(self, name, profiler):
+        if self.profile_dir is not None:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            profiler.dump_stats(os.path.join(self.profile_dir, f"{name}.prof"))
+        text = io.StringIO()
+        pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(self.profile_lines)
+        self.profiles[name] = text.getvalue()
+
+    def set(self, name, value):
+        self.counters[name] = value
+
+    def add(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def maximum(self, name, value):
+        if value > self.counters.get(name, value - 1):
+            self.counters[name] = value
+
+    def report(self):
+        return {"phases": dict(self.phases), "counters": dict(self.counters), "profiles": dict(self.profiles)}
+
+
+def forbidden_option_histogram(index):
+    """Число состояний по ширине пары: "запретов красных x запретов чёрных" (с «нет запрета»)."""
+    histogram = {}
+    for pair in range(index.pair_count):
+        black_width = index.pair_black_width[pair]
+        if not black_width:
+            continue
+        size = index.pair_offset[pair + 1] - index.pair_offset[pair]
+        key = f"{size // black_width}x{black_width}"
+        histogram[key] = histogram.get(key, 0) + size
+    return dict(sorted(histogram.items(), key=lambda item: tuple(map(int, item[0].split("x")))))
+
+
+def layer_statistics(status, distance, incoming=None):
+    """
+    По слоям ретроградного анализа (слой — расстояние: очередь обрабатывается слоями):
+    [{"layer", "nodes", "edges"}] — решённых на слое узлов (оба цвета) и просмотренных
+    у них предшественников. incoming — по цветам ходящего таблица предшественников
+    (для позиций с ходом чёрных — входящие ходы красных); без неё edges не считаются.
+    """
+    layers = {}
+    for color in (COLOR_RED, COLOR_BLACK):
+        color_distance = distance[color]
+        predecessors = None if incoming is None else incoming[color]
+        for idx, value in enumerate(status[color]):
+            if not value:
+                continue
+            entry = layers.setdefault(color_distance[idx], [0, 0])
+            entry[0] += 1
+            if predecessors is not None:
+                entry[1] += predecessors.degree(idx)
+    return [{"layer": layer, "nodes": nodes, "edges": edges if incoming is not None else None}
+            for layer, (nodes, edges) in sorted(layers.items())]
+
+
+# ==============================
+#  Решатель
+# ==============================
+
+class Solver:
+    """
+    Ленивый решатель: индекс состояний, переходы и статусы строятся при первом
+    обращении к соответствующему свойству и дальше переиспользуются.
+    Поиск индекса позиции не требует ни переходов, ни ретроградного анализа.
+    """
+
+    def __init__(self, cache_path=None, engine="queue", symmetry=False, rules=None, stats=None, workers=1,
+                 unmoves=False, solve_dir=None, checkpoint_every=60.0, partition_states=PARTITION_STATES):
+        """
+        rules — набор правил (Ruleset), по умолчанию DEFAULT_RULES.
+        cache_path — файл таблицы (см. save_tablebase). Если он подходит к текущим
+        правилам, всё читается из него через mmap; иначе таблица считается заново
+        и записывается туда после ретроградного анализа.
+        engine — движок ретроградного анализа из RETROGRADE_ENGINES.
+        symmetry — решать только канонические состояния (SymmetryReduction); индексы
+        и статусы снаружи остаются прежними, ходы генерируются на лету, а лучший
+        ход выбирается по статусам продолжений. Файл таблицы при этом не используется.
+        stats — SolverStats: замер фаз и счётчики, отчёт — statistics(). Без него
+        (по умолчанию) решатель ничего не меряет.
+        workers — процессов для построения графа переходов (build_transition_maps).
+        unmoves — не хранить граф переходов (build_generated_transitions): ходы и
+        предшественники генерируются на лету, в памяти только статусы, расстояния и
+        счётчики ходов; лучший ход, как с symmetry, выбирается по статусам продолжений.
+        solve_dir — решать на диске (solve_on_disk) в этом каталоге с контрольными точками
+        раз в checkpoint_every секунд и частями по partition_states состояний; прерванное
+        решение продолжается, готовое читается. Графа переходов при этом нет, как с unmoves.
+        """
+        if engine not in RETROGRADE_ENGINES:
+            raise ValueError(f"неизвестный движок: {engine!r}")
+        if symmetry and (cache_path is not None or engine != "queue"):
+            raise ValueError("симметрии совместимы только с движком queue и без файла таблицы")
+        if unmoves and (symmetry or cache_path is not None or engine != "queue"):
+            raise ValueError("генерация предшественников совместима только с движком queue,"
+                             " без симметрий и файла таблицы")
+        if solve_dir is not None and (symmetry or cache_path is not None or engine != "queue"):
+            raise ValueError("решение на диске совместимо только с движком queue, без симметрий и файла таблицы")
+        self.rules = DEFAULT_RULES if rules is None else rules
+        self.cache_path = cache_path
+        self.engine = engine
+        self.symmetry = symmetry
+        self.stats = stats
+        self.workers = workers
+        self.unmoves = unmoves or solve_dir is not None
+        self.solve_dir = solve_dir
+        self.checkpoint_every = checkpoint_every
+        self.partition_states = partition_states
+        self._cache_checked = cache_path is None
+        self._index = None
+        self._reduction = None
+        self._transitions = None
+        self._status = None
+        self._distance = None
+        self._best_moves = None
+        self._reachable = None
+
+    def _phase(self, name):
+        return nullcontext() if self.stats is None else self.stats.phase(name)
+
+    def _load_cache(self):
+        self._cache_checked = True
+        with self._phase("load_table"):
+            sections = open_tablebase(self.cache_path, self.rules)
+        if sections is None:
+            return
+
+        self._index = StateIndex(self.rules, tables=(sections["pair_offset"], sections["pair_black_width"],
+                                                     sections["pair_flags"], sections["packed_states"]))
+        self._transitions = (
+            TransitionTable(sections["red_offsets"], sections["red_targets"]),
+            TransitionTable(sections["black_offsets"], sections["black_targets"]),
+            TransitionTable(sections["red_in_offsets"], sections["red_in_sources"]),
+            TransitionTable(sections["black_in_offsets"], sections["black_in_sources"]),
+        )
+        self._status = {COLOR_RED: sections["red_status"], COLOR_BLACK: sections["black_status"]}
+        self._distance = {COLOR_RED: sections["red_distance"], COLOR_BLACK: sections["black_distance"]}
+        self._best_moves = {COLOR_RED: sections["red_best"], COLOR_BLACK: sections["black_best"]}
+
+    @property
+    def index(self):
+        if not self._cache_checked:
+            self._load_cache()
+        if self._index is None:
+            with self._phase("index"):
+                self._index = StateIndex(self.rules, keep_states=False)
+        return self._index
+
+    @property
+    def board(self):
+        return self.rules.board
+
+    @property
+    def reduction(self):
+        if self._reduction is None:
+            index = self.index
+            with self._phase("symmetry_reduction"):
+                self._reduction = SymmetryReduction(index)
+        return self._reduction
+
+    @property
+    def transitions(self):
+        if not self._cache_checked:
+            self._load_cache()
+        if self._transitions is None and self.unmoves:
+            self._transitions = build_generated_transitions(self.index)
+        elif self._transitions is None:
+            index = self.index
+            with self._phase("transitions"):
+                self._transitions = build_transition_maps(index, self.workers)
+        return self._transitions
+
+    @property
+    def outgoing_red(self):
+        if self.symmetry and self._transitions is None:
+            return GeneratedMoves(self.index, COLOR_RED)
+        return self.transitions[0]
+
+    @property
+    def outgoing_black(self):
+        if self.symmetry and self._transitions is None:
+            return GeneratedMoves(self.index, COLOR_BLACK)
+        return self.transitions[1]
+
+    @property
+    def predecessor_map_red(self):
+        return self.transitions[2]
+
+    @property
+    def predecessor_map_black(self):
+        return self.transitions[3]
+
+    def _solve(self):
+        if not self._cache_checked:
+            self._load_cache()
+        if self._status is None and self.symmetry:
+            reduction = self.reduction
+            with self._phase("symmetry_graph"):
+                graph = reduction.build_graph()
+            with self._phase("solve"):
+                status, distance = run_symmetric_retrograde_analysis(reduction, graph)
+            self._status = {color: SymmetricTable(reduction, status, color) for color in (COLOR_RED, COLOR_BLACK)}
+            self._distance = {color: SymmetricTable(reduction, distance, color) for color in (COLOR_RED, COLOR_BLACK)}
+        elif self._status is None and self.solve_dir is not None:
+            index = self.index
+            with self._phase("solve"):
+                store = solve_on_disk(index, self.solve_dir, self.partition_states, self.checkpoint_every,
+                                      stats=self.stats)
+                self._status, self._distance = store.gather()
+                store.close()
+        elif self._status is None:
+            index, transitions = self.index, self.transitions
+            with self._phase("solve"):
+                self._status, self._distance = RETROGRADE_ENGINES[self.engine](index, transitions, self.stats)
+            if not self.unmoves:
+                with self._phase("best_moves"):
+                    self._best_moves = build_best_moves(transitions, self._status, self._distance)
+            if self.cache_path is not None:
+                with self._phase("save_table"):
+                    save_tablebase(self, self.cache_path)
+
+    @property
+    def retro_status(self):
+        self._solve()
+        return self._status
+
+    @property
+    def retro_distance(self):
+        """Полуходов до конца партии при лучшей игре, по цветам (см. run_retrograde_analysis)."""
+        self._solve()
+        return self._distance
+
+    @property
+    def best_moves(self):
+        """Таблица лучших ходов (build_best_moves); с симметриями и без графа (unmoves) — None."""
+        self._solve()
+        return self._best_moves
+
+    @property
+    def reachable(self):
+        """Достижимые со старта позиции по цветам ходящего (find_reachable)."""
+        if self._reachable is None:
+            moves = (self.outgoing_red, self.outgoing_black)
+            with self._phase("reachable"):
+                self._reachable = find_reachable(self.index, moves)
+        return self._reachable
+
+    def best_move(self, index, color):
+        """Лучший ход из позиции: индекс позиции после хода или None."""
+        if self.best_moves is None:
+            options = self.outgoing(color)[index]
+            current = self.retro_status[color][index]
+            if not options or (current and not self.retro_distance[color][index]):
+                return None
+            opponent = COLOR_BLACK if color == COLOR_RED else COLOR_RED
+            return options[choose_best_move(options, current, self.retro_status[opponent],
+                                            self.retro_distance[opponent])]
+
+        choice = self.best_moves[color][index]
+        if choice == NO_MOVE:
+            return None
+        moves = self.outgoing(color)
+        return moves.targets[moves.offsets[index] + choice]
+
+    def statistics(self):
+        """
+        Отчёт для JSON (None без stats): правила, время фаз, счётчики и профили SolverStats
+        плюс посчитанное по готовым таблицам — состояния (и отброшенные «мельница у обоих»),
+        состояния по числу запретов, ходы по цветам, слои ретроградного анализа.
+        """
+        if self.stats is None:
+            return None
+        report = {"rules": self.rules.name, "engine": self.engine, "symmetry": self.symmetry,
+                  "unmoves": self.unmoves, "solve_dir": self.solve_dir}
+        report.update(self.stats.report())
+        counters = report["counters"]
+        index = self.index
+        counters["states"] = len(index)
+        if index.filtered_states is not None:
+            counters["filtered_both_mill_pairs"] = index.filtered_pairs
+            counters["filtered_both_mill_states"] = index.filtered_states
+        if self._reduction is not None:
+            counters["canonical_states"] = len(self._reduction)
+        if self._reachable is not None:
+            counters["reachable_red"] = self._reachable[COLOR_RED].count(1)
+            counters["reachable_black"] = self._reachable[COLOR_BLACK].count(1)
+        report["states_by_forbidden_options"] = forbidden_option_histogram(index)
+
+        incoming = None
+        if self._transitions is not None:
+            outgoing_red, outgoing_black, predecessor_map_red, predecessor_map_black = self._transitions
+            if not self.unmoves:
+                counters["edges_red"] = outgoing_red.edge_count()
+                counters["edges_black"] = outgoing_black.edge_count()
+            # в позицию с ходом чёрных приходят ходом красных, и наоборот
+            incoming = {COLOR_RED: predecessor_map_black, COLOR_BLACK: predecessor_map_red}
+        if self._status is not None:
+            report["layers"] = layer_statistics(self._status, self._distance, incoming)
+            counters["layers"] = len(report["layers"])
+        return report
+
+    def __len__(self):
+        return len(self.index)
+
+    def outgoing(self, color):
+        return self.outgoing_red if color == COLOR_RED else self.outgoing_black
+
+    def state_at(self, index):
+        return self.index.state_at(index)
+
+    def lookup_state_index(self, red_cells, black_cells, red_forbidden=None, black_forbidden=None):
+        return self.index.lookup_state_index(red_cells, black_cells, red_forbidden, black_forbidden)
+
+
+_default_solver = None
+
+
+def get_solver():
+    """Общий решатель модуля; создаётся при первом вызове."""
+    global _default_solver
+    if _default_solver is None:
+        _default_solver = Solver()
+    return _default_solver
+
+
+def lookup_state_index(red_cells, black_cells, red_forbidden=None, black_forbidden=None):
+    return get_solver().lookup_state_index(red_cells, black_cells, red_forbidden, black_forbidden)
+
+
+# ==============================
+#  Достижимость
+# ==============================
+
+def find_reachable(index, moves=None):
+    """
+    Проход вперёд от стартовой позиции (ходят красные): какие позиции встречаются
+    в партии при ходе каждого цвета — {цвет: bytearray}, 1 у достижимых индексов.
+    Позиция с мельницей — конец партии, ходы из неё не просматриваются.
+    moves — (ходы красных, ходы чёрных), например Solver.outgoing_red/outgoing_black;
+    без них ходы генерируются на лету. Если старта нет в словаре, достижимых нет.
+    """
+    total = len(index)
+    reached = (bytearray(total), bytearray(total))
+    start = index.lookup_state_index(index.rules.red_start, index.rules.black_start)
+    if start is None:
+        return {COLOR_RED: reached[0], COLOR_BLACK: reached[1]}
+    if moves is None:
+        moves = (GeneratedMoves(index, COLOR_RED), GeneratedMoves(index, COLOR_BLACK))
+    mill_flags = index.rules.mill_flags
+    unpack_state = index.board.unpack_state
+    unrank_state = index.unrank_state
+
+    # Элемент очереди: idx << 1 | сторона (0 — ходят красные, 1 — чёрные)
+    reached[0][start] = 1
+    queue = deque([start << 1])
+    popleft = queue.popleft
+    push = queue.append
+    while queue:
+        node = popleft()
+        idx, side = node >> 1, node & 1
+        red_mask, black_mask, _, _ = unpack_state(unrank_state(idx))
+        if mill_flags[red_mask] & RED_MILL or mill_flags[black_mask] & BLACK_MILL:
+            continue
+        marks = reached[side ^ 1]
+        for target in moves[side][idx]:
+            if not marks[target]:
+                marks[target] = 1
+                push(target << 1 | (side ^ 1))
+    return {COLOR_RED: reached[0], COLOR_BLACK: reached[1]}
+
+
+# ==============================
+#  Пересчёт после правки правил
+# ==============================
+
+def _rules_differ_only_in_moves(old, new):
+    """Правки, которые пересчитываются по частям: соседство и первые ходы красных."""
+    return (old.board == new.board and old.stones == new.stones and old.winning_lines == new.winning_lines
+            and old.red_start == new.red_start and old.black_start == new.black_start
+            and old.no_undo == new.no_undo)
+
+
+def changed_cells(old, new):
+    """Клетки, у которых в new другие соседи, чем в old (маска доски)."""
+    board = new.board
+    return board.cells_to_mask([cell for cell in board.cells if old.neighbors[cell] != new.neighbors[cell]])
+
+
+def map_states(old_index, new_index):
+    """
+    Соответствие состояний двух индексов одной доски и числа камней: (old_of_new, new_of_old),
+    -1 — состояния в другом индексе нет. Пары, у которых списки запретов совпали,
+    сопоставляются сдвигом, остальные — по кодам запретов.
+    """
+    old_of_new = array("q", [-1]) * len(new_index)
+    new_of_old = array("q", [-1]) * len(old_index)
+    for pair in range(new_index.pair_count):
+        new_width = new_index.pair_black_width[pair]
+        old_width = old_index.pair_black_width[pair]
+        if not new_width or not old_width:
+            continue
+        new_start = new_index.pair_offset[pair]
+        old_start = old_index.pair_offset[pair]
+        new_codes = new_index.pair_codes(pair)
+        old_codes = old_index.pair_codes(pair)
+        if new_codes == old_codes:
+            size = new_index.pair_offset[pair + 1] - new_start
+            old_of_new[new_start:new_start + size] = array("q", range(old_start, old_start + size))
+            new_of_old[old_start:old_start + size] = array("q", range(new_start, new_start + size))
+            continue
+        old_red_slot = {code: slot for slot, code in enumerate(old_codes[0])}
+        old_black_slot = {code: slot for slot, code in enumerate(old_codes[1])}
+        for red_slot, red_code in enumerate(new_codes[0]):
+            old_red = old_red_slot.get(red_code)
+            if old_red is None:
+                continue
+            for black_slot, black_code in enumerate(new_codes[1]):
+                old_black = old_black_slot.get(black_code)
+                if old_black is not None:
+                    old_idx = old_start + old_red * old_width + old_black
+                    new_idx = new_start + red_slot * new_width + black_slot
+                    old_of_new[new_idx] = old_idx
+                    new_of_old[old_idx] = new_idx
+    return old_of_new, new_of_old
+
+
+def _move_sources(index, packed, side):
+    """
+    Состояния index, из которых ход стороны side (0 — красные) мог привести в packed:
+    запрет ходящего (куда, откуда) указывает, какой камень вернуть. Свой запрет
+    у источника — любой из допустимых.
+    """
+    board = index.board
+    fields = list(board.unpack_state(packed))
+    forbidden = board.code_to_forbidden(fields[2 + side])
+    if forbidden is None:
+        return
+    dst, src = forbidden
+    fields[side] = fields[side] & ~board.cell_to_bit[dst] | board.cell_to_bit[src]
+    rank = index.sets.rank
+    red_rank, black_rank = rank[fields[0]], rank[fields[1]]
+    if red_rank < 0 or black_rank < 0 or fields[0] & fields[1]:
+        return
+    for code in index.pair_codes(red_rank * index.sets.count + black_rank)[side]:
+        fields[2 + side] = code
+        source = index.rank_state(*fields)
+        if source is not None:
+            yield source
+
+
+def _mapped_runs(old_of_new, skip=None):
+    """
+    Отрезки нового индекса (начало, конец, начало в старом), где состояния идут подряд
+    и в старом индексе; skip — метки позиций, которые в отрезки не входят.
+    """
+    total = len(old_of_new)
+    idx = 0
+    while idx < total:
+        if old_of_new[idx] < 0 or (skip is not None and skip[idx]):
+            idx += 1
+            continue
+        start = idx
+        shift = old_of_new[idx] - idx
+        idx += 1
+        while idx < total and old_of_new[idx] - idx == shift and (skip is None or not skip[idx]):
+            idx += 1
+        yield start, idx, start + shift
+
+
+def _remap_table(old_table, total, old_of_new, new_of_old, marks, rebuild):
+    """
+    Таблица переходов для нового индекса: у позиций с меткой marks (и новых) список
+    строит rebuild(idx), у остальных — старый с переводом индексов, отрезками подряд.
+    """
+    old_offsets, old_targets = old_table.offsets, old_table.targets
+    offsets = array("Q", [0])
+    targets = array("I" if total < 1 << 32 else "Q")
+    same_numbering = len(old_of_new) == len(new_of_old) and all(map(eq, new_of_old, range(total)))
+    position = 0
+    for start, end, old_start in chain(_mapped_runs(old_of_new, marks), ((total, total, 0),)):
+        for idx in range(position, start):
+            targets.extend(rebuild(idx))
+            offsets.append(len(targets))
+        if end > start:
+            first, last = old_offsets[old_start], old_offsets[old_start + end - start]
+            offsets.extend(map(add, old_offsets[old_start + 1:old_start + end - start + 1],
+                               repeat(len(targets) - first)))
+            run = old_targets[first:last]
+            targets.extend(run if same_numbering else map(new_of_old.__getitem__, run))
+        position = end
+    return TransitionTable(offsets, targets)
+
+
+def _remap_transitions(old_transitions, index, old_of_new, new_of_old, affected):
+    """
+    Четыре таблицы переходов нового индекса (как build_transition_maps) по старым:
+    ходы затронутых позиций (affected — метки по сторонам) генерируются заново,
+    у остальных переводятся индексы. Обратные таблицы правятся только у позиций,
+    в которые ведут изменившиеся ходы; если нумерация состояний не монотонна,
+    они строятся заново. Возвращает (таблицы, изменившиеся позиции по сторонам).
+    """
+    total = len(index)
+    unpack_state = index.board.unpack_state
+    mapped = [idx for idx in new_of_old if idx >= 0]
+    monotone = all(map(lt, mapped, mapped[1:]))
+    outgoing, incoming, changed = [], [], []
+    for side, color in enumerate((COLOR_RED, COLOR_BLACK)):
+        old_moves = old_transitions[side]
+        side_changed = {}
+
+        def rebuild_moves(idx):
+            old_idx = old_of_new[idx]
+            previous = None if old_idx < 0 else [new_of_old[target] for target in old_moves[old_idx]]
+            moves = index.generate_moves_from_masks(*unpack_state(index.unrank_state(idx)), color)
+            if moves != previous:
+                side_changed[idx] = moves
+            return moves
+
+        moves = _remap_table(old_moves, total, old_of_new, new_of_old, affected[side], rebuild_moves)
+        outgoing.append(moves)
+        changed.append(sorted(side_changed))
+        if not monotone:
+            incoming.append(moves.inverted())
+            continue
+
+        # позиции, у которых меняются входящие: цели старых и новых ходов изменившихся
+        # позиций и цели ходов исчезнувших
+        touched = bytearray(total)
+        arrivals = {}
+        for source, targets in side_changed.items():
+            for target in targets:
+                touched[target] = 1
+                arrivals.setdefault(target, []).append(source)
+        old_sources = [old_of_new[idx] for idx in side_changed if old_of_new[idx] >= 0]
+        old_sources += [idx for idx in range(len(new_of_old)) if new_of_old[idx] < 0]
+        for old_source in old_sources:
+            for target in old_moves[old_source]:
+                if new_of_old[target] >= 0:
+                    touched[new_of_old[target]] = 1
+        old_incoming = old_transitions[2 + side]
+
+        def rebuild_sources(idx):
+            old_idx = old_of_new[idx]
+            sources = [] if old_idx < 0 else [new_of_old[source] for source in old_incoming[old_idx]
+                                               if new_of_old[source] >= 0 and new_of_old[source] not in side_changed]
+            return sorted(sources + arrivals.get(idx, []))
+
+        incoming.append(_remap_table(old_incoming, total, old_of_new, new_of_old, touched, rebuild_sources))
+    return (outgoing[0], outgoing[1], incoming[0], incoming[1]), changed
+
+
+def solve_incremental(solver, rules):
+    """
+    Решение для правил rules по решённому solver: если правила отличаются только
+    соседством или первыми ходами красных, заново строятся ходы лишь затронутых
+    позиций (новых, с камнем ходящего на клетке с другими соседями, ведущих в
+    появившиеся или исчезнувшие состояния), а статусы пересчитываются только в
+    обратном конусе позиций, чьи ходы изменились; остальное берётся из solver
+    по соответствию map_states. Иначе — полный пересчёт. Если затронута или попала
+    в конус бо́льшая часть графа, граф или анализ строятся целиком: так быстрее.
+
+    Возвращает (новый Solver, отчёт): сколько состояний добавилось и исчезло,
+    сколько позиций построено заново (recomputed), у скольких изменились ходы
+    (changed) и сколько узлов (позиция, кто ходит) попало в конус (cone).
+    """
+    started = time.perf_counter()
+    if solver.symmetry:
+        raise ValueError("пересчёт по частям требует полной таблицы (без симметрий)")
+    old = solver.rules
+    fresh = Solver(rules=rules, engine=solver.engine, unmoves=solver.unmoves)
+    # без хранимого графа переиспользовать нечего
+    if solver.unmoves or not _rules_differ_only_in_moves(old, rules):
+        fresh.best_moves
+        return fresh, {"full": True, "states": len(fresh), "seconds": time.perf_counter() - started}
+
+    old_index = solver.index
+    old_status, old_distance, old_best = solver.retro_status, solver.retro_distance, solver.best_moves
+    old_transitions = solver.transitions
+    index = StateIndex(rules, keep_states=False)
+    total = len(index)
+    old_of_new, new_of_old = map_states(old_index, index)
+    moved_cells = changed_cells(old, rules)
+
+    # затронутые позиции по сторонам (0 — ходят красные): их ходы генерируются заново
+    affected = (bytearray(total), bytearray(total))
+    added = [idx for idx in range(total) if old_of_new[idx] < 0]
+    removed = [idx for idx in range(len(old_index)) if new_of_old[idx] < 0]
+    for side in (0, 1):
+        marks = affected[side]
+        for idx in added:
+            marks[idx] = 1
+            for source in _move_sources(index, index.unrank_state(idx), side):
+                marks[source] = 1
+        for idx in removed:
+            for source in old_transitions[2 + side][idx]:
+                if new_of_old[source] >= 0:
+                    marks[new_of_old[source]] = 1
+        for pair in range(index.pair_count):
+            start, end = index.pair_offset[pair], index.pair_offset[pair + 1]
+            if end > start and index.sets.masks[divmod(pair, index.sets.count)[side]] & moved_cells:
+                marks[start:end] = b"\1" * (end - start)
+    recomputed = affected[0].count(1) + affected[1].count(1)
+
+    if recomputed > total:
+        transitions = build_transition_maps(index)
+        changed = None
+    else:
+        transitions, (red_changed, black_changed) = _remap_transitions(old_transitions, index, old_of_new,
+                                                                       new_of_old, affected)
+        changed = [idx << 1 for idx in red_changed] + [idx << 1 | 1 for idx in black_changed]
+
+    # обратный конус: узлы, из которых можно дойти до изменившихся;
+    # в позицию с ходом красных приходят ходом чёрных, и наоборот
+    incoming = (transitions[3], transitions[2])
+    in_cone = (bytearray(total), bytearray(total))
+    cone = 0
+    if changed is not None:
+        for node in changed:
+            in_cone[node & 1][node >> 1] = 1
+        queue = deque(changed)
+        while queue and len(queue) + cone <= total:
+            node = queue.popleft()
+            cone += 1
+            side = node & 1
+            source_cone = in_cone[side ^ 1]
+            for source in incoming[side][node >> 1]:
+                if not source_cone[source]:
+                    source_cone[source] = 1
+                    queue.append(source << 1 | side ^ 1)
+        if queue:
+            changed = None
+
+    report = {"full": False, "states": total, "added": len(added), "removed": len(removed),
+              "recomputed": recomputed, "changed": None if changed is None else len(changed), "cone": 2 * total}
+    fresh._cache_checked = True
+    fresh._index = index
+    fresh._transitions = transitions
+    if changed is None:
+        # конус — бо́льшая часть графа: дешевле решить целиком
+        fresh.best_moves
+        report["seconds"] = time.perf_counter() - started
+        return fresh, report
+    report["cone"] = cone
+
+    status = {COLOR_RED: array("b", bytes(total)), COLOR_BLACK: array("b", bytes(total))}
+    distance = {COLOR_RED: array("H", bytes(2 * total)), COLOR_BLACK: array("H", bytes(2 * total))}
+    best_moves = {COLOR_RED: array("B", [NO_MOVE]) * total, COLOR_BLACK: array("B", [NO_MOVE]) * total}
+    for start, end, old_start in _mapped_runs(old_of_new):
+        old_end = old_start + end - start
+        for color in (COLOR_RED, COLOR_BLACK):
+            status[color][start:end] = old_status[color][old_start:old_end]
+            distance[color][start:end] = old_distance[color][old_start:old_end]
+            best_moves[color][start:end] = old_best[color][old_start:old_end]
+
+    # ретроградный анализ внутри конуса: решённые узлы вне его вбрасываются в очередь
+    # по своим расстояниям, так что слои идут в том же порядке, что и в run_retrograde_analysis
+    colors = (COLOR_RED, COLOR_BLACK)
+    mill_flags = rules.mill_flags
+    unpack_state = index.board.unpack_state
+    remaining = ({}, {})
+    layers = {}
+    for side, color in enumerate(colors):
+        opponent = colors[side ^ 1]
+        for idx in (idx for idx in range(total) if in_cone[side][idx]):
+            status[color][idx] = distance[color][idx] = 0
+            red_mask, black_mask, _, _ = unpack_state(index.unrank_state(idx))
+            degree = transitions[side].degree(idx)
+            if mill_flags[red_mask] & RED_MILL:
+                status[color][idx] = -1 if side else 1
+            elif mill_flags[black_mask] & BLACK_MILL:
+                status[color][idx] = 1 if side else -1
+            elif not degree:
+                status[color][idx] = -1
+            else:
+                remaining[side][idx] = degree
+                for target in transitions[side][idx]:
+                    if not in_cone[side ^ 1][target] and status[opponent][target]:
+                        layers.setdefault(distance[opponent][target], set()).add(target << 1 | side ^ 1)
+                continue
+            layers.setdefault(0, set()).add(idx << 1 | side)
+
+    layer = 0
+    while layers:
+        nodes = layers.pop(layer, ())
+        layer += 1
+        for node in sorted(nodes):
+            idx, side = node >> 1, node & 1
+            current = status[colors[side]][idx]
+            prev_status, prev_distance = status[colors[side ^ 1]], distance[colors[side ^ 1]]
+            prev_cone, prev_remaining = in_cone[side ^ 1], remaining[side ^ 1]
+            for prev_idx in incoming[side][idx]:
+                if not prev_cone[prev_idx] or prev_status[prev_idx]:
+                    continue
+                if current == 1 and prev_remaining[prev_idx] > 1:
+                    prev_remaining[prev_idx] -= 1
+                    continue
+                prev_status[prev_idx] = -current
+                prev_distance[prev_idx] = layer
+                layers.setdefault(layer, set()).add(prev_idx << 1 | side ^ 1)
+
+    for side, color in enumerate(colors):
+        opponent = colors[side ^ 1]
+        for idx in (idx for idx in range(total) if in_cone[side][idx]):
+            options = transitions[side][idx]
+            current = status[color][idx]
+            best_moves[color][idx] = NO_MOVE
+            if options and not (current and not distance[color][idx]):
+                best_moves[color][idx] = choose_best_move(options, current, status[opponent], distance[opponent])
+
+    fresh._status, fresh._distance, fresh._best_moves = status, distance, best_moves
+    report["seconds"] = time.perf_counter() - started
+    return fresh, report
+
+
+def apply_rule_edit(rules, command):
+    """
+    Правка правил одной строкой: «+A1 B2» / «-A1 B2» — добавить или убрать соседство
+    клеток, «first +A2,A3,B1» / «first -A2,A3,B1» — расстановку красных, после
+    которой у чёрных ещё нет запрета. ValueError при ошибке.
+    """
+    board = rules.board
+    words = command.split()
+    if len(words) == 2 and words[0] == "first" and words[1][:1] in "+-":
+        position = tuple(sorted(parse_cells(words[1][1:], board)))
+        if len(position) != rules.stones:
+            raise ValueError(f"расстановка — {rules.stones} клетки: {words[1][1:]!r}")
+        positions = set(rules.first_move_positions)
+        if words[1][0] == "+":
+            positions.add(position)
+        else:
+            positions.discard(position)
+        return rules.replace(first_move_positions=positions)
+    if len(words) == 2 and words[0][:1] in "+-":
+        (first,), (second,) = parse_cells(words[0][1:], board), parse_cells(words[1], board)
+        if first == second:
+            raise ValueError("клетка не может быть соседом самой себе")
+        neighbors_map = {cell: set(rules.neighbors[cell]) for cell in board.cells}
+        if words[0][0] == "+":
+            neighbors_map[first].add(second)
+            neighbors_map[second].add(first)
+        else:
+            neighbors_map[first].discard(second)
+            neighbors_map[second].discard(first)
+        return rules.replace(neighbors=neighbors_map)
+    raise ValueError(f"непонятная правка: {command!r}")
+
+
+def tune_rules(solver, lines, verify=False):
+    """
+    Цикл правок правил: каждая строка из lines — apply_rule_edit, после неё решение
+    пересчитывается solve_incremental и печатаются отчёт и исход стартовой позиции.
+    verify — ещё и сверять с полным пересчётом (compare_solutions). Возвращает
+    число правок, после которых решения разошлись.
+    """
+    labels = {1: "победа", -1: "поражение", 0: "не определено"}
+    failures = 0
+    solver.best_moves
+    for line in lines:
+        command = line.strip()
+        if command in ("quit", "exit"):
+            break
+        if not command or command.startswith("#"):
+            continue
+        try:
+            rules = apply_rule_edit(solver.rules, command)
+        except ValueError as exc:
+            print(f"   ошибка: {exc}")
+            continue
+        solver, report = solve_incremental(solver, rules)
+        if report["full"]:
+            print(f"   полный пересчёт: состояний {report['states']}, {report['seconds']:.2f} с")
+        else:
+            print(f"   состояний {report['states']} (+{report['added']} -{report['removed']}),"
+                  f" ходы заново у {report['recomputed']}, конус {report['cone']}, {report['seconds']:.2f} с")
+        start = solver.lookup_state_index(rules.red_start, rules.black_start)
+        if start is not None:
+            print(f"   старт (ход красных): {labels[solver.retro_status[COLOR_RED][start]]}")
+        if verify:
+            full = Solver(rules=rules, engine=solver.engine)
+            mismatches = compare_solutions(solver, full)
+            failures += bool(mismatches)
+            print(f"   проверка полным пересчётом: расхождений {mismatches}")
+    return failures
+
+
+def compare_solutions(first, second):
+    """
+    Сверка двух решений одних правил: число позиций (по обоим цветам), где разошлись
+    статус, расстояние, ходы, входящие ходы или лучший ход. Ноль — решения совпадают.
+    """
+    if len(first) != len(second):
+        return max(len(first), len(second))
+    mismatches = 0
+    for side, color in enumerate((COLOR_RED, COLOR_BLACK)):
+        tables = [(first.transitions[number], second.transitions[number]) for number in (side, side + 2)]
+        mismatches += sum(1 for idx in range(len(first))
+                          if first.retro_status[color][idx] != second.retro_status[color][idx]
+                          or first.retro_distance[color][idx] != second.retro_distance[color][idx]
+                          or first.best_move(idx, color) != second.best_move(idx, color)
+                          or any(list(table_a[idx]) != list(table_b[idx]) for table_a, table_b in tables))
+    return mismatches
+
+
+# ==============================
+#  Пакетный режим
+# ==============================
+
+def solve_ruleset(rules, engine="queue"):
+    """
+    Решает один набор правил и возвращает сводку:
+      - name, fingerprint (hex), states, edges — имя, хэш правил, число состояний и ходов;
+      - counts — по цветам (победа, поражение, не определено);
+      - longest — по цветам самая длинная форсированная партия в полуходах;
+      - start — по цветам статус стартовой позиции (None, если её нет в словаре).
+    """
+    solver = Solver(engine=engine, rules=rules)
+    status = solver.retro_status
+    distance = solver.retro_distance
+    start = solver.lookup_state_index(rules.red_start, rules.black_start)
+    summary = {
+        "name": rules.name,
+        "fingerprint": rules.fingerprint().hex(),
+        "states": len(solver),
+        "edges": solver.outgoing_red.edge_count() + solver.outgoing_black.edge_count(),
+        "counts": {},
+        "longest": {},
+        "start": {},
+    }
+    for color in (COLOR_RED, COLOR_BLACK):
+        wins = status[color].count(1)
+        losses = status[color].count(-1)
+        summary["counts"][color] = (wins, losses, len(status[color]) - wins - losses)
+        summary["longest"][color] = max(distance[color], default=0)
+        summary["start"][color] = None if start is None else status[color][start]
+    return summary
+
+
+def solve_rulesets(rulesets, jobs=None, engine="queue"):
+    """
+    Решает наборы правил в пуле процессов и возвращает сводки solve_ruleset в том же порядке.
+    jobs — число процессов (по умолчанию по числу ядер; 1 — в текущем процессе).
+
+    Не зависящие от правил таблицы (сочетания, ранги наборов камней) строятся при импорте
+    модуля, а таблицы ходов (build_move_tables) — заранее для каждого соседства; при запуске
+    процессов через fork пул наследует их, а не строит заново.
+    """
+    rulesets = list(rulesets)
+    if jobs == 1 or len(rulesets) <= 1:
+        return [solve_ruleset(rules, engine) for rules in rulesets]
+
+    for rules in rulesets:
+        build_move_tables(rules)
+    workers = min(jobs or os.cpu_count() or 1, len(rulesets))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(solve_ruleset, rulesets, [engine] * len(rulesets)))
+
+
+def forbidden_to_labels(forbidden, labels=None):
+    """Запрет (cur, prev) метками; labels — Board.cell_to_label (по умолчанию доска 3×3)."""
+    if forbidden is None:
+        return None
+    if labels is None:
+        labels = cell_to_label
+    return (labels[forbidden[0]], labels[forbidden[1]])
+
+
+def format_forbidden_field(forbidden_labels):
+    if forbidden_labels is None:
+        return "null"
+    return f"[{forbidden_labels[0]}, {forbidden_labels[1]}]"
+
+
+def print_sources_for_position(solver, index):
+    """
+    Показывает, из каких позиций можно попасть в указанную (раздельно по цветам).
+    """
+    labels = solver.board.cell_to_label
+    r, b, red_forbidden, black_forbidden = solver.state_at(index)
+    r_labels = tuple(labels[c] for c in r)
+    b_labels = tuple(labels[c] for c in b)
+    red_forbidden_labels = forbidden_to_labels(red_forbidden, labels)
+    black_forbidden_labels = forbidden_to_labels(black_forbidden, labels)
+
+    print(f"\nПозиция #{index}:  Red={r_labels}  Black={b_labels}")
+    print(f"   Запрет красных: {red_forbidden_labels}")
+    print(f"   Запрет чёрных: {black_forbidden_labels}")
+
+    red_sources = solver.predecessor_map_red[index]
+    black_sources = solver.predecessor_map_black[index]
+
+    if not red_sources and not black_sources:
+        print("   В эту позицию нельзя попасть одним ходом")
+        return
+
+    if red_sources:
+        print(f"   <- Красные ({len(red_sources)}):")
+        for src_idx in red_sources:
+            sr = tuple(labels[c] for c in solver.state_at(src_idx)[0])
+            sb = tuple(labels[c] for c in solver.state_at(src_idx)[1])
+            print(f"      #{src_idx}: Red={sr} Black={sb}")
+
+    if black_sources:
+        print(f"   <- Чёрные ({len(black_sources)}):")
+        for src_idx in black_sources:
+            sr = tuple(labels[c] for c in solver.state_at(src_idx)[0])
+            sb = tuple(labels[c] for c in solver.state_at(src_idx)[1])
+            print(f"      #{src_idx}: Red={sr} Black={sb}")
+
+
+def print_all_positions(solver, out=None):
+    """
+    Полный вывод всех позиций и их индексов (потоком, пачками строк).
+    """
+    labels = solver.board.cell_to_label
+    board = solver.board
+    lines = (f"#{idx}: Red={tuple(labels[c] for c in board.mask_to_cells(red_mask))}"
+             f"  Black={tuple(labels[c] for c in board.mask_to_cells(black_mask))}"
+             f"  R-ban={forbidden_to_labels(board.code_to_forbidden(red_code), labels)}"
+             f"  B-ban={forbidden_to_labels(board.code_to_forbidden(black_code), labels)}\n"
+             for idx, (red_mask, black_mask, red_code, black_code)
+             in enumerate(map(board.unpack_state, solver.index.iter_packed_states())))
+    out = sys.stdout if out is None else out
+    out.write("\nПолный список позиций:\n")
+    write_buffered(out, lines)
+
+
+def print_batch_summary(results):
+    """Сравнительная таблица сводок solve_rulesets."""
+    outcome = {1: "победа", -1: "поражение", 0: "не определено", None: "нет"}
+    print("\nСравнение наборов правил:")
+    for result in results:
+        print(f"\n[{result['name']}] состояний {result['states']}, ходов {result['edges']}"
+              f"  (правила {result['fingerprint'][:12]})")
+        for label, turn in (("Красные ходят", COLOR_RED), ("Чёрные ходят", COLOR_BLACK)):
+            wins, losses, draws = result["counts"][turn]
+            print(f" - {label}: победа {wins}, поражение {losses}, не определено {draws},"
+                  f" самая длинная партия {result['longest'][turn]} полуход.")
+        print(f"   Старт: ход красных — {outcome[result['start'][COLOR_RED]]},"
+              f" ход чёрных — {outcome[result['start'][COLOR_BLACK]]}")
+
+
+def print_retrograde_summary(status_map, distance_map=None):
+    print("\nРезультаты ретроградного анализа:")
+    # таблицы могут быть представлениями (SymmetricTable) — читаем каждую один раз
+    statuses = {turn: list(status_map[turn]) for turn in (COLOR_RED, COLOR_BLACK)}
+    for label, turn in (("Красные ходят", COLOR_RED), ("Чёрные ходят", COLOR_BLACK)):
+        data = statuses[turn]
+        wins = data.count(1)
+        losses = data.count(-1)
+        draws = len(data) - wins - losses
+        print(f" - {label}: победа {wins}, поражение {losses}, не определено {draws}")
+        if distance_map is not None:
+            distances = list(distance_map[turn])
+            longest = max(range(len(distances)), key=distances.__getitem__, default=None)
+            if longest is not None:
+                print(f"   самая длинная форсированная партия: {distances[longest]} полуход. (#{longest})")
+
+    # показать по нескольку позиций
+    for turn in (COLOR_RED, COLOR_BLACK):
+        wins = [idx for idx, val in enumerate(statuses[turn]) if val == 1][:5]
+        losses = [idx for idx, val in enumerate(statuses[turn]) if val == -1][:5]
+        print(f"\nПримеры для {'красных' if turn == COLOR_RED else 'чёрных'} (ход):")
+        print(f"   Победа: {wins}")
+        print(f"   Поражение: {losses}")
+
+
+def print_move_outcomes(solver, index, color):
+    """
+    Показывает статусы всех продолжений из позиции для заданного игрока.
+    """
+    labels = solver.board.cell_to_label
+    moves = solver.outgoing(color)
+    next_turn = COLOR_BLACK if color == COLOR_RED else COLOR_RED
+    label = 'красных' if color == COLOR_RED else 'чёрных'
+    retro_status = solver.retro_status
+    distance = solver.retro_distance[next_turn]
+
+    r_tuple, b_tuple, red_forbidden, black_forbidden = solver.state_at(index)
+    r = tuple(labels[c] for c in r_tuple)
+    b = tuple(labels[c] for c in b_tuple)
+    print(f"\nАнализ ходов для позиции #{index} (ход {label}): Red={r} Black={b}")
+    print(f"   Запрет красных: {forbidden_to_labels(red_forbidden, labels)}")
+    print(f"   Запрет чёрных: {forbidden_to_labels(black_forbidden, labels)}")
+
+    options = moves[index]
+    if not options:
+        print("   Ходов нет.")
+        return
+
+    best_win = []
+    forced_loss = []
+    undecided = []
+
+    for target in options:
+        status_next = retro_status[next_turn][target]
+        target_state = solver.state_at(target)
+        tr = tuple(labels[c] for c in target_state[0])
+        tb = tuple(labels[c] for c in target_state[1])
+        if status_next == -1:
+            best_win.append((target, tr, tb))
+        elif status_next == 1:
+            forced_loss.append((target, tr, tb))
+        else:
+            undecided.append((target, tr, tb))
+
+    if best_win:
+        print("   Гарантированная победа при ходе в:")
+        for idx, tr, tb in best_win:
+            print(f"      #{idx}: Red={tr} Black={tb}  (до конца {distance[idx] + 1} полуход.)")
+
+    if forced_loss:
+        print("   Ходы, ведущие к поражению:")
+        for idx, tr, tb in forced_loss:
+            print(f"      #{idx}: Red={tr} Black={tb}  (до конца {distance[idx] + 1} полуход.)")
+
+    if undecided:
+        print("   Ходы с неопределённым исходом:")
+        for idx, tr, tb in undecided:
+            print(f"      #{idx}: Red={tr} Black={tb}")
+
+
+def show_forced_win_moves(solver, index, color):
+    """
+    Если позиция выигрышна для текущего игрока, выводит ходы, сохраняющие победу.
+    color — кто должен ходить в позиции index.
+    """
+    labels = solver.board.cell_to_label
+    retro_status = solver.retro_status
+    status_val = retro_status[color][index]
+    if status_val != 1:
+        print(f"\nПозиция #{index} не является гарантированной победой для {color}.")
+        return
+
+    moves = solver.outgoing(color)
+    opponent = COLOR_BLACK if color == COLOR_RED else COLOR_RED
+    label = 'красных' if color == COLOR_RED else 'чёрных'
+    distance = solver.retro_distance
+    best = solver.best_move(index, color)
+
+    state = solver.state_at(index)
+    r = tuple(labels[c] for c in state[0])
+    b = tuple(labels[c] for c in state[1])
+    print(f"\nПозиция #{index}: Red={r} Black={b}")
+    print(f"Запрет красных: {forbidden_to_labels(state[2], labels)}")
+    print(f"Запрет чёрных: {forbidden_to_labels(state[3], labels)}")
+    print(f"Победа за {distance[color][index]} полуход.")
+    print(f"Ходы {label}, сохраняющие форсированную победу:")
+
+    for target in moves[index]:
+        if retro_status[opponent][target] == -1:
+            target_state = solver.state_at(target)
+            tr = tuple(labels[c] for c in target_state[0])
+            tb = tuple(labels[c] for c in target_state[1])
+            mark = "  <- быстрейший" if target == best else ""
+            print(f"   -> #{target}: Red={tr} Black={tb}  R-ban={forbidden_to_labels(target_state[2], labels)}  B-ban={forbidden_to_labels(target_state[3], labels)}  (до конца {distance[opponent][target] + 1}){mark}")
+
+
+def print_best_move(solver, index, color):
+    """
+    Выводит лучший ход из таблицы лучших ходов (одно чтение массива).
+    """
+    labels = solver.board.cell_to_label
+    status = solver.retro_status[color][index]
+    distance = solver.retro_distance[color][index]
+    target = solver.best_move(index, color)
+    outcome = {1: "победа", -1: "поражение", 0: "не определено"}[status]
+
+    r, b, red_forbidden, black_forbidden = solver.state_at(index)
+    print(f"\nПозиция #{index}: Red={tuple(labels[c] for c in r)} Black={tuple(labels[c] for c in b)}")
+    print(f"Ход {'красных' if color == COLOR_RED else 'чёрных'}: {outcome}"
+          + (f" за {distance} полуход." if status else ""))
+
+    if target is None:
+        print("   Ходить некуда.")
+        return
+    st = solver.state_at(target)
+    print(f"   -> #{target}: Red={tuple(labels[c] for c in st[0])} Black={tuple(labels[c] for c in st[1])}"
+          f"  R-ban={forbidden_to_labels(st[2], labels)}  B-ban={forbidden_to_labels(st[3], labels)}")
+
+
+# ==============================
+#  Удобная функция для проверки
+# ==============================
+
+def print_moves_for_position(solver, index, color):
+    """
+    Показывает все ходы для позиции с данным индексом.
+    color = COLOR_RED или COLOR_BLACK.
+    """
+    labels = solver.board.cell_to_label
+
+    r, b, red_forbidden, black_forbidden = solver.state_at(index)
+    r_labels = tuple(labels[c] for c in r)
+    b_labels = tuple(labels[c] for c in b)
+    print(f"\nПозиция #{index}:  Red={r_labels}  Black={b_labels}")
+    print(f"Запрет красных: {forbidden_to_labels(red_forbidden, labels)}")
+    print(f"Запрет чёрных: {forbidden_to_labels(black_forbidden, labels)}")
+    print(f"Ходы для {color}:")
+
+    result = solver.index.generate_moves_for_color(r, b, red_forbidden, black_forbidden, color)
+
+    if not result:
+        print("   Нет доступных ходов")
+        return
+
+    for idx in result:
+        st = solver.state_at(idx)
+        r2 = tuple(labels[c] for c in st[0])
+        b2 = tuple(labels[c] for c in st[1])
+        print(f"   -> #{idx}: Red={r2} Black={b2}  R-ban={forbidden_to_labels(st[2], labels)}  B-ban={forbidden_to_labels(st[3], labels)}")
+
+
+def iter_safe_transitions(solver, color=COLOR_BLACK, reachable=None):
+    """
+    Поток (индекс, состояние, ходы) по всем позициям в порядке индексов: ходы color,
+    после которых у соперника нет форсированной победы, — пары клеток (откуда, куда).
+    Позиции без таких ходов пропускаются; состояние — как у state_at.
+    reachable — Solver.reachable: только позиции, достижимые со старта при ходе color.
+    """
+    index = solver.index
+    board = index.board
+    cell_to_bit = board.cell_to_bit
+    adjacency = index.rules.neighbors
+    no_undo = index.rules.no_undo
+    opponent = COLOR_BLACK if color == COLOR_RED else COLOR_RED
+    opponent_status = solver.retro_status[opponent]
+    moves_red = color == COLOR_RED
+    marks = None if reachable is None else reachable[color]
+
+    for state_index, packed in enumerate(index.iter_packed_states()):
+        if marks is not None and not marks[state_index]:
+            continue
+        red_mask, black_mask, red_code, black_code = board.unpack_state(packed)
+        own_mask = red_mask if moves_red else black_mask
+        own_forbidden = board.code_to_forbidden(red_code if moves_red else black_code)
+        occupied = red_mask | black_mask
+        transitions = []
+
+        for src in board.mask_to_cells(own_mask):
+            for dst in adjacency[src]:
+                if occupied & cell_to_bit[dst]:
+                    continue
+
+                if own_forbidden and src == own_forbidden[0] and dst == own_forbidden[1]:
+                    continue
+
+                new_mask = own_mask ^ cell_to_bit[src] ^ cell_to_bit[dst]
+                undo_code = board.forbidden_to_code((dst, src)) if no_undo else 0
+                if moves_red:
+                    idx = index.rank_state(new_mask, black_mask, undo_code, black_code)
+                else:
+                    idx = index.rank_state(red_mask, new_mask, red_code, undo_code)
+                if idx is None:
+                    continue
+
+                # После хода ходит соперник; пропускаем,
+                # если для него позиция является гарантированной победой.
+                if opponent_status[idx] == 1:
+                    continue
+
+                transitions.append((src, dst))
+
+        if transitions:
+            state = (board.mask_to_cells(red_mask), board.mask_to_cells(black_mask),
+                     board.code_to_forbidden(red_code), board.code_to_forbidden(black_code))
+            yield state_index, state, transitions
+
+
+def iter_transition_rules(solver, color=COLOR_BLACK, reachable=None):
+    """
+    Поток правил переходов для color — словари как у build_black_transition_rules,
+    с индексом позиции в поле "index"; reachable — как в iter_safe_transitions.
+    """
+    labels = solver.board.cell_to_label
+    for state_index, (r, b, red_forbidden, black_forbidden), transitions in iter_safe_transitions(
+            solver, color, reachable):
+        yield {
+            "index": state_index,
+            "red": [labels[c] for c in r],
+            "black": [labels[c] for c in b],
+            "red_forbidden": forbidden_to_labels(red_forbidden, labels),
+            "black_forbidden": forbidden_to_labels(black_forbidden, labels),
+            "transitions": sorted((labels[src], labels[dst]) for src, dst in transitions)
+        }
+
+
+def build_black_transition_rules(solver):
+    """
+    Формирует список правил переходов для чёрных, исключая ходы,
+    после которых красные получают форсированную победу.
+    Для больших таблиц лучше iter_transition_rules — без списка в памяти.
+    """
+    return list(iter_transition_rules(solver, COLOR_BLACK))
+
+
+def print_black_transition_rules(rules, out=None):
+    """
+    Выводит правила переходов для чёрных в виде вызовов addRule({...}).
+    rules — список или поток (iter_transition_rules); out — файл (по умолчанию stdout).
+    """
+    def blocks():
+        for rule in rules:
+            transitions = "".join(f"    [{src}, {dst}],\n" for src, dst in rule["transitions"])
+            yield ("addRule({\n"
+                   f"  red: [{', '.join(rule['red'])}],\n"
+                   f"  black: [{', '.join(rule['black'])}],\n"
+                   f"  redForbidden: {format_forbidden_field(rule['red_forbidden'])},\n"
+                   f"  blackForbidden: {format_forbidden_field(rule['black_forbidden'])},\n"
+                   "  transitions: [\n"
+                   f"{transitions}"
+                   "  ],\n"
+                   "});\n\n")
+
+    out = sys.stdout if out is None else out
+    out.write("\n// Чёрные: безопасные переходы\n")
+    write_buffered(out, blocks())
+
+
+def print_black_transition_rules_numeric(solver, rules, out=None):
+    """
+    Выводит правила в числовом формате — в порядке правил (поток iter_transition_rules
+    идёт по возрастанию индекса). Если у правила нет поля "index", индекс ищется по меткам.
+    """
+    label_to_cell = solver.board.label_to_cell
+
+    def rule_index(rule):
+        if "index" in rule:
+            return rule["index"]
+        r = tuple(sorted([label_to_cell[c] for c in rule["red"]]))
+        b = tuple(sorted([label_to_cell[c] for c in rule["black"]]))
+        rf_labels = rule["red_forbidden"]
+        rf = (label_to_cell[rf_labels[0]], label_to_cell[rf_labels[1]]) if rf_labels else None
+        bf_labels = rule["black_forbidden"]
+        bf = (label_to_cell[bf_labels[0]], label_to_cell[bf_labels[1]]) if bf_labels else None
+        return solver.lookup_state_index(r, b, rf, bf)
+
+    def lines():
+        for rule in rules:
+            state_index = rule_index(rule)
+            if state_index is None or not rule["transitions"]:
+                continue
+            numeric_transitions = [[label_to_cell[src_label], label_to_cell[dst_label]]
+                                   for src_label, dst_label in rule["transitions"]]
+            yield f"  {state_index}: {numeric_transitions},\n"
+
+    out = sys.stdout if out is None else out
+    out.write("\n// Чёрные: безопасные переходы (числовой формат)\n{\n")
+    write_buffered(out, lines())
+    out.write("}\n")
+
+
+# ==============================
+#  Экспорт
+# ==============================
+
+# Сколько строк (записей) собирать перед одной записью в файл
+EXPORT_BATCH = 4096
+
+# Фильтры по исходу для ходящего: --only
+EXPORT_OUTCOMES = {
+    "win": (1,),
+    "loss": (-1,),
+    "undecided": (0,),
+    "decided": (1, -1),
+}
+
+# Двоичный экспорт: заголовок (магия, версия, клеток на доске, флаги) и записи.
+# Позиция: индекс, упакованное состояние (Board.pack_state), ходящий (0 — R, 1 — B), статус, полуходов.
+# Правило: индекс, упакованное состояние, ходящий, число ходов, затем пары байт (откуда, куда).
+POSITIONS_MAGIC = b"MILLPOS\0"
+RULES_MAGIC = b"MILLRUL\0"
+EXPORT_VERSION = 1
+EXPORT_HEADER = struct.Struct("<8sHBB")
+POSITION_RECORD = struct.Struct("<IQBbH")
+RULE_RECORD = struct.Struct("<IQBB")
+
+
+def write_buffered(out, chunks, batch=EXPORT_BATCH):
+    """Пишет поток строк (или bytes) в out пачками по batch штук одним write."""
+    chunks = iter(chunks)
+    while True:
+        block = [chunk for _, chunk in zip(range(batch), chunks)]
+        if not block:
+            return
+        out.write(block[0][:0].join(block))
+
+
+def export_colors(color):
+    """--color: R, B или both -> кортеж цветов."""
+    return (COLOR_RED, COLOR_BLACK) if color in (None, "both") else (color,)
+
+
+def iter_position_records(solver, colors=(COLOR_RED, COLOR_BLACK), only=None, reachable=None):
+    """
+    Поток (индекс, ходящий, упакованное состояние, статус, полуходов) по всем позициям
+    и цветам colors; only — ключ EXPORT_OUTCOMES (исход для ходящего) или None;
+    reachable — Solver.reachable: только достижимые со старта при этом ходящем.
+    """
+    allowed = None if only is None else EXPORT_OUTCOMES[only]
+    status = solver.retro_status
+    distance = solver.retro_distance
+    tables = [(color, status[color], distance[color], None if reachable is None else reachable[color])
+              for color in colors]
+    for state_index, packed in enumerate(solver.index.iter_packed_states()):
+        for color, color_status, color_distance, marks in tables:
+            if marks is not None and not marks[state_index]:
+                continue
+            value = color_status[state_index]
+            if allowed is None or value in allowed:
+                yield state_index, color, packed, value, color_distance[state_index]
+
+
+def iter_rule_records(solver, colors=(COLOR_BLACK,), only=None, reachable=None):
+    """
+    Поток (индекс, ходящий, состояние, статус, ходы) из iter_safe_transitions;
+    only и reachable — как в iter_position_records.
+    """
+    allowed = None if only is None else EXPORT_OUTCOMES[only]
+    for color in colors:
+        status = solver.retro_status[color]
+        for state_index, state, transitions in iter_safe_transitions(solver, color, reachable):
+            value = status[state_index]
+            if allowed is None or value in allowed:
+                yield state_index, color, state, value, transitions
+
+
+def _field_texts(board, fmt):
+    """
+    Текст полей «камни по маске» и «запрет по коду» для csv/jsonl — с кэшем:
+    различных масок и кодов немного, поэтому каждая строка собирается один раз.
+    """
+    labels = board.cell_to_label
+
+    @lru_cache(maxsize=None)
+    def stones(mask):
+        names = [labels[c] for c in board.mask_to_cells(mask)]
+        return " ".join(names) if fmt == "csv" else json.dumps(names, separators=(",", ":"))
+
+    @lru_cache(maxsize=None)
+    def ban(code):
+        names = forbidden_to_labels(board.code_to_forbidden(code), labels)
+        if fmt == "csv":
+            return " ".join(names or ())
+        return json.dumps(list(names) if names else None, separators=(",", ":"))
+
+    return stones, ban
+
+
+def export_positions(solver, out, fmt="jsonl", colors=(COLOR_RED, COLOR_BLACK), only=None, reachable=None):
+    """
+    Потоковый экспорт позиций со статусами в out (текстовый файл для jsonl/csv,
+    двоичный для binary). Память не зависит от размера таблицы.
+    reachable — Solver.reachable, чтобы выгрузить только достижимые со старта позиции.
+    """
+    board = solver.board
+    unpack_state = board.unpack_state
+    records = iter_position_records(solver, colors, only, reachable)
+
+    if fmt == "binary":
+        out.write(EXPORT_HEADER.pack(POSITIONS_MAGIC, EXPORT_VERSION, board.cell_count, 0))
+        pack = POSITION_RECORD.pack
+        write_buffered(out, (pack(state_index, packed, color == COLOR_BLACK, value, distance)
+                             for state_index, color, packed, value, distance in records))
+    elif fmt == "csv":
+        stones, ban = _field_texts(board, fmt)
+
+        def rows():
+            for state_index, color, packed, value, distance in records:
+                red_mask, black_mask, red_code, black_code = unpack_state(packed)
+                yield (f"{state_index},{color},{stones(red_mask)},{stones(black_mask)},"
+                       f"{ban(red_code)},{ban(black_code)},{value},{distance if value else ''}\n")
+
+        out.write("index,color,red,black,red_ban,black_ban,status,distance\n")
+        write_buffered(out, rows())
+    elif fmt == "jsonl":
+        stones, ban = _field_texts(board, fmt)
+
+        def rows():
+            for state_index, color, packed, value, distance in records:
+                red_mask, black_mask, red_code, black_code = unpack_state(packed)
+                yield (f'{{"index":{state_index},"color":"{color}","red":{stones(red_mask)},'
+                       f'"black":{stones(black_mask)},"red_ban":{ban(red_code)},"black_ban":{ban(black_code)},'
+                       f'"status":{value},"distance":{distance if value else "null"}}}\n')
+
+        write_buffered(out, rows())
+    else:
+        raise ValueError(f"неизвестный формат: {fmt!r}")
+
+
+def export_rules(solver, out, fmt="jsonl", colors=(COLOR_BLACK,), only=None, reachable=None):
+    """
+    Потоковый экспорт безопасных переходов (iter_safe_transitions) в out;
+    форматы и reachable — как у export_positions.
+    """
+    board = solver.board
+    labels = board.cell_to_label
+    records = iter_rule_records(solver, colors, only, reachable)
+
+    if fmt == "binary":
+        out.write(EXPORT_HEADER.pack(RULES_MAGIC, EXPORT_VERSION, board.cell_count, 0))
+
+        def blobs():
+            for state_index, color, (r, b, red_forbidden, black_forbidden), value, transitions in records:
+                packed = board.pack_state(board.cells_to_mask(r), board.cells_to_mask(b),
+                                          board.forbidden_to_code(red_forbidden),
+                                          board.forbidden_to_code(black_forbidden))
+                yield (RULE_RECORD.pack(state_index, packed, color == COLOR_BLACK, len(transitions))
+                       + bytes(cell for move in transitions for cell in move))
+
+        write_buffered(out, blobs())
+    elif fmt == "csv":
+        def rows():
+            for state_index, color, (r, b, red_forbidden, black_forbidden), value, transitions in records:
+                yield (f"{state_index},{color},{' '.join(labels[c] for c in r)},"
+                       f"{' '.join(labels[c] for c in b)},"
+                       f"{' '.join(forbidden_to_labels(red_forbidden, labels) or ())},"
+                       f"{' '.join(forbidden_to_labels(black_forbidden, labels) or ())},"
+                       f"{value},{' '.join(f'{labels[src]}-{labels[dst]}' for src, dst in transitions)}\n")
+
+        out.write("index,color,red,black,red_ban,black_ban,status,transitions\n")
+        write_buffered(out, rows())
+    elif fmt == "jsonl":
+        def rows():
+            for state_index, color, (r, b, red_forbidden, black_forbidden), value, transitions in records:
+                yield json.dumps({
+                    "index": state_index,
+                    "color": color,
+                    "red": [labels[c] for c in r],
+                    "black": [labels[c] for c in b],
+                    "red_ban": forbidden_to_labels(red_forbidden, labels),
+                    "black_ban": forbidden_to_labels(black_forbidden, labels),
+                    "status": value,
+                    "transitions": [[labels[src], labels[dst]] for src, dst in transitions],
+                }, separators=(",", ":")) + "\n"
+
+        write_buffered(out, rows())
+    else:
+        raise ValueError(f"неизвестный формат: {fmt!r}")
+
+
+def read_binary_export(stream):
+    """
+    Обратное к двоичному экспорту: (вид, записи), где вид — "positions" или "rules".
+    Позиции — (индекс, ходящий, упакованное состояние, статус, полуходов);
+    правила — (индекс, ходящий, упакованное состояние, ходы).
+    """
+    magic, version, _, _ = EXPORT_HEADER.unpack(stream.read(EXPORT_HEADER.size))
+    if magic not in (POSITIONS_MAGIC, RULES_MAGIC) or version != EXPORT_VERSION:
+        raise ValueError("это не двоичный экспорт mill-calc")
+    colors = (COLOR_RED, COLOR_BLACK)
+
+    def positions():
+        while True:
+            chunk = stream.read(POSITION_RECORD.size * EXPORT_BATCH)
+            if not chunk:
+                return
+            for state_index, packed, side, value, distance in POSITION_RECORD.iter_unpack(chunk):
+                yield state_index, colors[side], packed, value, distance
+
+    def rules():
+        while True:
+            head = stream.read(RULE_RECORD.size)
+            if not head:
+                return
+            state_index, packed, side, count = RULE_RECORD.unpack(head)
+            body = stream.read(2 * count)
+            yield state_index, colors[side], packed, list(zip(body[::2], body[1::2]))
+
+    if magic == POSITIONS_MAGIC:
+        return "positions", positions()
+    return "rules", rules()
+
+
+# ==============================
+#  Разбор партий
+# ==============================
+
+# Запись разметки полухода: партия (номер строки), полуход (с 1), ходящий, ход, индекс
+# позиции до хода, статус и полуходов для ходящего до хода, индекс после хода, исход для
+# ходящего после хода (статус соперника с обратным знаком) и полуходов, ошибка
+# (выигрыш -> не выигрыш), причина, если ход не принят (тогда остальные поля None).
+ANNOTATION_FIELDS = ("game", "ply", "color", "move", "index", "status", "distance",
+                     "next_index", "result", "next_distance", "blunder", "error")
+
+
+def _move_table(rules):
+    """
+    Ходы по тексту «A1-B2»: (бит откуда, бит куда, код хода, запрет после хода,
+    соседние ли клетки); строятся для всех пар клеток доски.
+    """
+    board = rules.board
+    labels = board.cell_to_label
+    table = {}
+    for src in board.cells:
+        for dst in board.cells:
+            if src == dst:
+                continue
+            table[f"{labels[src]}-{labels[dst]}"] = (
+                board.cell_to_bit[src], board.cell_to_bit[dst], board.forbidden_to_code((src, dst)),
+                board.forbidden_to_code((dst, src)) if rules.no_undo else 0, dst in rules.neighbors[src])
+    return table
+
+
+def annotate_games(solver, lines):
+    """
+    Поток разметки партий (кортежи полей ANNOTATION_FIELDS): lines — по партии на строку,
+    ходы вида «A1-B2» (метки cell_to_label) через пробелы или запятые; пустые строки,
+    строки с «#» и номера ходов («12.») пропускаются. Каждая партия переигрывается со
+    старта, первыми ходят красные; запрет отмены хода отслеживается так же, как в словаре.
+    Ход, которого нет по правилам, и ходы после конца партии (мельница) дают запись
+    с причиной в error, и партия на этом обрывается. Память не зависит от числа партий.
+    """
+    index = solver.index
+    rules = index.rules
+    rank_state = index.rank_state
+    mill_flags = rules.mill_flags
+    status = (solver.retro_status[COLOR_RED], solver.retro_status[COLOR_BLACK])
+    distance = (solver.retro_distance[COLOR_RED], solver.retro_distance[COLOR_BLACK])
+    colors = (COLOR_RED, COLOR_BLACK)
+    moves = _move_table(rules)
+    start = (rules.red_start_mask, rules.black_start_mask)
+    start_index = rank_state(*start, 0, 0)
+
+    for game, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        masks = list(start)
+        codes = [0, 0]
+        idx = start_index
+        ply = 0
+        for token in line.replace(",", " ").split():
+            if token[-1] == "." and token[:-1].isdigit():
+                continue
+            side = ply & 1
+            ply += 1
+            move = moves.get(token.upper())
+            error = None
+            if idx is None:
+                error = "стартовой позиции нет в словаре"
+            elif mill_flags[masks[0]] & RED_MILL or mill_flags[masks[1]] & BLACK_MILL:
+                error = "партия уже окончена"
+            elif move is None:
+                error = "нет такого хода"
+            else:
+                src_bit, dst_bit, move_code, undo_code, adjacent = move
+                if not masks[side] & src_bit:
+                    error = "на клетке нет своего камня"
+                elif not adjacent:
+                    error = "клетки не соседние"
+                elif (masks[0] | masks[1]) & dst_bit:
+                    error = "клетка занята"
+                elif codes[side] == move_code:
+                    error = "ход отменяет предыдущий"
+            if error is None:
+                masks[side] ^= src_bit | dst_bit
+                codes[side] = undo_code
+                next_idx = rank_state(masks[0], masks[1], codes[0], codes[1])
+                if next_idx is None:
+                    error = "позиции после хода нет в словаре"
+            if error is not None:
+                yield game, ply, colors[side], token, idx, None, None, None, None, None, None, error
+                break
+
+            value = status[side][idx]
+            result = -status[side ^ 1][next_idx]
+            yield (game, ply, colors[side], token, idx, value, distance[side][idx], next_idx, result,
+                   distance[side ^ 1][next_idx], value == 1 and result != 1, None)
+            idx = next_idx
+
+
+def export_annotations(records, out, fmt="jsonl"):
+    """
+    Пишет поток annotate_games в out пачками (write_buffered): jsonl — объект на полуход,
+    csv — строка на полуход с заголовком ANNOTATION_FIELDS. Полуходов у неопределённых
+    позиций нет (пусто / null). Возвращает сводку: партий, полуходов, ошибок, отвергнутых ходов.
+    """
+    summary = {"games": 0, "plies": 0, "blunders": 0, "rejected": 0}
+    last_game = [None]
+
+    def counted():
+        for record in records:
+            if record[0] != last_game[0]:
+                last_game[0] = record[0]
+                summary["games"] += 1
+            if record[-1] is None:
+                summary["plies"] += 1
+                summary["blunders"] += record[10]
+            else:
+                summary["rejected"] += 1
+            yield record
+
+    if fmt == "csv":
+        def rows():
+            for game, ply, color, move, idx, value, dist, next_idx, result, next_dist, blunder, error in counted():
+                if error is not None:
+                    yield f"{game},{ply},{color},{move},{'' if idx is None else idx},,,,,,,{error}\n"
+                    continue
+                yield (f"{game},{ply},{color},{move},{idx},{value},{dist if value else ''},{next_idx},{result},"
+                       f"{next_dist if result else ''},{int(blunder)},\n")
+
+        out.write(",".join(ANNOTATION_FIELDS) + "\n")
+        write_buffered(out, rows())
+    elif fmt == "jsonl":
+        def rows():
+            for game, ply, color, move, idx, value, dist, next_idx, result, next_dist, blunder, error in counted():
+                if error is not None:
+                    yield (f'{{"game":{game},"ply":{ply},"color":"{color}","move":{json.dumps(move)},'
+                           f'"index":{"null" if idx is None else idx},"error":"{error}"}}\n')
+                    continue
+                yield (f'{{"game":{game},"ply":{ply},"color":"{color}","move":"{move}","index":{idx},'
+                       f'"status":{value},"distance":{dist if value else "null"},"next_index":{next_idx},'
+                       f'"result":{result},"next_distance":{next_dist if result else "null"},'
+                       f'"blunder":{"true" if blunder else "false"}}}\n')
+
+        write_buffered(out, rows())
+    else:
+        raise ValueError(f"неизвестный формат: {fmt!r}")
+    return summary
+
+
+# ==============================
+#  Упакованная таблица для JS-клиента
+# ==============================
+
+# Флаги пары в упакованной таблице: PAIR_RED_NONE, PAIR_BLACK_NONE и «пара есть в словаре»
+PACKED_PAIR_PRESENT = 4
+
+# Декодер упакованной таблицы (вставляется в вывод после MILL_TABLE)
+JS_TABLE_DECODER = """\
+function decodeMillTable(table) {
+  const raw = atob(table.data);
+  const bytes = new Uint8Array(raw.length);
+  for (let i = 0; i < raw.length; i++) bytes[i] = raw.charCodeAt(i);
+  let pos = 0;
+  const varint = () => {
+    let value = 0, scale = 1, byte;
+    do { byte = bytes[pos++]; value += (byte & 0x7f) * scale; scale *= 128; } while (byte & 0x80);
+    return value;
+  };
+
+  const count = table.masks.length;
+  const rankOf = new Map(table.masks.map((mask, rank) => [mask, rank]));
+  const bit = (cell) => 2 ** (cell - 1);
+  const maskOf = (cells) => cells.reduce((mask, cell) => mask + bit(cell), 0);
+  const cellsOf = (mask) => table.labels.map((_, i) => i + 1).filter((cell) => Math.floor(mask / bit(cell)) % 2);
+  // запреты набора — в порядке generate_forbidden_options
+  const bans = table.masks.map((mask) => {
+    if (!table.noUndo) return [];
+    const stones = cellsOf(mask);
+    return stones.flatMap((cur) => table.neighbors[cur].filter((prev) => !stones.includes(prev)).map((prev) => [cur, prev]));
+  });
+
+  const pairFlags = bytes.subarray(0, count * count);
+  pos = count * count;
+  const pairOffset = new Float64Array(count * count + 1);
+  for (let pair = 0; pair < count * count; pair++) {
+    const flags = pairFlags[pair];
+    const size = flags & 4
+      ? (bans[Math.floor(pair / count)].length + (flags & 1)) * (bans[pair % count].length + ((flags >> 1) & 1))
+      : 0;
+    pairOffset[pair + 1] = pairOffset[pair] + size;
+  }
+
+  const safe = {};
+  for (const color of ["R", "B"]) {
+    const masks = new Uint32Array(table.states);
+    let index = 0;
+    for (let runs = varint(); runs > 0; runs--) {
+      index += varint();
+      for (let length = varint(); length > 0; length--) masks[index++] = varint();
+    }
+    safe[color] = masks;
+  }
+
+  const slot = (rank, ban, none) => {
+    if (!ban) return none ? 0 : -1;
+    const i = bans[rank].findIndex(([cur, prev]) => cur === ban[0] && prev === ban[1]);
+    return i < 0 ? -1 : i + none;
+  };
+
+  // red, black — номера клеток (1 = A1, ...), redBan/blackBan — [откуда пришли, куда нельзя] или null
+  function stateIndex(red, black, redBan, blackBan) {
+    const redRank = rankOf.get(maskOf(red));
+    const blackRank = rankOf.get(maskOf(black));
+    if (redRank === undefined || blackRank === undefined) return -1;
+    const pair = redRank * count + blackRank;
+    const flags = pairFlags[pair];
+    if (!(flags & 4)) return -1;
+    const redSlot = slot(redRank, redBan, flags & 1);
+    const blackSlot = slot(blackRank, blackBan, (flags >> 1) & 1);
+    if (redSlot < 0 || blackSlot < 0) return -1;
+    return pairOffset[pair] + redSlot * (bans[blackRank].length + ((flags >> 1) & 1)) + blackSlot;
+  }
+
+  // безопасные ходы color ("R" или "B"): [[откуда, куда], ...] или null, если позиции нет;
+  // в таблице с table.reachable у недостижимых со старта позиций список пуст
+  function safeMoves(color, red, black, redBan, blackBan) {
+    const index = stateIndex(red, black, redBan, blackBan);
+    if (index < 0) return null;
+    const own = color === "R" ? red : black;
+    const ban = color === "R" ? redBan : blackBan;
+    const occupied = new Set([...red, ...black]);
+    const bits = safe[color][index];
+    const moves = [];
+    let move = 0;
+    for (const src of [...own].sort((a, b) => a - b)) {
+      for (const dst of table.neighbors[src]) {
+        if (occupied.has(dst) || (ban && ban[0] === src && ban[1] === dst)) continue;
+        if ((bits >>> move) & 1) moves.push([src, dst]);
+        move++;
+      }
+    }
+    return moves;
+  }
+
+  return { stateIndex, safeMoves, labels: table.labels };
+}
+
+if (typeof module !== "undefined") module.exports = { MILL_TABLE, decodeMillTable };
+"""
+
+
+def _append_varint(buffer, value):
+    while value >= 0x80:
+        buffer.append(value & 0x7F | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def legal_move_order(board, adjacency, own_mask, occupied, own_forbidden):
+    """
+    Ходы (откуда, куда) в порядке клиента: камни по возрастанию клетки, соседи —
+    по таблице соседства; занятые клетки и запрещённый возврат пропускаются.
+    Попадёт ли позиция после хода в словарь, здесь не проверяется.
+    """
+    order = []
+    for src in board.mask_to_cells(own_mask):
+        for dst in adjacency[src]:
+            if occupied & board.cell_to_bit[dst] or own_forbidden == (src, dst):
+                continue
+            order.append((src, dst))
+    return order
+
+
+def _packed_state_list(index):
+    """Упакованные состояния индекса (при keep_states=False — собираются из потока)."""
+    if index.packed_states is not None:
+        return index.packed_states
+    return array("Q", index.iter_packed_states())
+
+
+def _safe_moves_from_table(solver, color, state_index, packed_states, side, own_mask):
+    """Безопасные ходы color из позиции по solver.outgoing и retro_status: {(откуда, куда)}."""
+    board = solver.board
+    opponent_status = solver.retro_status[COLOR_BLACK if color == COLOR_RED else COLOR_RED]
+    safe = set()
+    for target in solver.outgoing(color)[state_index]:
+        if opponent_status[target] == 1:
+            continue
+        target_mask = board.unpack_state(packed_states[target])[side]
+        src, = board.mask_to_cells(own_mask & ~target_mask)
+        dst, = board.mask_to_cells(target_mask & ~own_mask)
+        safe.add((src, dst))
+    return safe
+
+
+def build_packed_safe_moves(solver, color, reachable=None):
+    """
+    Для каждого индекса позиции — маска безопасных ходов color: бит k выставлен,
+    если k-й ход legal_move_order не даёт сопернику форсированной победы.
+    Ходы берутся из solver.outgoing(color), статусы — из retro_status.
+    reachable — Solver.reachable: у недостижимых со старта позиций маска нулевая.
+    """
+    index = solver.index
+    board = index.board
+    adjacency = index.rules.neighbors
+    unpack_state = board.unpack_state
+    cell_to_bit = board.cell_to_bit
+    packed_states = _packed_state_list(index)
+    moves = solver.outgoing(color)
+    opponent_status = solver.retro_status[COLOR_BLACK if color == COLOR_RED else COLOR_RED]
+    side = 0 if color == COLOR_RED else 1
+    marks = None if reachable is None else reachable[color]
+    orders = {}
+    result = array("I", bytes(4 * len(packed_states)))
+
+    for state_index, packed in enumerate(packed_states):
+        if marks is not None and not marks[state_index]:
+            continue
+        fields = unpack_state(packed)
+        own_mask = fields[side]
+        bits = 0
+        for target in moves[state_index]:
+            if opponent_status[target] == 1:
+                continue
+            key = (own_mask, fields[0] | fields[1], fields[2 + side])
+            order = orders.get(key)
+            if order is None:
+                order = orders[key] = {
+                    (cell_to_bit[src], cell_to_bit[dst]): slot for slot, (src, dst) in enumerate(
+                        legal_move_order(board, adjacency, own_mask, key[1], board.code_to_forbidden(key[2])))}
+            target_mask = unpack_state(packed_states[target])[side]
+            bits |= 1 << order[own_mask & ~target_mask, target_mask & ~own_mask]
+        result[state_index] = bits
+    return result
+
+
+def build_packed_rule_table(solver, reachable=None):
+    """
+    Таблица безопасных ходов обоих цветов для JS-клиента (словарь, готовый для JSON):
+    метаданные доски и наборов камней плюс data — base64 от
+      - флагов пар (байт на пару: PAIR_RED_NONE | PAIR_BLACK_NONE | PACKED_PAIR_PRESENT),
+        по которым клиент восстанавливает индексы позиций;
+      - для R и B — масок build_packed_safe_moves, сжатых серийно: число серий, затем
+        в каждой серии пропуск нулевых масок от конца предыдущей, длина и маски (varint).
+    С reachable (Solver.reachable) маски есть только у достижимых со старта позиций:
+    остальные попадают в пропуски, и таблица заметно короче (поле "reachable").
+    """
+    index = solver.index
+    rules = index.rules
+    board = index.board
+    widest = rules.stones * max(len(targets) for targets in rules.neighbors.values())
+    if widest > 32:
+        raise ValueError(f"маска ходов не помещается в 32 бита ({widest} ходов)")
+
+    data = bytearray()
+    for pair in range(index.pair_count):
+        data.append(index.pair_flags[pair] | PACKED_PAIR_PRESENT if index.pair_black_width[pair] else 0)
+
+    for color in (COLOR_RED, COLOR_BLACK):
+        runs = []
+        gap = 0
+        for bits in build_packed_safe_moves(solver, color, reachable):
+            if not bits:
+                gap += 1
+                continue
+            if gap or not runs:
+                runs.append((gap, []))
+                gap = 0
+            runs[-1][1].append(bits)
+        _append_varint(data, len(runs))
+        for skip, masks in runs:
+            _append_varint(data, skip)
+            _append_varint(data, len(masks))
+            for bits in masks:
+                _append_varint(data, bits)
+
+    return {
+        "rules": rules.name,
+        "fingerprint": rules.fingerprint().hex(),
+        "states": len(index),
+        "labels": list(board.labels),
+        "neighbors": {cell: list(rules.neighbors[cell]) for cell in board.cells},
+        "masks": list(index.sets.masks),
+        "noUndo": rules.no_undo,
+        "reachable": reachable is not None,
+        "data": base64.b64encode(bytes(data)).decode("ascii"),
+    }
+
+
+def read_packed_rule_table(table):
+    """
+    Обратное к build_packed_rule_table (как decodeMillTable в JS): флаги пар и для R и B —
+    маски безопасных ходов по индексам позиций (array "I"). ValueError, если data обрезана.
+    """
+    data = base64.b64decode(table["data"])
+    pairs = len(table["masks"]) ** 2
+    if len(data) < pairs:
+        raise ValueError("упакованная таблица обрезана")
+    pos = pairs
+
+    def varint():
+        nonlocal pos
+        value = shift = 0
+        while True:
+            if pos >= len(data):
+                raise ValueError("упакованная таблица обрезана")
+            byte = data[pos]
+            pos += 1
+            value |= (byte & 0x7F) << shift
+            shift += 7
+            if not byte & 0x80:
+                return value
+
+    result = {"pair_flags": data[:pairs]}
+    for color in (COLOR_RED, COLOR_BLACK):
+        masks = array("I", bytes(4 * table["states"]))
+        index = 0
+        for _ in range(varint()):
+            index += varint()
+            for _ in range(varint()):
+                masks[index] = varint()
+                index += 1
+        result[color] = masks
+    return result
+
+
+def print_packed_rule_table(solver, out=None, reachable=None):
+    """Выводит MILL_TABLE (build_packed_rule_table) и декодер decodeMillTable."""
+    table = build_packed_rule_table(solver, reachable)
+    out = sys.stdout if out is None else out
+    out.write("// Безопасные ходы обоих цветов: упакованная таблица и декодер\n")
+    out.write(f"const MILL_TABLE = {json.dumps(table, separators=(',', ':'))};\n\n")
+    out.write(JS_TABLE_DECODER)
+
+
+# ==============================
+#  Упакованные статусы
+# ==============================
+
+# Статус в 2 битах: 0 — не определено, 1 — победа, 2 — поражение ходящего (3 не бывает)
+STATUS_CODES = {0: 0, 1: 1, -1: 2}
+STATUS_VALUES = (0, 1, -1, 0)
+
+STATUS_MAGIC = b"MILLSTS\0"
+STATUS_VERSION = 1
+STATUS_DEFLATE = 1
+_STATUS_HEADER = struct.Struct("<8sHBx32sQ")  # сигнатура, версия, флаги, хэш правил, число позиций
+
+
+class PackedStatusTable:
+    """
+    Статусы обоих цветов по 2 бита на (позиция, кто ходит) в порядке индексов позиций:
+    позиция idx — полубайт idx-го байта data >> 1, младший у чётных позиций; в полубайте
+    младшие 2 бита — ход красных, старшие — ход чёрных. Индекс — ранг состояния
+    (StateIndex), поэтому к таблице не нужно прикладывать список позиций.
+    """
+
+    __slots__ = ("data", "states")
+
+    def __init__(self, data, states):
+        self.data = data
+        self.states = states
+
+    def __len__(self):
+        return self.states
+
+    def get(self, idx, color):
+        """Статус позиции idx при ходе color: 1, -1 или 0."""
+        shift = (idx & 1) << 2 | (2 if color == COLOR_BLACK else 0)
+        return STATUS_VALUES[self.data[idx >> 1] >> shift & 3]
+
+    def get_many(self, indices, color):
+        """Статусы позиций indices при ходе color: с numpy — массив int8 разом, иначе список."""
+        side = 2 if color == COLOR_BLACK else 0
+        if np is None:
+            data = self.data
+            return [STATUS_VALUES[data[idx >> 1] >> ((idx & 1) << 2 | side) & 3] for idx in indices]
+        indices = np.asarray(indices, dtype=np.int64)
+        data = np.frombuffer(self.data, dtype=np.uint8)
+        codes = data[indices >> 1] >> ((indices & 1) << 2 | side).astype(np.uint8) & 3
+        return np.array(STATUS_VALUES, dtype=np.int8)[codes]
+
+
+def pack_status_table(status):
+    """PackedStatusTable из retro_status ({цвет: статусы по индексам})."""
+    red, black = status[COLOR_RED], status[COLOR_BLACK]
+    states = len(red)
+    if np is not None:
+        codes = np.array([2, 0, 1], dtype=np.uint8)  # код по статусу + 1: поражение, не определено, победа
+        nibbles = np.zeros(states + (states & 1), dtype=np.uint8)
+        nibbles[:states] = (codes[np.asarray(red, dtype=np.int8) + 1]
+                            | codes[np.asarray(black, dtype=np.int8) + 1] << 2)
+        return PackedStatusTable(bytearray((nibbles[0::2] | nibbles[1::2] << 4).tobytes()), states)
+    data = bytearray((states + 1) >> 1)
+    for idx in range(states):
+        data[idx >> 1] |= (STATUS_CODES[red[idx]] | STATUS_CODES[black[idx]] << 2) << ((idx & 1) << 2)
+    return PackedStatusTable(data, states)
+
+
+def serialize_status_table(table, rules, deflate=True):
+    """
+    Файл упакованных статусов: заголовок (STATUS_MAGIC, версия, флаги, хэш правил,
+    число позиций) и байты таблицы — с deflate сжатые zlib (для classic около 8 КБ вместо 53).
+    """
+    payload = zlib.compress(bytes(table.data), 9) if deflate else bytes(table.data)
+    return _STATUS_HEADER.pack(STATUS_MAGIC, STATUS_VERSION, STATUS_DEFLATE if deflate else 0,
+                               rules.fingerprint(), table.states) + payload
+
+
+def read_status_table(data, rules=None):
+    """Обратное к serialize_status_table; с rules сверяется хэш правил (ValueError, если чужие)."""
+    magic, version, flags, fingerprint, states = _STATUS_HEADER.unpack_from(data)
+    if magic != STATUS_MAGIC or version != STATUS_VERSION:
+        raise ValueError("это не файл упакованных статусов mill-calc")
+    if rules is not None and fingerprint != rules.fingerprint():
+        raise ValueError("статусы посчитаны для других правил")
+    payload = bytes(data[_STATUS_HEADER.size:])
+    if flags & STATUS_DEFLATE:
+        payload = zlib.decompress(payload)
+    if len(payload) != (states + 1) >> 1:
+        raise ValueError("файл упакованных статусов обрезан")
+    return PackedStatusTable(bytearray(payload), states)
+
+
+# Декодер упакованных статусов (вставляется в вывод после MILL_STATUS). Индексы позиций он
+# восстанавливает сам по правилам — так же, как StateIndex: наборы камней в порядке
+# сочетаний, пары без общих клеток и без мельниц у обоих, запреты в порядке
+# generate_forbidden_options.
+JS_STATUS_DECODER = """\
+async function decodeMillStatus(table) {
+  const raw = atob(table.data);
+  let bytes = new Uint8Array(raw.length);
+  for (let i = 0; i < raw.length; i++) bytes[i] = raw.charCodeAt(i);
+  if (table.deflate) {
+    const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream("deflate"));
+    bytes = new Uint8Array(await new Response(stream).arrayBuffer());
+  }
+
+  const n = table.labels.length;
+  const bit = (cell) => 2 ** (cell - 1);
+  const maskOf = (cells) => cells.reduce((mask, cell) => mask + bit(cell), 0);
+  const has = (mask, cell) => Math.floor(mask / bit(cell)) % 2 === 1;
+  const masks = [];
+  const combine = (first, left, mask) => {
+    if (!left) { masks.push(mask); return; }
+    for (let cell = first; cell <= n - left + 1; cell++) combine(cell + 1, left - 1, mask + bit(cell));
+  };
+  combine(1, table.redStart.length, 0);
+  const count = masks.length;
+  const rankOf = new Map(masks.map((mask, rank) => [mask, rank]));
+  const bans = masks.map((mask) => {
+    if (!table.noUndo) return [];
+    const stones = table.labels.map((_, i) => i + 1).filter((cell) => has(mask, cell));
+    return stones.flatMap((cur) => table.neighbors[cur].filter((prev) => !has(mask, prev)).map((prev) => [cur, prev]));
+  });
+  const redStart = maskOf(table.redStart), blackStart = maskOf(table.blackStart);
+  const firstMoves = new Set(table.firstMoves.map(maskOf));
+  const lines = table.lines.map(maskOf);
+  const mill = (mask, start) => mask !== start && lines.some((line) => (mask & line) === line);
+
+  // пары по порядку: смещение, флаги «запрета может не быть» (1 — у красных, 2 — у чёрных)
+  const pairOffset = new Float64Array(count * count + 1);
+  const pairFlags = new Uint8Array(count * count);
+  for (let pair = 0; pair < count * count; pair++) {
+    const red = masks[Math.floor(pair / count)], black = masks[pair % count];
+    let size = 0;
+    if (!(red & black)) {
+      const redNone = !table.noUndo || (red === redStart && black === blackStart);
+      const blackNone = !table.noUndo || (black === blackStart && (red === redStart || firstMoves.has(red)));
+      const width = bans[pair % count].length + (blackNone ? 1 : 0);
+      size = (bans[Math.floor(pair / count)].length + (redNone ? 1 : 0)) * width;
+      if (mill(red, redStart) && mill(black, blackStart)) size = 0;
+      pairFlags[pair] = (redNone ? 1 : 0) | (blackNone ? 2 : 0);
+    }
+    pairOffset[pair + 1] = pairOffset[pair] + size;
+  }
+
+  const slot = (rank, ban, none) => {
+    if (!ban) return none ? 0 : -1;
+    const i = bans[rank].findIndex(([cur, prev]) => cur === ban[0] && prev === ban[1]);
+    return i < 0 ? -1 : i + none;
+  };
+
+  // red, black — номера клеток (1 = A1, ...), redBan/blackBan — [откуда пришли, куда нельзя] или null
+  function stateIndex(red, black, redBan, blackBan) {
+    const redRank = rankOf.get(maskOf(red)), blackRank = rankOf.get(maskOf(black));
+    if (redRank === undefined || blackRank === undefined) return -1;
+    const pair = redRank * count + blackRank;
+    if (pairOffset[pair + 1] === pairOffset[pair]) return -1;
+    const flags = pairFlags[pair];
+    const redSlot = slot(redRank, redBan, flags & 1), blackSlot = slot(blackRank, blackBan, (flags >> 1) & 1);
+    if (redSlot < 0 || blackSlot < 0) return -1;
+    return pairOffset[pair] + redSlot * (bans[blackRank].length + ((flags >> 1) & 1)) + blackSlot;
+  }
+
+  // статус позиции index при ходе color ("R" или "B"): 1 — победа, -1 — поражение, 0 — не определено
+  const statusAt = (index, color) => [0, 1, -1, 0][(bytes[index >> 1] >> ((index & 1) * 4 + (color === "B" ? 2 : 0))) & 3];
+  const status = (color, red, black, redBan, blackBan) => {
+    const index = stateIndex(red, black, redBan, blackBan);
+    return index < 0 ? null : statusAt(index, color);
+  };
+
+  return { stateIndex, statusAt, status, states: table.states, labels: table.labels };
+}
+
+if (typeof module !== "undefined") module.exports = { MILL_STATUS, decodeMillStatus };
+"""
+
+
+def build_status_payload(solver, deflate=True):
+    """
+    Упакованные статусы для JS-клиента (словарь, готовый для JSON): правила, по которым
+    декодер восстанавливает индексы, и data — base64 от таблицы (с deflate — сжатой zlib).
+    """
+    rules = solver.rules
+    board = solver.board
+    table = pack_status_table(solver.retro_status)
+    data = zlib.compress(bytes(table.data), 9) if deflate else bytes(table.data)
+    return {
+        "rules": rules.name,
+        "fingerprint": rules.fingerprint().hex(),
+        "states": table.states,
+        "labels": list(board.labels),
+        "neighbors": {cell: list(rules.neighbors[cell]) for cell in board.cells},
+        "lines": [list(line) for line in rules.winning_lines],
+        "redStart": list(rules.red_start),
+        "blackStart": list(rules.black_start),
+        "firstMoves": [list(position) for position in sorted(rules.first_move_positions)],
+        "noUndo": rules.no_undo,
+        "deflate": deflate,
+        "data": base64.b64encode(data).decode("ascii"),
+    }
+
+
+def print_status_table(solver, out=None, deflate=True):
+    """Выводит MILL_STATUS (build_status_payload) и декодер decodeMillStatus."""
+    payload = build_status_payload(solver, deflate)
+    out = sys.stdout if out is None else out
+    out.write("// Статусы всех позиций по 2 бита: упакованная таблица и декодер\n")
+    out.write(f"const MILL_STATUS = {json.dumps(payload, separators=(',', ':'))};\n\n")
+    out.write(JS_STATUS_DECODER)
+
+
+# ==============================
+#  Минимизация правил переходов
+# ==============================
+
+def _label_moves(moves, labels):
+    return sorted((labels[src], labels[dst]) for src, dst in moves)
+
+
+def _rule_disagreements(denied, entries):
+    """Сколько позиций (ходы, запрещённые) не согласны с общим списком запретов denied."""
+    return sum(1 for legal, deny in entries if [move for move in legal if move in denied] != deny)
+
+
+def _best_rule_choice(entries, inherited):
+    """
+    Лучший список запретов для группы позиций при унаследованном inherited:
+    (цена, список), где цена — своё правило (если список другой) плюс исключения внутри группы.
+    """
+    best = (_rule_disagreements(inherited, entries), inherited)
+    candidates = {frozenset(deny) for _, deny in entries}
+    candidates.add(frozenset().union(*candidates))
+    for denied in candidates - {inherited}:
+        cost = 1 + _rule_disagreements(denied, entries)
+        if cost < best[0]:
+            best = (cost, denied)
+    return best
+
+
+def minimize_transition_rules(solver, color=COLOR_BLACK, group=True, reachable=None):
+    """
+    Поток правил-исключений из политики «разрешён любой ход»: по умолчанию ходящий
+    может сделать любой ход из legal_move_order, а правило перечисляет запрещённые
+    (deny) — после которых соперник выигрывает или позиции нет в словаре. Правило
+    применяется к ходам позиции как deny ∩ её ходы; действует самое точное из
+    подходящих:
+      - с полями red_forbidden и black_forbidden — к одной позиции;
+      - только с запретом соперника (для чёрных — red_forbidden) — ко всем позициям
+        с этими камнями и этим запретом соперника (с group);
+      - без полей запретов — ко всем позициям с этими камнями (с group).
+    Списки для групп выбираются так, чтобы правил было меньше всего.
+    reachable — Solver.reachable: правила верны только для достижимых со старта
+    позиций, ходы в остальных не важны, и групп без исключений становится больше.
+    """
+    index = solver.index
+    board = index.board
+    labels = board.cell_to_label
+    adjacency = index.rules.neighbors
+    packed_states = _packed_state_list(index)
+    side = 0 if color == COLOR_RED else 1
+    opponent_field = "black_forbidden" if color == COLOR_RED else "red_forbidden"
+    marks = None if reachable is None else reachable[color]
+    nothing = frozenset()
+
+    def state_rule(r, b, fields, deny, keys=("red_forbidden", "black_forbidden")):
+        rule = {"red": r, "black": b}
+        for key in keys:
+            code = fields[2] if key == "red_forbidden" else fields[3]
+            rule[key] = forbidden_to_labels(board.code_to_forbidden(code), labels)
+        rule["deny"] = _label_moves(deny, labels)
+        return rule
+
+    for pair in range(index.pair_count):
+        start, end = index.pair_offset[pair], index.pair_offset[pair + 1]
+        if start == end:
+            continue
+        # позиции одного набора камней идут в индексе подряд
+        block = []
+        for state_index in range(start, end):
+            if marks is not None and not marks[state_index]:
+                continue
+            fields = board.unpack_state(packed_states[state_index])
+            legal = legal_move_order(board, adjacency, fields[side], fields[0] | fields[1],
+                                     board.code_to_forbidden(fields[2 + side]))
+            safe = _safe_moves_from_table(solver, color, state_index, packed_states, side, fields[side])
+            block.append((fields, legal, [move for move in legal if move not in safe]))
+        if not any(deny for _, _, deny in block):
+            continue
+        r = [labels[c] for c in board.mask_to_cells(block[0][0][0])]
+        b = [labels[c] for c in board.mask_to_cells(block[0][0][1])]
+
+        if not group:
+            for fields, _, deny in block:
+                if deny:
+                    yield state_rule(r, b, fields, deny)
+            continue
+
+        # запрет соперника не меняет ходов ходящего — по нему второй уровень групп
+        subgroups = {}
+        for fields, legal, deny in block:
+            subgroups.setdefault(fields[3 - side], []).append((fields, legal, deny))
+        entries = [[(legal, deny) for _, legal, deny in members] for members in subgroups.values()]
+        choices = {nothing} | {frozenset(deny) for _, _, deny in block}
+        choices.add(frozenset().union(*choices))
+        best = None
+        for denied in choices:
+            cost = (denied != nothing) + sum(_best_rule_choice(part, denied)[0] for part in entries)
+            if best is None or cost < best[0]:
+                best = (cost, denied)
+
+        class_denied = best[1]
+        if class_denied:
+            yield {"red": r, "black": b, "deny": _label_moves(class_denied, labels)}
+        for members, part in zip(subgroups.values(), entries):
+            _, denied = _best_rule_choice(part, class_denied)
+            if denied != class_denied:
+                yield state_rule(r, b, members[0][0], denied, (opponent_field,))
+            for fields, legal, deny in members:
+                if [move for move in legal if move in denied] != deny:
+                    yield state_rule(r, b, fields, deny)
+
+
+def expand_minimized_rules(solver, minimized, color=COLOR_BLACK, reachable=None):
+    """
+    Обратное к minimize_transition_rules: поток полных правил в формате
+    iter_transition_rules (разрешённые ходы — все ходы минус deny самого точного правила).
+    reachable — как при минимизации: правила только для достижимых позиций.
+    """
+    index = solver.index
+    board = index.board
+    labels = board.cell_to_label
+    adjacency = index.rules.neighbors
+    side = 0 if color == COLOR_RED else 1
+    exceptions = {}
+    for rule in minimized:
+        key = (tuple(rule["red"]), tuple(rule["black"]),
+               rule.get("red_forbidden", "*"), rule.get("black_forbidden", "*"))
+        exceptions[key] = set(map(tuple, rule["deny"]))
+    marks = None if reachable is None else reachable[color]
+
+    for state_index, packed in enumerate(index.iter_packed_states()):
+        if marks is not None and not marks[state_index]:
+            continue
+        fields = board.unpack_state(packed)
+        r = tuple(labels[c] for c in board.mask_to_cells(fields[0]))
+        b = tuple(labels[c] for c in board.mask_to_cells(fields[1]))
+        red_forbidden = forbidden_to_labels(board.code_to_forbidden(fields[2]), labels)
+        black_forbidden = forbidden_to_labels(board.code_to_forbidden(fields[3]), labels)
+        opponent_key = (r, b, "*", black_forbidden) if color == COLOR_RED else (r, b, red_forbidden, "*")
+        deny = ()
+        for key in ((r, b, red_forbidden, black_forbidden), opponent_key, (r, b, "*", "*")):
+            if key in exceptions:
+                deny = exceptions[key]
+                break
+        legal = legal_move_order(board, adjacency, fields[side], fields[0] | fields[1],
+                                 board.code_to_forbidden(fields[2 + side]))
+        allowed = [move for move in _label_moves(legal, labels) if move not in deny]
+        if allowed:
+            yield {
+                "index": state_index,
+                "red": list(r),
+                "black": list(b),
+                "red_forbidden": red_forbidden,
+                "black_forbidden": black_forbidden,
+                "transitions": allowed,
+            }
+
+
+def verify_minimized_rules(solver, minimized, color=COLOR_BLACK, reachable=None):
+    """
+    Разворачивает minimized и сравнивает с полной таблицей iter_transition_rules
+    (с reachable — по достижимым позициям). Возвращает (число правил полной таблицы,
+    число расхождений).
+    """
+    checked = mismatches = 0
+    for expanded, full in zip_longest(expand_minimized_rules(solver, minimized, color, reachable),
+                                      iter_transition_rules(solver, color, reachable)):
+        checked += full is not None
+        mismatches += expanded != full
+    return checked, mismatches
+
+
+def print_minimized_rules(rules, out=None, color=COLOR_BLACK):
+    """
+    Выводит правила minimize_transition_rules для color в виде вызовов addException({...});
+    у групповых правил полей запретов нет (или есть только запрет соперника).
+    """
+    def blocks():
+        for rule in rules:
+            forbidden = ""
+            if "red_forbidden" in rule:
+                forbidden += f"  redForbidden: {format_forbidden_field(rule['red_forbidden'])},\n"
+            if "black_forbidden" in rule:
+                forbidden += f"  blackForbidden: {format_forbidden_field(rule['black_forbidden'])},\n"
+            yield ("addException({\n"
+                   f"  red: [{', '.join(rule['red'])}],\n"
+                   f"  black: [{', '.join(rule['black'])}],\n"
+                   f"{forbidden}"
+                   f"  deny: [{', '.join(f'[{src}, {dst}]' for src, dst in rule['deny'])}],\n"
+                   "});\n")
+
+    out = sys.stdout if out is None else out
+    side = "Красные" if color == COLOR_RED else "Чёрные"
+    out.write(f"\n// {side}: исключения из «разрешён любой ход»\n")
+    write_buffered(out, blocks())
+
+
+# ==============================
+#  Командная строка
+# ==============================
+
+def parse_cells(text, board=None):
+    """'A1,A2,A3' -> (1, 2, 3); бросает ValueError при неизвестной метке. board — доска (по умолчанию 3×3)."""
+    labels = (DEFAULT_BOARD if board is None else board).label_to_cell
+    cells_out = []
+    for label in text.replace(" ", "").split(","):
+        if label.upper() not in labels:
+            raise ValueError(f"неизвестная клетка: {label!r}")
+        cells_out.append(labels[label.upper()])
+    return tuple(cells_out)
+
+
+def parse_forbidden(text, board=None):
+    """'B1,A1' -> (4, 1); пустая строка или 'none' — запрета нет."""
+    if text is None or text.lower() in ("", "none", "null"):
+        return None
+    pair = parse_cells(text, board)
+    if len(pair) != 2:
+        raise ValueError(f"запрет задаётся двумя клетками: {text!r}")
+    return pair
+
+
+def add_position_arguments(parser):
+    parser.add_argument("index", nargs="?", type=int,
+                        help="индекс позиции; по умолчанию позиция задаётся --red/--black или стартовая")
+    parser.add_argument("--red", help="камни красных, например A1,A2,A3")
+    parser.add_argument("--black", help="камни чёрных, например C1,C2,C3")
+    parser.add_argument("--red-ban", help="запрет красных (клетка, откуда пришли), например B1,A1")
+    parser.add_argument("--black-ban", help="запрет чёрных, например B3,C3")
+
+
+def add_color_argument(parser):
+    parser.add_argument("--color", choices=(COLOR_RED, COLOR_BLACK), default=COLOR_RED,
+                        help="кто ходит (по умолчанию R)")
+
+
+def resolve_position(parser, solver, args):
+    """Индекс позиции из аргументов командной строки."""
+    if args.index is not None:
+        if not 0 <= args.index < len(solver):
+            parser.error(f"индекс вне диапазона 0..{len(solver) - 1}")
+        return args.index
+
+    try:
+        red = parse_cells(args.red, solver.board) if args.red else solver.rules.red_start
+        black = parse_cells(args.black, solver.board) if args.black else solver.rules.black_start
+        red_forbidden = parse_forbidden(args.red_ban, solver.board)
+        black_forbidden = parse_forbidden(args.black_ban, solver.board)
+    except ValueError as exc:
+        parser.error(str(exc))
+
+    index = solver.lookup_state_index(red, black, red_forbidden, black_forbidden)
+    if index is None:
+        parser.error("такой позиции нет в словаре")
+    return index
+
+
+def build_arg_parser():
+    # search, selfplay и server сами импортируют calc, поэтому здесь — импорт по месту
+    from search import SEARCH_METHODS
+    from selfplay import SELFPLAY_POLICIES
+
+    parser = argparse.ArgumentParser(description="Ретроградный анализ мельницы 3×3.")
+    parser.add_argument("--table", metavar="PATH",
+                        help="файл решённой таблицы: читается, если подходит к правилам, иначе пересчитывается")
+    parser.add_argument("--engine", choices=sorted(RETROGRADE_ENGINES), default="queue",
+                        help="движок ретроградного анализа (numpy — послойный, нужен numpy)")
+    parser.add_argument("--symmetry", action="store_true",
+                        help="решать с точностью до симметрий доски (без --table, движок queue)")
+    parser.add_argument("--rules", choices=sorted(RULESETS), default=DEFAULT_RULES.name,
+                        help="набор правил (по умолчанию classic)")
+    parser.add_argument("--grid", metavar="RxC",
+                        help="вместо --rules: сетка R×C с линиями из трёх клеток (см. grid_rules)")
+    parser.add_argument("--stones", type=int, help="камней у каждого на сетке --grid (по умолчанию C)")
+    parser.add_argument("--king-moves", action="store_true",
+                        help="на сетке --grid ходить на любую из восьми соседних клеток")
+    parser.add_argument("--workers", type=int, default=1, metavar="N",
+                        help="процессов для построения графа переходов (по умолчанию 1)")
+    parser.add_argument("--unmoves", action="store_true",
+                        help="не хранить граф переходов: ходы и предшественники генерировать на лету"
+                             " (меньше памяти; без --table, движок queue)")
+    parser.add_argument("--solve-dir", metavar="DIR",
+                        help="решать на диске по частям с контрольными точками в DIR; прерванное решение"
+                             " продолжается, готовое читается (без --table, движок queue)")
+    parser.add_argument("--checkpoint-every", type=float, default=60.0, metavar="SECONDS",
+                        help="с --solve-dir: контрольная точка не чаще раза в SECONDS секунд (по умолчанию 60)")
+    parser.add_argument("--partition-states", type=int, default=PARTITION_STATES, metavar="N",
+                        help="с --solve-dir: состояний в части (по умолчанию 2^20)")
+    parser.add_argument("--stats", metavar="PATH",
+                        help="записать статистику решателя (фазы, счётчики, слои) в JSON; '-' — в stderr")
+    parser.add_argument("--profile", metavar="DIR", nargs="?", const="",
+                        help="со --stats: профилировать фазы cProfile (с DIR — ещё и файлы <фаза>.prof)")
+    commands = parser.add_subparsers(dest="command", metavar="команда")
+
+    commands.add_parser("summary", help="размер словаря и итоги ретроградного анализа")
+    commands.add_parser("positions", help="полный список позиций")
+
+    moves = commands.add_parser("moves", help="ходы из позиции")
+    add_position_arguments(moves)
+    add_color_argument(moves)
+
+    outcomes = commands.add_parser("outcomes", help="статусы всех продолжений из позиции")
+    add_position_arguments(outcomes)
+    add_color_argument(outcomes)
+
+    best = commands.add_parser("best", help="лучший ход: быстрейшая победа или самое долгое поражение")
+    add_position_arguments(best)
+    add_color_argument(best)
+
+    sources = commands.add_parser("sources", help="из каких позиций можно попасть в данную")
+    add_position_arguments(sources)
+
+    forced = commands.add_parser("forced-win", help="ходы, сохраняющие форсированную победу")
+    add_position_arguments(forced)
+    add_color_argument(forced)
+
+    search = commands.add_parser("search", help="поиск из позиции (альфа-бета или числа доказательства) без таблицы")
+    add_position_arguments(search)
+    add_color_argument(search)
+    search.add_argument("--method", choices=SEARCH_METHODS, default="alphabeta",
+                        help="итеративное углубление с альфа-бета или поиск по числам доказательства (pns)")
+    search.add_argument("--depth", type=int, default=64, help="предел глубины в полуходах (по умолчанию 64)")
+    search.add_argument("--time", type=float, metavar="SEC", help="предел времени в секундах")
+    search.add_argument("--nodes", type=int, help="предел числа узлов")
+    search.add_argument("--oracle", metavar="PATH",
+                        help="обрезать поиск по таблице: файл --table или каталог --solve-dir (можно недорешённый)")
+
+    batch = commands.add_parser("batch", help="решить несколько наборов правил параллельно и сравнить")
+    batch.add_argument("names", nargs="*", metavar="правила",
+                       help=f"наборы правил: {', '.join(sorted(RULESETS))} (по умолчанию все)")
+    batch.add_argument("--jobs", type=int, default=None, help="число процессов (по умолчанию по числу ядер)")
+
+    selfplay = commands.add_parser("selfplay", help="турнир политик самоигрой: лучший ход, случайный, правила переходов")
+    selfplay.add_argument("--policies", nargs="+", choices=tuple(SELFPLAY_POLICIES), default=list(SELFPLAY_POLICIES),
+                          help="политики турнира: играются все пары (красные, чёрные)")
+    selfplay.add_argument("--games", type=int, default=10000, help="партий на пару политик (по умолчанию 10000)")
+    selfplay.add_argument("--max-plies", type=int, default=200,
+                          help="после стольких полуходов партия — ничья (по умолчанию 200)")
+    selfplay.add_argument("--batch", type=int, default=1 << 16, help="партий в пачке (по умолчанию 65536)")
+    selfplay.add_argument("--jobs", type=int, default=1, help="число процессов (0 — по числу ядер)")
+    selfplay.add_argument("--seed", type=int, default=0, help="зерно генератора (по умолчанию 0)")
+    selfplay.add_argument("--reachable-only", action="store_true",
+                          help="строить правила safe только для позиций, достижимых со старта")
+    selfplay.add_argument("-o", "--output", metavar="PATH", help="записать итоги в JSON")
+
+    tune = commands.add_parser("tune", help="правки соседства и первых ходов с пересчётом по частям (из stdin)")
+    tune.add_argument("--verify", action="store_true", help="сверять каждый пересчёт с полным")
+
+    serve = commands.add_parser("serve", help="HTTP/JSON-сервер запросов о позициях (см. PositionService)")
+    serve.add_argument("--host", default="127.0.0.1", help="адрес (по умолчанию 127.0.0.1)")
+    serve.add_argument("--port", type=int, default=8765, help="порт (по умолчанию 8765)")
+    serve.add_argument("--precompute", action="store_true", help="заранее построить ответы для всех позиций")
+
+    dump = commands.add_parser("export", help="потоковый экспорт позиций или безопасных переходов в файл")
+    dump.add_argument("what", choices=("positions", "rules"), help="что выгружать")
+    dump.add_argument("--format", choices=("jsonl", "csv", "binary"), default="jsonl", help="формат (по умолчанию jsonl)")
+    dump.add_argument("--color", choices=(COLOR_RED, COLOR_BLACK, "both"),
+                      help="кто ходит (по умолчанию: both для позиций, B для переходов)")
+    dump.add_argument("--only", choices=sorted(EXPORT_OUTCOMES), help="только позиции с таким исходом для ходящего")
+    dump.add_argument("-o", "--output", metavar="PATH", help="файл (по умолчанию stdout)")
+    dump.add_argument("--reachable-only", action="store_true",
+                      help="выгружать только позиции, достижимые со старта (по умолчанию все)")
+
+    annotate = commands.add_parser("annotate", help="разметка партий из лога: статус, полуходы и ошибки каждого хода")
+    annotate.add_argument("input", nargs="?", metavar="LOG",
+                          help="партии по одной на строку, ходы вида A1-B2 (по умолчанию stdin)")
+    annotate.add_argument("--format", choices=("jsonl", "csv"), default="jsonl", help="формат (по умолчанию jsonl)")
+    annotate.add_argument("-o", "--output", metavar="PATH", help="файл (по умолчанию stdout)")
+
+    export = commands.add_parser("export-rules", help="безопасные переходы чёрных")
+    export.add_argument("--format", choices=("js", "numeric", "packed", "minimal"), default="js",
+                        help="addRule({...}), числовой словарь по индексам, упакованная таблица"
+                             " обоих цветов с декодером или только исключения (addException)")
+    export.add_argument("--no-group", action="store_true",
+                        help="для minimal: не объединять позиции с одинаковыми камнями")
+    export.add_argument("--verify", action="store_true",
+                        help="для minimal: развернуть исключения и сверить с полной таблицей")
+    export.add_argument("--reachable-only", action="store_true",
+                        help="правила только для позиций, достижимых со старта (по умолчанию для всех)")
+
+    status = commands.add_parser("export-status", help="статусы всех позиций по 2 бита (таблица для клиентов)")
+    status.add_argument("--format", choices=("js", "binary"), default="js",
+                        help="MILL_STATUS с декодером decodeMillStatus или файл serialize_status_table")
+    status.add_argument("--raw", action="store_true", help="не сжимать таблицу (для клиентов без deflate)")
+    status.add_argument("-o", "--output", metavar="PATH", help="файл (по умолчанию stdout)")
+
+    return parser
+
+
+def main(argv=None):
+    parser = build_arg_parser()
+    args = parser.parse_args(argv)
+    if args.engine == "numpy" and np is None:
+        parser.error("движок numpy недоступен: модуль numpy не установлен")
+    try:
+        if args.grid:
+            rows, _, cols = args.grid.lower().partition("x")
+            rules = grid_rules(int(rows), int(cols), args.stones, king_moves=args.king_moves)
+        else:
+            rules = RULESETS[args.rules]
+        stats = None
+        if args.stats:
+            stats = SolverStats(profile=args.profile is not None, profile_dir=args.profile or None)
+        solver = Solver(cache_path=args.table, engine=args.engine, symmetry=args.symmetry, rules=rules, stats=stats,
+                        workers=args.workers, unmoves=args.unmoves, solve_dir=args.solve_dir,
+                        checkpoint_every=args.checkpoint_every, partition_states=args.partition_states)
+        if args.solve_dir:
+            solver.retro_status  # сразу: каталог с чужим решением — ошибка аргументов, а не трассировка
+    except ValueError as exc:
+        parser.error(str(exc))
+    command = args.command or "summary"
+    exit_code = 0
+
+    if command == "batch":
+        unknown = [name for name in args.names if name not in RULESETS]
+        if unknown:
+            parser.error(f"неизвестные наборы правил: {', '.join(unknown)}")
+        names = args.names or list(RULESETS)
+        print_batch_summary(solve_rulesets([RULESETS[name] for name in names], args.jobs, args.engine))
+    elif command == "summary":
+        print("Размер словаря после фильтрации:", len(solver))
+        if solver.symmetry:
+            print("Канонических состояний (с точностью до симметрий):", len(solver.reduction))
+        reachable = solver.reachable
+        print(f"Достижимо со старта: при ходе красных {reachable[COLOR_RED].count(1)},"
+              f" при ходе чёрных {reachable[COLOR_BLACK].count(1)}")
+        print_retrograde_summary(solver.retro_status, solver.retro_distance)
+    elif command == "positions":
+        print_all_positions(solver)
+    elif command == "moves":
+        print_moves_for_position(solver, resolve_position(parser, solver, args), args.color)
+    elif command == "outcomes":
+        print_move_outcomes(solver, resolve_position(parser, solver, args), args.color)
+    elif command == "best":
+        print_best_move(solver, resolve_position(parser, solver, args), args.color)
+    elif command == "sources":
+        print_sources_for_position(solver, resolve_position(parser, solver, args))
+    elif command == "forced-win":
+        show_forced_win_moves(solver, resolve_position(parser, solver, args), args.color)
+    elif command == "search":
+        from search import PartitionOracle, SearchEngine, TableOracle, print_search_result
+
+        index = resolve_position(parser, solver, args)
+        oracle = None
+        if args.oracle and os.path.isdir(args.oracle):
+            try:
+                oracle = PartitionOracle(*open_solve_dir(solver.index, args.oracle))
+            except ValueError as exc:
+                parser.error(str(exc))
+        elif args.oracle:
+            sections = open_tablebase(args.oracle, rules)
+            if sections is None:
+                parser.error(f"{args.oracle}: нет файла таблицы для правил {rules.name}")
+            oracle = TableOracle.from_tablebase(sections, rules)
+        engine = SearchEngine(solver.index, oracle=oracle)
+        result = engine.search(index, args.color, args.depth, args.time, args.nodes, args.method)
+        print_search_result(solver, index, args.color, result)
+    elif command == "selfplay":
+        from selfplay import build_play_tables, print_tournament, run_tournament, tournament_report
+
+        if np is None:
+            parser.error("самоигра недоступна: модуль numpy не установлен")
+        if solver.symmetry or solver.unmoves:
+            parser.error("selfplay несовместим с --symmetry и --unmoves")
+        try:
+            tables = build_play_tables(solver, solver.reachable if args.reachable_only else None)
+        except ValueError as exc:
+            parser.error(str(exc))
+        results = run_tournament(tables, args.policies, args.games, args.max_plies, args.batch,
+                                 args.jobs or None, args.seed)
+        print_tournament(results)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as out:
+                json.dump(tournament_report(results), out, ensure_ascii=False, indent=2)
+    elif command == "tune":
+        if solver.symmetry:
+            parser.error("tune несовместим с --symmetry")
+        interactive = sys.stdin.isatty()
+        if interactive:
+            print(f"Правила {solver.rules.name}. Правки: «+A1 B2» / «-A1 B2» — соседство,"
+                  " «first +A2,A3,B1» / «first -…» — первые ходы красных; quit — выход.")
+
+        def commands_from_stdin():
+            while True:
+                if interactive:
+                    print("> ", end="", flush=True)
+                line = sys.stdin.readline()
+                if not line:
+                    return
+                if not interactive:
+                    print(">", line.strip())
+                yield line
+
+        if tune_rules(solver, commands_from_stdin(), args.verify):
+            exit_code = 1
+    elif command == "serve":
+        from server import PositionService, make_query_server
+
+        service = PositionService(solver)
+        service.warm_up(args.precompute)
+        server = make_query_server(service, args.host, args.port)
+        print(f"Сервер запросов: http://{args.host}:{server.server_address[1]}/ (правила {solver.rules.name})")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+    elif command == "export":
+        colors = export_colors(args.color or (COLOR_BLACK if args.what == "rules" else "both"))
+        exporter = export_positions if args.what == "positions" else export_rules
+        binary = args.format == "binary"
+        if args.output:
+            out = open(args.output, "wb" if binary else "w", encoding=None if binary else "utf-8", newline=None if binary else "")
+        else:
+            out = sys.stdout.buffer if binary else sys.stdout
+        try:
+            exporter(solver, out, args.format, colors, args.only, solver.reachable if args.reachable_only else None)
+        finally:
+            if args.output:
+                out.close()
+    elif command == "annotate":
+        source = open(args.input, encoding="utf-8") if args.input else sys.stdin
+        out = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+        solver.retro_status, solver.retro_distance  # решение — до замера скорости разбора
+        started = time.perf_counter()
+        try:
+            summary = export_annotations(annotate_games(solver, source), out, args.format)
+        finally:
+            if args.input:
+                source.close()
+            if args.output:
+                out.close()
+        elapsed = time.perf_counter() - started
+        print(f"Партий {summary['games']}, полуходов {summary['plies']}, ошибок {summary['blunders']},"
+              f" отвергнутых ходов {summary['rejected']}; {summary['plies'] / max(elapsed, 1e-9):.0f} полуходов/с",
+              file=sys.stderr)
+    elif command == "export-status":
+        if args.format == "binary":
+            data = serialize_status_table(pack_status_table(solver.retro_status), solver.rules, not args.raw)
+            if args.output:
+                with open(args.output, "wb") as out:
+                    out.write(data)
+            else:
+                sys.stdout.buffer.write(data)
+        elif args.output:
+            with open(args.output, "w", encoding="utf-8") as out:
+                print_status_table(solver, out, not args.raw)
+        else:
+            print_status_table(solver, deflate=not args.raw)
+    elif command == "export-rules":
+        reachable = solver.reachable if args.reachable_only else None
+        rules = iter_transition_rules(solver, COLOR_BLACK, reachable)
+        if args.format == "minimal":
+            minimized = list(minimize_transition_rules(solver, COLOR_BLACK, not args.no_group, reachable))
+            mismatches = 0
+            if args.verify:
+                checked, mismatches = verify_minimized_rules(solver, minimized, COLOR_BLACK, reachable)
+                print(f"// Проверка: правил в полной таблице {checked}, исключений {len(minimized)},"
+                      f" расхождений {mismatches}", file=sys.stderr)
+            if mismatches:
+                exit_code = 1
+            else:
+                print_minimized_rules(minimized, color=COLOR_BLACK)
+        elif args.format == "packed":
+            try:
+                print_packed_rule_table(solver, reachable=reachable)
+            except ValueError as exc:
+                parser.error(str(exc))
+        elif args.format == "js":
+            print_black_transition_rules(rules)
+        else:
+            print_black_transition_rules_numeric(solver, rules)
+
+    if stats is not None:
+        report = json.dumps(solver.statistics(), ensure_ascii=False, indent=2)
+        if args.stats == "-":
+            print(report, file=sys.stderr)
+        else:
+            with open(args.stats, "w", encoding="utf-8") as out:
+                out.write(report + "\n")
+    return exit_code
 
 
-# Полный вывод всех позиций:
-print_all_positions()
+if __name__ == "__main__":
+    # модули команд импортируют calc: CLI работает с ним, а не с копией в __main__
+    import calc
+    sys.exit(calc.main())
@@ -0,0 +1,53 @@
+import pytest
+
+import calc
+from calc import RULESETS, Solver
+
+
+@pytest.fixture(scope="session")
+def solved():
+    """Решённые Solver по именам наборов правил (строятся один раз на прогон)."""
+    cache = {}
+
+    def get(name):
+        if name not in cache:
+            cache[name] = Solver(rules=RULESETS[name])
+            cache[name].best_moves
+        return cache[name]
+    return get
+
+
+class SolveInterrupted(Exception):
+    """Имитация сбоя посреди solve_on_disk."""
+
+
+@pytest.fixture
+def interrupted_solve(monkeypatch):
+    """
+    solve_on_disk(index, directory, **options), оборванный посреди слоя layer: фронт
+    читается пачками по 64 позиции, и на первой пачке слоя обработана только половина.
+    """
+    def run(index, directory, layer, **options):
+        read_layer, expand = calc._read_layer, calc._expand_layer
+        layers = [0]
+
+        def counting(path):
+            layers[0] += 1
+            return read_layer(path)
+
+        def crashing(store, items, push):
+            if layers[0] > layer:
+                expand(store, items[:len(items) // 2], push)
+                raise SolveInterrupted
+            expand(store, items, push)
+
+        monkeypatch.setattr(calc, "LAYER_CHUNK", 64)
+        monkeypatch.setattr(calc, "_read_layer", counting)
+        monkeypatch.setattr(calc, "_expand_layer", crashing)
+        try:
+            with pytest.raises(SolveInterrupted):
+                calc.solve_on_disk(index, directory, **options)
+        finally:
+            monkeypatch.setattr(calc, "_read_layer", read_layer)
+            monkeypatch.setattr(calc, "_expand_layer", expand)
+    return run
@@ -0,0 +1,405 @@
+"""
+Поиск из отдельной позиции без полной таблицы: итеративное углубление с альфа-бета
+и поиск по числам доказательства (SearchEngine), команда `calc.py search`.
+"""
+
+import time
+from bisect import bisect_right
+
+from calc import BLACK_MILL, COLOR_BLACK, COLOR_RED, RED_MILL, forbidden_to_labels
+
+
+# Оценки поиска — с точки зрения ходящего: победа через n полуходов — SEARCH_WIN - n,
+# поражение через n — -(SEARCH_WIN - n); оценки не меньше SEARCH_PROVEN по модулю — доказанный исход.
+SEARCH_WIN = 1 << 20
+SEARCH_PROVEN = SEARCH_WIN - (1 << 16)
+SEARCH_METHODS = ("alphabeta", "pns")
+
+# Вид оценки в таблице транспозиций
+TT_EXACT, TT_LOWER, TT_UPPER = 0, 1, 2
+
+PN_INFINITY = 1 << 62
+
+
+class SearchInterrupted(Exception):
+    """Исчерпан бюджет поиска (время или число узлов)."""
+
+
+class ProofNode:
+    """Узел дерева поиска по числам доказательства: позиция, кто ходит, родитель, дети, числа."""
+
+    __slots__ = ("state", "side", "parent", "children", "proof", "disproof")
+
+    def __init__(self, state, side, parent):
+        self.state = state
+        self.side = side
+        self.parent = parent
+        self.children = None
+        self.proof = 1
+        self.disproof = 1
+
+
+class TableOracle:
+    """
+    Исходы позиций для SearchEngine из массивов по индексам тех же правил: status и
+    distance — пары (ходят красные, ходят чёрные), как retro_status / retro_distance
+    решателя или секции файла таблицы. probe(state, side) — (статус, расстояние) или
+    None, если исход неизвестен. complete=False — таблица частичная: статус 0 значит
+    «не решено», а не ничья; max_distance — верить только исходам не дальше него.
+    """
+
+    def __init__(self, rules, status, distance, complete=True, max_distance=None):
+        self.rules = rules
+        self.status = status
+        self.distance = distance
+        self.complete = complete
+        self.max_distance = max_distance
+
+    @classmethod
+    def from_solver(cls, solver):
+        status, distance = solver.retro_status, solver.retro_distance
+        return cls(solver.rules, (status[COLOR_RED], status[COLOR_BLACK]),
+                   (distance[COLOR_RED], distance[COLOR_BLACK]))
+
+    @classmethod
+    def from_tablebase(cls, sections, rules):
+        """Секции open_tablebase (открытого для тех же rules) — без чтения файла целиком."""
+        return cls(rules, (sections["red_status"], sections["black_status"]),
+                   (sections["red_distance"], sections["black_distance"]))
+
+    def probe(self, state, side):
+        status = self.status[side][state]
+        if status:
+            distance = self.distance[side][state]
+            if self.max_distance is None or distance <= self.max_distance:
+                return status, distance
+        elif self.complete:
+            return 0, 0
+        return None
+
+
+class PartitionOracle:
+    """
+    Исходы позиций из каталога solve_on_disk (open_solve_dir), в том числе прерванного:
+    тогда известны только позиции, решённые до последней контрольной точки. Части
+    отображаются через mmap по мере обращений, как при самом решении.
+    """
+
+    def __init__(self, store, layer, complete):
+        self.rules = store.index.rules
+        self.store = store
+        self.layer = layer
+        self.complete = complete
+
+    def probe(self, state, side):
+        store = self.store
+        part = bisect_right(store.starts, state) - 1
+        values = store.opened.get(part) or store.arrays(part)
+        local = state - store.starts[part]
+        status = values[4 + side][local]
+        if status:
+            distance = values[side][local]
+            if distance <= self.layer:
+                return status, distance
+        elif self.complete:
+            return 0, 0
+        return None
+
+
+class SearchEngine:
+    """
+    Поиск из отдельной позиции по ходам generate_moves_from_masks, без графа переходов:
+    итеративное углубление с альфа-бета отсечением (negamax) и таблицей транспозиций
+    по (индекс состояния, кто ходит) либо поиск по числам доказательства (method="pns").
+
+    oracle — источник исходов тех же правил (TableOracle, PartitionOracle или решённый
+    Solver): позиции, исход которых он знает, не раскрываются, их оценка точная; корень
+    раскрывается всегда, чтобы был ход. Таблица может быть частичной — например, прерванное
+    решение на диске или эндшпиль: тогда поиск обрезается только там, где исход известен,
+    так что он годится и для правил, где полный ретроградный анализ слишком велик.
+
+    Повторение позиции на текущем пути считается ничьей: победа при лучшей игре
+    достигается без повторений, так что доказанные исходы от этого не меняются.
+    Недоказанная оценка, в которую вошло такое повторение, зависит от пути и в таблицу
+    транспозиций не пишется (остаётся только ход для упорядочивания).
+    Неоконченная позиция на границе глубины оценивается как 0.
+    """
+
+    def __init__(self, index, oracle=None, table_size=1 << 20):
+        """index — StateIndex; table_size — сколько позиций держать в таблице транспозиций."""
+        if oracle is not None and not hasattr(oracle, "probe"):
+            oracle = TableOracle.from_solver(oracle)
+        if oracle is not None and oracle.rules != index.rules:
+            raise ValueError("таблица oracle решена для других правил")
+        self.index = index
+        self.oracle = oracle
+        self.table_size = table_size
+        self.table = {}
+        self.nodes = 0
+        self._probe = None if oracle is None else oracle.probe
+        self._repeated = False
+        self._root_move = None
+        self._mill_flags = index.rules.mill_flags
+        self._unpack = index.board.unpack_state
+        self._path = set()
+        self._deadline = None
+        self._node_limit = None
+
+    def _fields(self, state):
+        index = self.index
+        packed = index.packed_states[state] if index.packed_states is not None else index.unrank_state(state)
+        return self._unpack(packed)
+
+    def _moves(self, fields, side):
+        return self.index.generate_moves_from_masks(*fields, COLOR_BLACK if side else COLOR_RED)
+
+    def _count_node(self):
+        self.nodes += 1
+        if self._node_limit is not None and self.nodes > self._node_limit:
+            raise SearchInterrupted
+        if self._deadline is not None and not self.nodes & 255 and time.perf_counter() > self._deadline:
+            raise SearchInterrupted
+
+    def _terminal(self, fields, side):
+        """Исход для ходящего по мельницам на доске: 1, -1 или None, если мельницы нет."""
+        if self._mill_flags[fields[0]] & RED_MILL:
+            return -1 if side else 1
+        if self._mill_flags[fields[1]] & BLACK_MILL:
+            return 1 if side else -1
+        return None
+
+    def _store(self, key, depth, flag, value, ply, move):
+        # доказанные оценки хранятся относительно самой позиции, а не корня
+        if value >= SEARCH_PROVEN:
+            value += ply
+        elif value <= -SEARCH_PROVEN:
+            value -= ply
+        if len(self.table) >= self.table_size:
+            self.table.clear()
+        self.table[key] = (depth, flag, value, move)
+
+    def _negamax(self, state, side, depth, alpha, beta, ply):
+        self._count_node()
+        if self._probe is not None and ply:
+            known = self._probe(state, side)
+            if known is not None:
+                status, distance = known
+                if not status:
+                    return 0
+                score = SEARCH_WIN - ply - distance
+                return score if status > 0 else -score
+
+        fields = self._fields(state)
+        outcome = self._terminal(fields, side)
+        if outcome is not None:
+            return outcome * (SEARCH_WIN - ply)
+        key = state << 1 | side
+        if key in self._path:
+            self._repeated = True
+            return 0
+
+        hint = None
+        entry = self.table.get(key)
+        # в корне оценка из таблицы не обрывает поиск: нужен ход, а не только оценка
+        if entry is not None and not ply:
+            hint = entry[3]
+        elif entry is not None:
+            entry_depth, flag, value, hint = entry
+            if value >= SEARCH_PROVEN:
+                value -= ply
+            elif value <= -SEARCH_PROVEN:
+                value += ply
+            # доказанная оценка верна на любой глубине, прочие — только не меньшей
+            if (entry_depth >= depth or (flag != TT_UPPER and value >= SEARCH_PROVEN)
+                    or (flag != TT_LOWER and value <= -SEARCH_PROVEN)):
+                if flag == TT_EXACT:
+                    return value
+                if flag == TT_LOWER:
+                    alpha = max(alpha, value)
+                else:
+                    beta = min(beta, value)
+                if alpha >= beta:
+                    return value
+        if depth <= 0:
+            return 0
+
+        moves = self._moves(fields, side)
+        if not moves:
+            return -(SEARCH_WIN - ply)
+        if hint is not None and hint in moves:
+            moves.remove(hint)
+            moves.insert(0, hint)
+
+        start_alpha = alpha
+        best = -SEARCH_WIN - 1
+        choice = None
+        # было ли повторение на пути где-то ниже этой позиции
+        repeated, self._repeated = self._repeated, False
+        self._path.add(key)
+        try:
+            for target in moves:
+                score = -self._negamax(target, side ^ 1, depth - 1, -beta, -alpha, ply + 1)
+                if score > best:
+                    best, choice = score, target
+                    if best > alpha:
+                        alpha = best
+                        if alpha >= beta:
+                            break
+        finally:
+            self._path.discard(key)
+            path_dependent = self._repeated
+            self._repeated = repeated or path_dependent
+
+        if not ply:
+            self._root_move = choice
+        flag = TT_UPPER if best <= start_alpha else TT_LOWER if best >= beta else TT_EXACT
+        if path_dependent and -SEARCH_PROVEN < best < SEARCH_PROVEN:
+            # глубина -1 ничего не отсекает, но ход остаётся подсказкой
+            self._store(key, -1, flag, best, ply, choice)
+        else:
+            self._store(key, depth, flag, best, ply, choice)
+        return best
+
+    def _alphabeta(self, state, side, max_depth, result):
+        for depth in range(1, max_depth + 1):
+            self._root_move = None
+            score = self._negamax(state, side, depth, -SEARCH_WIN - 1, SEARCH_WIN + 1, 0)
+            result["depth"] = depth
+            result["move"] = self._root_move
+            if score >= SEARCH_PROVEN:
+                result.update(status=1, distance=SEARCH_WIN - score, proven=True)
+            elif score <= -SEARCH_PROVEN:
+                result.update(status=-1, distance=SEARCH_WIN + score, proven=True)
+            else:
+                # с полной таблицей оценки продолжений точные — одной глубины достаточно
+                result.update(status=0, distance=None, proven=self.oracle is not None and self.oracle.complete)
+            if result["proven"]:
+                break
+
+    def _proof_leaf(self, node, attacker):
+        """Числа листа: исход по таблице oracle (кроме корня), мельницам или повторению на пути, иначе (1, 1)."""
+        outcome = None
+        if self._probe is not None and node.parent is not None:
+            known = self._probe(node.state, node.side)
+            if known is not None:
+                outcome = known[0]
+        if outcome is None:
+            outcome = self._terminal(self._fields(node.state), node.side)
+        if outcome is None:
+            parent = node.parent
+            while parent is not None:
+                if parent.state == node.state and parent.side == node.side:
+                    outcome = 0
+                    break
+                parent = parent.parent
+            else:
+                return
+        won = outcome == 1 if node.side == attacker else outcome == -1
+        node.proof, node.disproof = (0, PN_INFINITY) if won else (PN_INFINITY, 0)
+
+    def _prove(self, state, side, attacker):
+        """Дерево поиска по числам доказательства: может ли attacker (0 — красные) выиграть."""
+        root = ProofNode(state, side, None)
+        self._proof_leaf(root, attacker)
+        while root.proof and root.disproof:
+            node = root
+            while node.children is not None:
+                if node.side == attacker:
+                    node = min(node.children, key=lambda child: child.proof)
+                else:
+                    node = min(node.children, key=lambda child: child.disproof)
+
+            self._count_node()
+            moves = self._moves(self._fields(node.state), node.side)
+            node.children = []
+            if not moves:
+                won = node.side != attacker
+                node.proof, node.disproof = (0, PN_INFINITY) if won else (PN_INFINITY, 0)
+            for target in moves:
+                child = ProofNode(target, node.side ^ 1, node)
+                self._proof_leaf(child, attacker)
+                node.children.append(child)
+
+            while node is not None:
+                if node.children:
+                    proofs = [child.proof for child in node.children]
+                    disproofs = [child.disproof for child in node.children]
+                    if node.side == attacker:
+                        node.proof, node.disproof = min(proofs), min(PN_INFINITY, sum(disproofs))
+                    else:
+                        node.proof, node.disproof = min(PN_INFINITY, sum(proofs)), min(disproofs)
+                    if node is not root and not (node.proof and node.disproof):
+                        node.children = ()  # решённое поддерево больше не нужно
+                node = node.parent
+        return root
+
+    def _proof_number(self, state, side, result):
+        win = self._prove(state, side, side)
+        if not win.proof:
+            result.update(status=1, proven=True,
+                          move=next((child.state for child in win.children or () if not child.proof), None))
+            return
+        loss = self._prove(state, side, side ^ 1)
+        children = loss.children or ()
+        if not loss.proof:
+            result.update(status=-1, proven=True, move=children[0].state if children else None)
+        else:
+            # ход, на котором соперник не может доказать победу
+            result.update(status=0, proven=True,
+                          move=next((child.state for child in children if not child.disproof), None))
+
+    def search(self, state, color, max_depth=64, time_limit=None, node_limit=None, method="alphabeta"):
+        """
+        Поиск из позиции state, ходит color. max_depth — предел глубины итеративного
+        углубления (в полуходах), time_limit — секунды, node_limit — узлы.
+        Возвращает словарь: move (индекс позиции после хода или None), status (1, -1, 0),
+        distance (полуходов до конца при лучшей игре или None), proven (исход доказан;
+        без него status 0 значит «не найдено в пределах глубины»), depth (последняя
+        пройденная глубина), nodes, seconds, complete (поиск не прерван бюджетом), method.
+        Прерванный поиск возвращает результат последней пройденной глубины.
+        """
+        if method not in SEARCH_METHODS:
+            raise ValueError(f"неизвестный метод поиска: {method!r}")
+        started = time.perf_counter()
+        self.nodes = 0
+        self._deadline = None if time_limit is None else started + time_limit
+        self._node_limit = node_limit
+        side = 0 if color == COLOR_RED else 1
+        result = {"method": method, "move": None, "status": 0, "distance": None, "proven": False,
+                  "depth": 0, "complete": True}
+        try:
+            if method == "pns":
+                self._proof_number(state, side, result)
+            else:
+                self._alphabeta(state, side, max_depth, result)
+        except SearchInterrupted:
+            result["complete"] = False
+        finally:
+            self._path.clear()
+            self._repeated = False
+        result["nodes"] = self.nodes
+        result["seconds"] = time.perf_counter() - started
+        return result
+
+
+def print_search_result(solver, index, color, result):
+    """Выводит результат SearchEngine.search для позиции index."""
+    labels = solver.board.cell_to_label
+    outcome = {1: "победа", -1: "поражение", 0: "ничья" if result["proven"] else "не определено"}[result["status"]]
+    r, b, _, _ = solver.state_at(index)
+    print(f"\nПоиск ({result['method']}) из позиции #{index}: Red={tuple(labels[c] for c in r)}"
+          f" Black={tuple(labels[c] for c in b)}")
+    print(f"Ход {'красных' if color == COLOR_RED else 'чёрных'}: {outcome}"
+          + (f" за {result['distance']} полуход." if result["distance"] is not None else "")
+          + ("" if result["proven"] else " (не доказано)"))
+    depth = f"глубина {result['depth']}, " if result["method"] == "alphabeta" else ""
+    print(f"   {depth}узлов {result['nodes']}, {result['seconds']:.3f} с"
+          + ("" if result["complete"] else " — бюджет исчерпан"))
+
+    target = result["move"]
+    if target is None:
+        print("   Хода нет.")
+        return
+    st = solver.state_at(target)
+    print(f"   -> #{target}: Red={tuple(labels[c] for c in st[0])} Black={tuple(labels[c] for c in st[1])}"
+          f"  R-ban={forbidden_to_labels(st[2], labels)}  B-ban={forbidden_to_labels(st[3], labels)}")
@@ -0,0 +1,270 @@
+"""
+Самоигра пачками по массивам переходов и турнир политик (run_tournament),
+команда `calc.py selfplay`.
+"""
+
+import os
+import sys
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from calc import (BLACK_MILL, COLOR_BLACK, COLOR_RED, NO_MOVE, RED_MILL, _packed_state_list, _typecode,
+                  iter_transition_rules)
+
+try:
+    import numpy as np
+except ImportError:  # numpy нужен только для самоигры
+    np = None
+
+
+# Партии идут пачками: состояние пачки — массив индексов позиций, и все партии пачки
+# делают очередной полуход разом (ходят все красные, затем все чёрные), по массивам
+# переходов, статусов и лучших ходов (build_play_tables).
+
+_play_tables = None
+
+
+def _rule_edges(solver, color, reachable=None):
+    """
+    Переходы color, разрешённые экспортируемыми правилами (iter_transition_rules):
+    CSR (смещения по позициям, номера рёбер в solver.outgoing(color).targets).
+    Ходы правил сопоставляются рёбрам по клеткам (откуда, куда), как их видит клиент.
+    """
+    index = solver.index
+    board = index.board
+    label_to_cell = board.label_to_cell
+    packed_states = _packed_state_list(index)
+    moves = solver.outgoing(color)
+    offsets, targets = moves.offsets, moves.targets
+    side = 0 if color == COLOR_RED else 1
+    counts = np.zeros(len(index) + 1, dtype=np.int64)
+    edges = array("q")
+    for rule in iter_transition_rules(solver, color, reachable):
+        state_index = rule["index"]
+        allowed = {(label_to_cell[src], label_to_cell[dst]) for src, dst in rule["transitions"]}
+        own_mask = board.unpack_state(packed_states[state_index])[side]
+        for position in range(offsets[state_index], offsets[state_index + 1]):
+            target_mask = board.unpack_state(packed_states[targets[position]])[side]
+            src, = board.mask_to_cells(own_mask & ~target_mask)
+            dst, = board.mask_to_cells(target_mask & ~own_mask)
+            if (src, dst) in allowed:
+                edges.append(position)
+                counts[state_index + 1] += 1
+    return np.cumsum(counts), np.frombuffer(edges, dtype=np.int64)
+
+
+def build_play_tables(solver, reachable=None):
+    """
+    Массивы NumPy для самоигры (словарь, его можно передать в другие процессы):
+      - start — индекс стартовой позиции, terminal — 1/2 у позиций с мельницей красных/чёрных;
+      - по сторонам (0 — красные, 1 — чёрные): offsets/targets — ходы, status/distance —
+        статусы и расстояния, best — номер ребра лучшего хода (-1, если хода нет),
+        rule_offsets/rule_edges — рёбра, разрешённые правилами переходов (_rule_edges;
+        reachable — как при экспорте).
+    Нужны numpy и решатель без симметрий (таблица лучших ходов).
+    """
+    if np is None:
+        raise RuntimeError("самоигра недоступна: модуль numpy не установлен")
+    if solver.symmetry or solver.unmoves:
+        raise ValueError("самоигре нужны хранимый граф переходов и таблица лучших ходов"
+                         " (без симметрий и генерации предшественников)")
+    index = solver.index
+    rules = index.rules
+    start = index.lookup_state_index(rules.red_start, rules.black_start)
+    if start is None:
+        raise ValueError("стартовой позиции нет в словаре")
+
+    packed = np.fromiter(index.iter_packed_states(), dtype=np.uint64, count=len(index))
+    mills = np.frombuffer(bytes(rules.mill_flags), dtype=np.uint8)
+    cell_mask = np.uint64((1 << index.board.cell_count) - 1)
+    red_win = (mills[(packed & cell_mask).astype(np.intp)] & RED_MILL) != 0
+    black_win = (mills[(packed >> np.uint64(index.board.cell_count) & cell_mask).astype(np.intp)] & BLACK_MILL) != 0
+    terminal = np.where(red_win, 1, np.where(black_win, 2, 0)).astype(np.int8)
+
+    tables = {"start": start, "terminal": terminal, "offsets": [], "targets": [], "status": [], "distance": [],
+              "best": [], "rule_offsets": [], "rule_edges": []}
+    for color in (COLOR_RED, COLOR_BLACK):
+        moves = solver.outgoing(color)
+        offsets = np.frombuffer(moves.offsets, dtype=np.uint64).astype(np.int64)
+        best = np.frombuffer(solver.best_moves[color], dtype=np.uint8).astype(np.int64)
+        rule_offsets, rule_edges = _rule_edges(solver, color, reachable)
+        tables["offsets"].append(offsets)
+        tables["targets"].append(np.frombuffer(moves.targets, dtype=np.dtype(_typecode(moves.targets))).astype(np.int64))
+        tables["status"].append(np.frombuffer(solver.retro_status[color], dtype=np.int8).copy())
+        distance = solver.retro_distance[color]
+        tables["distance"].append(np.frombuffer(distance, dtype=np.dtype(_typecode(distance))).astype(np.int64))
+        tables["best"].append(np.where(best == NO_MOVE, -1, offsets[:-1] + best))
+        tables["rule_offsets"].append(rule_offsets)
+        tables["rule_edges"].append(rule_edges)
+    return tables
+
+
+def _policy_best(tables, side, states, rng):
+    return tables["best"][side][states]
+
+
+def _policy_random(tables, side, states, rng):
+    offsets = tables["offsets"][side]
+    first = offsets[states]
+    return first + (rng.random(states.size) * (offsets[states + 1] - first)).astype(np.int64)
+
+
+def _policy_safe(tables, side, states, rng):
+    offsets, edges = tables["rule_offsets"][side], tables["rule_edges"][side]
+    first = offsets[states]
+    count = offsets[states + 1] - first
+    if not edges.size:
+        return np.full(states.size, -1, dtype=np.int64)
+    pick = np.minimum(first + (rng.random(states.size) * count).astype(np.int64), edges.size - 1)
+    return np.where(count > 0, edges[pick], -1)
+
+
+# Политики самоигры: (таблицы, сторона, индексы позиций, генератор) -> номера рёбер
+# в targets стороны; -1 — у политики нет хода, и партия продолжается случайным ходом.
+SELFPLAY_POLICIES = {
+    "best": _policy_best,
+    "random": _policy_random,
+    "safe": _policy_safe,
+}
+
+
+def play_games(tables, red_policy, black_policy, games, max_plies=200, seed=None):
+    """
+    Играет games партий со старта: красные по политике red_policy, чёрные — black_policy
+    (имена SELFPLAY_POLICIES). Партия кончается мельницей, отсутствием ходов у ходящего
+    (он проиграл) или ничьей после max_plies полуходов. Возвращает словарь:
+      - games, wins (победы красных, чёрных), draws; lengths — партий по длине в полуходах;
+      - по сторонам: moves — ходов, blunders — ходов, ухудшивших исход для ходящего
+        (из выигрыша — не в выигрыш, из ничьей — в поражение), disagreements — ходов
+        с другим исходом, чем у лучшего хода (статус соперника после хода, а у выигрыша
+        и поражения — ещё и расстояние; равноценные ходы расхождением не считаются),
+        gaps — позиций, где у политики не было хода.
+    """
+    rng = np.random.default_rng(seed)
+    policies = (SELFPLAY_POLICIES[red_policy], SELFPLAY_POLICIES[black_policy])
+    terminal = tables["terminal"]
+    states = np.full(games, tables["start"], dtype=np.int64)
+    result = {"games": games, "wins": [0, 0], "draws": 0, "lengths": np.zeros(max_plies + 1, dtype=np.int64),
+              "moves": [0, 0], "blunders": [0, 0], "disagreements": [0, 0], "gaps": [0, 0]}
+
+    for ply in range(max_plies + 1):
+        if not states.size:
+            break
+        side = ply & 1
+        offsets = tables["offsets"][side]
+        ended = terminal[states]
+        stuck = (ended == 0) & (offsets[states + 1] == offsets[states])
+        result["wins"][0] += int(np.count_nonzero(ended == 1))
+        result["wins"][1] += int(np.count_nonzero(ended == 2))
+        result["wins"][side ^ 1] += int(np.count_nonzero(stuck))
+        playing = states.size
+        states = states[(ended == 0) & ~stuck]
+        result["lengths"][ply] += playing - states.size
+        if ply == max_plies:
+            result["draws"] = int(states.size)
+            result["lengths"][ply] += states.size
+            break
+
+        edges = policies[side](tables, side, states, rng)
+        gaps = edges < 0
+        if gaps.any():
+            edges[gaps] = _policy_random(tables, side, states[gaps], rng)
+            result["gaps"][side] += int(np.count_nonzero(gaps))
+        targets = tables["targets"][side][edges]
+        current = tables["status"][side][states]
+        reply = tables["status"][side ^ 1][targets]
+        result["moves"][side] += int(states.size)
+        result["blunders"][side] += int(np.count_nonzero(((current == 1) & (reply != -1))
+                                                         | ((current == 0) & (reply == 1))))
+        best = tables["best"][side][states]
+        known = best >= 0
+        best_targets = tables["targets"][side][best[known]]
+        distance = tables["distance"][side ^ 1]
+        reply_known = reply[known]
+        result["disagreements"][side] += int(np.count_nonzero(
+            (reply_known != tables["status"][side ^ 1][best_targets])
+            | ((reply_known != 0) & (distance[targets[known]] != distance[best_targets]))))
+        states = targets
+    return result
+
+
+def _init_play_worker(tables):
+    global _play_tables
+    _play_tables = tables
+
+
+def _play_task(task):
+    red_policy, black_policy, games, max_plies, seed = task
+    return play_games(_play_tables, red_policy, black_policy, games, max_plies, seed)
+
+
+def run_tournament(tables, policies=tuple(SELFPLAY_POLICIES), games=10000, max_plies=200, batch=1 << 16,
+                   jobs=1, seed=0):
+    """
+    Турнир политик: games партий на каждую упорядоченную пару (красные, чёрные),
+    пачками по batch партий, в jobs процессах (None — по числу ядер). Пачки получают
+    свои генераторы из seed (SeedSequence.spawn), поэтому итог не зависит от jobs.
+    Возвращает по парам словари play_games с полями red и black, суммированные по пачкам.
+    """
+    matchups = [(red, black) for red in policies for black in policies]
+    tasks = []
+    for red, black in matchups:
+        for start in range(0, games, batch):
+            tasks.append((red, black, min(batch, games - start), max_plies))
+    seeds = np.random.SeedSequence(seed).spawn(len(tasks))
+    tasks = [task + (task_seed,) for task, task_seed in zip(tasks, seeds)]
+
+    if jobs == 1 or len(tasks) <= 1:
+        parts = [play_games(tables, *task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(jobs or os.cpu_count() or 1, len(tasks)),
+                                 initializer=_init_play_worker, initargs=(tables,)) as pool:
+            parts = list(pool.map(_play_task, tasks))
+
+    results = {}
+    for (red, black, *_), part in zip(tasks, parts):
+        total = results.get((red, black))
+        if total is None:
+            results[red, black] = dict(part, red=red, black=black)
+            continue
+        for key, value in part.items():
+            if isinstance(value, list):
+                total[key] = [a + b for a, b in zip(total[key], value)]
+            else:
+                total[key] = total[key] + value
+    return [results[matchup] for matchup in matchups]
+
+
+def tournament_report(results):
+    """Итоги run_tournament для JSON: длины партий — списком, плюс средняя длина."""
+    report = []
+    for result in results:
+        entry = dict(result, lengths=result["lengths"].tolist())
+        entry["mean_length"] = float(np.dot(np.arange(result["lengths"].size), result["lengths"])
+                                     / max(1, result["games"]))
+        report.append(entry)
+    return report
+
+
+def print_tournament(results, out=None):
+    """Выводит итоги run_tournament: исходы, длины партий и доли ошибок по сторонам."""
+    out = sys.stdout if out is None else out
+
+    def share(part, whole):
+        return f"{100 * part / whole:.2f}%" if whole else "—"
+
+    for entry in tournament_report(results):
+        games = entry["games"]
+        lengths = np.cumsum(entry["lengths"])
+        median = int(np.searchsorted(lengths, (games + 1) // 2)) if games else 0
+        longest = int(np.flatnonzero(entry["lengths"])[-1]) if games else 0
+        out.write(f"\nКрасные {entry['red']} — чёрные {entry['black']}: партий {games},"
+                  f" победы красных {share(entry['wins'][0], games)}, чёрных {share(entry['wins'][1], games)},"
+                  f" ничьи {share(entry['draws'], games)}\n")
+        out.write(f"   длина: средняя {entry['mean_length']:.1f}, медиана {median}, самая длинная {longest}"
+                  f" полуход.\n")
+        for side, name in enumerate(("красные", "чёрные")):
+            moves = entry["moves"][side]
+            gaps = f", без своего хода {entry['gaps'][side]}" if entry["gaps"][side] else ""
+            out.write(f"   {name}: ходов {moves}, ошибок {share(entry['blunders'][side], moves)},"
+                      f" не как лучший ход {share(entry['disagreements'][side], moves)}{gaps}\n")
@@ -0,0 +1,192 @@
+"""
+Ответы на запросы о позициях (PositionService) и HTTP/JSON-сервер над ними,
+команда `calc.py serve`.
+"""
+
+import json
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+from calc import COLOR_BLACK, COLOR_RED, forbidden_to_labels, parse_cells, parse_forbidden
+
+
+class PositionService:
+    """
+    Ответы на запросы о позициях поверх решённой таблицы (без вывода в stdout).
+    Позиция — словарь {"red": [...], "black": [...], "red_ban": [...], "black_ban": [...],
+    "color": "R"} с метками клеток (списком или строкой "A1,A2") либо {"index": n, "color": "R"}.
+    Ответ по (индекс, цвет) строится один раз и дальше берётся из кэша.
+    """
+
+    def __init__(self, solver, cache_size=1 << 16):
+        self.solver = solver
+        self.board = solver.board
+        self._answer = lru_cache(maxsize=cache_size)(self._build_answer)
+
+    def warm_up(self, precompute=False):
+        """Строит статусы и лучшие ходы; с precompute — ещё и ответы для всех позиций."""
+        self.solver.retro_status
+        self.solver.best_moves
+        if precompute:
+            self._answer = lru_cache(maxsize=None)(self._build_answer)
+            for index in range(len(self.solver)):
+                for color in (COLOR_RED, COLOR_BLACK):
+                    self._answer(index, color)
+
+    def _cells(self, value):
+        if isinstance(value, str):
+            return parse_cells(value, self.board) if value.strip() else ()
+        labels = self.board.label_to_cell
+        try:
+            return tuple(labels[label.upper()] for label in value)
+        except (KeyError, AttributeError, TypeError):
+            raise ValueError(f"неизвестные клетки: {value!r}") from None
+
+    def _forbidden(self, value):
+        if value is None or isinstance(value, str):
+            return parse_forbidden(value, self.board)
+        pair = self._cells(value)
+        if len(pair) != 2:
+            raise ValueError(f"запрет задаётся двумя клетками: {value!r}")
+        return pair
+
+    def resolve(self, position):
+        """(индекс, цвет) позиции запроса; ValueError, если позиции нет в словаре."""
+        if not isinstance(position, dict):
+            raise ValueError("позиция задаётся объектом")
+        color = position.get("color", COLOR_RED)
+        if color not in (COLOR_RED, COLOR_BLACK):
+            raise ValueError(f"неизвестный цвет: {color!r}")
+        if "index" in position:
+            index = position["index"]
+            # bool — подкласс int, а lru_cache считает True == 1
+            if isinstance(index, bool) or not isinstance(index, int) or not 0 <= index < len(self.solver):
+                raise ValueError(f"индекс вне диапазона 0..{len(self.solver) - 1}")
+            return index, color
+        index = self.solver.lookup_state_index(self._cells(position.get("red", ())),
+                                               self._cells(position.get("black", ())),
+                                               self._forbidden(position.get("red_ban")),
+                                               self._forbidden(position.get("black_ban")))
+        if index is None:
+            raise ValueError("такой позиции нет в словаре")
+        return index, color
+
+    def _move(self, before, target, color):
+        """Ход как {"from", "to", "index"}: клетки берутся из разницы наборов камней."""
+        labels = self.board.cell_to_label
+        side = 0 if color == COLOR_RED else 1
+        after = set(self.solver.state_at(target)[side])
+        src, = set(before[side]) - after
+        dst, = after - set(before[side])
+        return {"from": labels[src], "to": labels[dst], "index": target}
+
+    def _build_answer(self, index, color):
+        solver = self.solver
+        labels = self.board.cell_to_label
+        opponent = COLOR_BLACK if color == COLOR_RED else COLOR_RED
+        opponent_status = solver.retro_status[opponent]
+        opponent_distance = solver.retro_distance[opponent]
+        state = solver.state_at(index)
+        status = solver.retro_status[color][index]
+        winning = []
+        safe = []
+        # в конечной позиции (мельница уже стоит) ходов нет
+        options = solver.outgoing(color)[index] if not status or solver.retro_distance[color][index] else ()
+        for target in options:
+            reply = opponent_status[target]
+            if reply == 1:
+                continue
+            move = self._move(state, target, color)
+            if reply == -1:
+                move["distance"] = opponent_distance[target] + 1
+                winning.append(move)
+            safe.append(move)
+        best = solver.best_move(index, color)
+        return {
+            "index": index,
+            "color": color,
+            "red": [labels[c] for c in state[0]],
+            "black": [labels[c] for c in state[1]],
+            "red_ban": forbidden_to_labels(state[2], labels),
+            "black_ban": forbidden_to_labels(state[3], labels),
+            "status": status,
+            "distance": solver.retro_distance[color][index] if status else None,
+            "best": None if best is None else self._move(state, best, color),
+            "winning": winning,
+            "safe": safe,
+        }
+
+    def query(self, position):
+        """Ответ на одну позицию; ошибка разбора — {"error": ...} вместо исключения."""
+        try:
+            return self._answer(*self.resolve(position))
+        except (ValueError, TypeError) as exc:
+            return {"error": str(exc)}
+
+    def query_batch(self, positions):
+        return [self.query(position) for position in positions]
+
+    def info(self):
+        rules = self.solver.rules
+        return {"rules": rules.name, "fingerprint": rules.fingerprint().hex(), "states": len(self.solver)}
+
+
+class QueryRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP/JSON к PositionService:
+      GET  /info                      — правила и размер словаря;
+      GET  /query?red=A1,A2,B2&...    — одна позиция (поля как в PositionService);
+      POST /query   {позиция}         — одна позиция;
+      POST /batch   {"positions": [...]} или [...] — много позиций за один запрос.
+    """
+
+    server_version = "mill-calc"
+    service = None
+
+    def _reply(self, code, payload):
+        body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path, _, query = self.path.partition("?")
+        if path == "/info":
+            self._reply(200, self.service.info())
+        elif path == "/query":
+            position = dict(parse_qsl(query))
+            if "index" in position:
+                position["index"] = int(position["index"]) if position["index"].isdigit() else -1
+            self._reply(200, self.service.query(position))
+        else:
+            self._reply(404, {"error": f"неизвестный путь: {path}"})
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"null")
+        except ValueError as exc:
+            self._reply(400, {"error": f"некорректный JSON: {exc}"})
+            return
+        if self.path == "/query":
+            self._reply(200, self.service.query(payload))
+        elif self.path == "/batch":
+            positions = payload.get("positions") if isinstance(payload, dict) else payload
+            if not isinstance(positions, list):
+                self._reply(400, {"error": "ожидается список позиций"})
+                return
+            self._reply(200, {"results": self.service.query_batch(positions)})
+        else:
+            self._reply(404, {"error": f"неизвестный путь: {self.path}"})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_query_server(service, host="127.0.0.1", port=8765):
+    """HTTP-сервер запросов (ThreadingHTTPServer); запуск — serve_forever()."""
+    handler = type("BoundQueryRequestHandler", (QueryRequestHandler,), {"service": service})
+    return ThreadingHTTPServer((host, port), handler)
@@ -0,0 +1,389 @@
+import base64
+import io
+import json
+import shutil
+import subprocess
+import zlib
+
+import pytest
+
+import calc
+from calc import RULESETS, Solver, apply_rule_edit, compare_solutions, grid_rules, solve_incremental, tune_rules
+
+
+def incremental_matches_full(solver, command):
+    rules = apply_rule_edit(solver.rules, command)
+    fresh, report = solve_incremental(solver, rules)
+    assert compare_solutions(fresh, Solver(rules=rules)) == 0
+    return fresh, report
+
+
+@pytest.mark.parametrize("name", ["classic", "original", "classic-free"])
+@pytest.mark.parametrize("command", ["+A1 C1", "-A1 C1", "-A1 B1", "first -A2,A3,B1", "first +A1,B2,C3"])
+def test_edit_matches_full_solve(solved, name, command):
+    solver = solved(name)
+    if command.startswith("-A1 C1"):
+        # убрать добавленное: сначала «+A1 C1», затем правка поверх пересчитанного решения
+        solver, _ = solve_incremental(solver, apply_rule_edit(solver.rules, "+A1 C1"))
+    incremental_matches_full(solver, command)
+
+
+def test_first_move_edit_stays_in_cone(solved):
+    _, report = incremental_matches_full(solved("classic"), "first -A2,A3,B1")
+    assert not report["full"] and report["changed"] and report["cone"] < report["states"]
+
+
+def test_chained_edits(solved):
+    solver = solved("original")
+    for command in ("first -A2,A3,B1", "+A1 C1", "first +A2,A3,B1", "-A1 C1"):
+        solver, _ = incremental_matches_full(solver, command)
+    assert compare_solutions(solver, solved("original")) == 0
+
+
+def test_graph_rebuild_fallback():
+    # ход по новой диагонали затрагивает больше позиций, чем есть в словаре
+    _, report = incremental_matches_full(Solver(rules=grid_rules(2, 4, stones=2)), "+A1 A3")
+    assert not report["full"] and report["recomputed"] > report["states"] and report["changed"] is None
+
+
+def test_whole_resolve_fallback():
+    # граф перестраивается по частям, но конус накрывает всё — анализ заново целиком
+    _, report = incremental_matches_full(Solver(rules=grid_rules(2, 4, stones=2)), "-A1 A2")
+    assert report["recomputed"] <= report["states"] and report["changed"] is None
+    assert report["cone"] == 2 * report["states"]
+
+
+def test_full_rebuild_when_rules_differ_beyond_moves(solved):
+    rules = RULESETS["classic-free"]
+    fresh, report = solve_incremental(solved("classic"), rules)
+    assert report["full"]
+    assert compare_solutions(fresh, Solver(rules=rules)) == 0
+
+
+def test_tune_verify_reports_no_mismatches(solved, capsys):
+    assert tune_rules(solved("classic-free"), ["+A1 C1", "first -A2,A3,B1", "-A1 C1"], verify=True) == 0
+    assert "расхождений 0" in capsys.readouterr().out
+
+
+@pytest.mark.skipif(calc.np is None, reason="нужен numpy")
+@pytest.mark.parametrize("name", ["classic", "original", "original-free"])
+def test_numpy_engine_matches_queue(solved, name):
+    solver = solved(name)
+    status, distance = calc.run_retrograde_analysis_numpy(solver.index, solver.transitions)
+    assert (status, distance) == calc.run_retrograde_analysis(solver.index, solver.transitions)
+    assert status == solver.retro_status and distance == solver.retro_distance
+
+
+def disk_solution(index, directory, **options):
+    store = calc.solve_on_disk(index, directory, **options)
+    result = store.gather()
+    store.close()
+    return result
+
+
+@pytest.mark.parametrize("name", ["classic", "original-free"])
+def test_disk_solve_matches_queue(solved, tmp_path, name):
+    solver = solved(name)
+    status, distance = disk_solution(calc.StateIndex(solver.rules), str(tmp_path), partition_states=1024)
+    assert status == solver.retro_status and distance == solver.retro_distance
+
+
+@pytest.mark.parametrize("layer, checkpoint_every", [(1, 0), (4, 0), (7, 0), (5, 1e9), (9, 1e9)])
+def test_disk_solve_resumes_after_crash(solved, tmp_path, interrupted_solve, layer, checkpoint_every):
+    # checkpoint_every=0 — точка после каждого слоя; 1e9 — только начальная, откат до слоя 0
+    solver = solved("classic")
+    index = calc.StateIndex(solver.rules)
+    directory = str(tmp_path)
+    interrupted_solve(index, directory, layer, partition_states=4096, checkpoint_every=checkpoint_every)
+    stats = calc.SolverStats()
+    status, distance = disk_solution(index, directory, partition_states=4096, stats=stats)
+    assert stats.counters["resumed_layer"] == (layer if checkpoint_every == 0 else 0)
+    assert status == solver.retro_status and distance == solver.retro_distance
+    # законченный каталог просто открывается, чужие правила — ошибка
+    assert disk_solution(index, directory, partition_states=4096) == (status, distance)
+    with pytest.raises(ValueError):
+        calc.solve_on_disk(calc.StateIndex(RULESETS["original"]), directory, partition_states=4096)
+
+
+@pytest.mark.parametrize("rules", [RULESETS["classic"], RULESETS["original-free"], grid_rules(3, 4, stones=2)],
+                         ids=lambda rules: rules.name)
+def test_parallel_transitions_are_byte_identical(rules):
+    index = calc.StateIndex(rules)
+    serial = calc.build_transition_maps(index)
+    parallel = calc.build_transition_maps(index, workers=3)
+    # ходы красных и чёрных, затем обратный граф
+    assert len(serial) == len(parallel) == 4
+    for one, other in zip(serial, parallel):
+        assert bytes(one.offsets) == bytes(other.offsets)
+        assert bytes(one.targets) == bytes(other.targets)
+        assert memoryview(one.targets).format == memoryview(other.targets).format
+
+
+@pytest.mark.parametrize("rules", [RULESETS["classic"], RULESETS["original-free"], grid_rules(2, 4, stones=2)],
+                         ids=lambda rules: rules.name)
+def test_unmoves_equal_reverse_graph(rules):
+    index = calc.StateIndex(rules)
+    incoming = calc.build_transition_maps(index)[2:]
+    unpack_state = index.board.unpack_state
+    for idx in range(len(index)):
+        fields = unpack_state(index.unrank_state(idx))
+        for mover, table in zip((calc.COLOR_RED, calc.COLOR_BLACK), incoming):
+            assert sorted(index.generate_unmoves_from_masks(*fields, mover)) == sorted(table[idx])
+
+
+@pytest.mark.parametrize("name", ["classic", "original-free"])
+def test_unmove_solver_matches_queue(solved, name):
+    solver = solved(name)
+    lean = Solver(rules=solver.rules, unmoves=True)
+    assert lean.retro_status == solver.retro_status and lean.retro_distance == solver.retro_distance
+    for color in (calc.COLOR_RED, calc.COLOR_BLACK):
+        assert all(lean.best_move(idx, color) == solver.best_move(idx, color) for idx in range(0, len(solver), 7))
+
+
+def test_full_rebuild_without_stored_graph():
+    rules = apply_rule_edit(RULESETS["classic-free"], "+A1 C1")
+    fresh, report = solve_incremental(Solver(rules=RULESETS["classic-free"], unmoves=True), rules)
+    assert report["full"]
+    assert fresh.retro_status == Solver(rules=rules).retro_status
+
+
+@pytest.mark.parametrize("rules", [RULESETS["classic"], RULESETS["original-free"], grid_rules(3, 4, stones=2)],
+                         ids=lambda rules: rules.name)
+def test_rank_unrank_round_trip(rules):
+    index = calc.StateIndex(rules)
+    unpack_state = index.board.unpack_state
+    for idx, packed in enumerate(index.iter_packed_states()):
+        assert index.unrank_state(idx) == packed
+        assert index.rank_state(*unpack_state(packed)) == idx
+        red, black, red_forbidden, black_forbidden = index.state_at(idx)
+        assert index.lookup_state_index(red, black, red_forbidden, black_forbidden) == idx
+
+
+def test_rank_rejects_missing_states():
+    index = calc.StateIndex(RULESETS["classic"])
+    red_mask, black_mask, red_code, black_code = index.board.unpack_state(index.unrank_state(0))
+    assert index.rank_state(red_mask, red_mask, red_code, black_code) is None   # камни друг на друге
+    assert index.rank_state(red_mask & red_mask - 1, black_mask, red_code, black_code) is None  # камня не хватает
+    assert index.lookup_state_index((1, 2), (4, 5, 7)) is None
+
+
+@pytest.mark.parametrize("name", ["classic", "original-free"])
+def test_symmetric_solve_matches_full(solved, name):
+    solver = solved(name)
+    reduced = Solver(rules=solver.rules, symmetry=True)
+    assert len(reduced) == len(solver)
+    assert len(reduced.reduction) < len(solver)
+    assert all(reduced.state_at(idx) == solver.state_at(idx) for idx in range(0, len(solver), 13))
+    for color in (calc.COLOR_RED, calc.COLOR_BLACK):
+        status, distance = reduced.retro_status[color], reduced.retro_distance[color]
+        assert list(status) == list(solver.retro_status[color])
+        assert list(distance) == list(solver.retro_distance[color])
+        # то же при обращении по индексу, а не подряд
+        assert all(status[idx] == solver.retro_status[color][idx] for idx in range(0, len(solver), 13))
+
+
+def test_tablebase_round_trip(solved, tmp_path):
+    path = str(tmp_path / "classic.mtb")
+    solver = solved("classic")
+    calc.save_tablebase(solver, path)
+    stats = calc.SolverStats()
+    reopened = Solver(cache_path=path, stats=stats)
+    # открытый файл читается через mmap и не решается заново
+    assert isinstance(reopened.retro_status[calc.COLOR_RED], memoryview)
+    assert "solve" not in stats.phases and "load_table" in stats.phases
+    assert len(reopened) == len(solver)
+    for color in (calc.COLOR_RED, calc.COLOR_BLACK):
+        assert list(reopened.retro_status[color]) == list(solver.retro_status[color])
+        assert list(reopened.retro_distance[color]) == list(solver.retro_distance[color])
+        assert list(reopened.best_moves[color]) == list(solver.best_moves[color])
+    for mine, theirs in zip(reopened.transitions, solver.transitions):
+        assert list(mine.offsets) == list(theirs.offsets) and list(mine.targets) == list(theirs.targets)
+    assert all(reopened.state_at(idx) == solver.state_at(idx) for idx in range(0, len(solver), 11))
+
+
+def test_tablebase_is_tied_to_rules(solved, tmp_path):
+    path = str(tmp_path / "table.mtb")
+    calc.save_tablebase(solved("classic-free"), path)
+    edited = apply_rule_edit(RULESETS["classic-free"], "+A1 C1")
+    assert calc.open_tablebase(path, RULESETS["classic-free"]) is not None
+    assert edited.fingerprint() != RULESETS["classic-free"].fingerprint()
+    assert calc.open_tablebase(path, edited) is None
+    assert calc.open_tablebase(path, RULESETS["classic"]) is None
+    assert calc.open_tablebase(str(tmp_path / "missing.mtb"), RULESETS["classic-free"]) is None
+    # файл чужих правил пересчитывается и перезаписывается
+    rebuilt = Solver(cache_path=path, rules=edited)
+    assert list(rebuilt.retro_status[calc.COLOR_RED]) == list(Solver(rules=edited).retro_status[calc.COLOR_RED])
+    assert calc.open_tablebase(path, edited) is not None
+    # испорченный заголовок — как нет файла
+    with open(path, "r+b") as f:
+        f.write(b"BROKEN!!")
+    assert calc.open_tablebase(path, edited) is None
+
+
+@pytest.mark.parametrize("name", ["classic", "original-free"])
+def test_reachable_is_closed_under_moves(solved, name):
+    solver = solved(name)
+    index, rules = solver.index, solver.rules
+    reachable = solver.reachable
+    marks = (reachable[calc.COLOR_RED], reachable[calc.COLOR_BLACK])
+    start = index.lookup_state_index(rules.red_start, rules.black_start)
+    assert marks[0][start]
+    moves = (solver.outgoing_red, solver.outgoing_black)
+    mill_flags = rules.mill_flags
+    reached_from = (bytearray(len(index)), bytearray(len(index)))
+    for side in (0, 1):
+        for idx in range(len(index)):
+            if not marks[side][idx]:
+                continue
+            red_mask, black_mask, _, _ = index.board.unpack_state(index.unrank_state(idx))
+            if mill_flags[red_mask] & calc.RED_MILL or mill_flags[black_mask] & calc.BLACK_MILL:
+                continue
+            for target in moves[side][idx]:
+                assert marks[side ^ 1][target]
+                reached_from[side ^ 1][target] = 1
+    # и ничего лишнего: кроме старта, в каждую отмеченную позицию есть ход из отмеченной
+    reached_from[0][start] = 1
+    assert reached_from == marks
+    assert 0 < marks[0].count(1) < len(index)
+    assert calc.find_reachable(index) == reachable
+
+
+def test_exports_are_full_unless_reachable_only(solved, tmp_path):
+    solver = solved("classic")
+    full, pruned = str(tmp_path / "full.jsonl"), str(tmp_path / "pruned.jsonl")
+    calc.main(["export", "rules", "-o", full])
+    calc.main(["export", "rules", "--reachable-only", "-o", pruned])
+    with open(full, encoding="utf-8") as source:
+        assert sum(1 for _ in source) == sum(1 for _ in calc.iter_rule_records(solver))
+    with open(pruned, encoding="utf-8") as source:
+        assert sum(1 for _ in source) == sum(1 for _ in calc.iter_rule_records(solver, reachable=solver.reachable))
+
+
+def run_node(script, module, cases):
+    """Выполняет JS script под node: MODULE — путь к выведенной таблице, CASES — JSON из stdin."""
+    completed = subprocess.run(["node", "-e", script, module], input=json.dumps(cases), capture_output=True,
+                               text=True, check=True, timeout=120)
+    return json.loads(completed.stdout)
+
+
+def safe_moves_by_index(solver, color, reachable=None):
+    return {idx: sorted(moves) for idx, _, moves in calc.iter_safe_transitions(solver, color, reachable)}
+
+
+@pytest.mark.parametrize("pruned", [False, True], ids=["all", "reachable"])
+def test_packed_rule_table_round_trip(solved, pruned):
+    solver = solved("classic")
+    reachable = solver.reachable if pruned else None
+    table = calc.build_packed_rule_table(solver, reachable)
+    unpacked = calc.read_packed_rule_table(table)
+    index, board = solver.index, solver.board
+    assert list(unpacked["pair_flags"]) == [index.pair_flags[pair] | calc.PACKED_PAIR_PRESENT
+                                            if index.pair_black_width[pair] else 0 for pair in range(index.pair_count)]
+    labels = board.cell_to_label
+    for side, color in enumerate((calc.COLOR_RED, calc.COLOR_BLACK)):
+        assert unpacked[color] == calc.build_packed_safe_moves(solver, color, reachable)
+        decoded = {}
+        for idx, bits in enumerate(unpacked[color]):
+            fields = board.unpack_state(index.unrank_state(idx))
+            order = calc.legal_move_order(board, solver.rules.neighbors, fields[side], fields[0] | fields[1],
+                                          board.code_to_forbidden(fields[2 + side]))
+            if bits:
+                decoded[idx] = sorted((labels[src], labels[dst]) for slot, (src, dst) in enumerate(order)
+                                      if bits >> slot & 1)
+        rules = calc.iter_transition_rules(solver, color, reachable)
+        if color == calc.COLOR_BLACK and not pruned:
+            rules = calc.build_black_transition_rules(solver)
+        assert decoded == {rule["index"]: rule["transitions"] for rule in rules}
+    with pytest.raises(ValueError):
+        calc.read_packed_rule_table(dict(table, data=table["data"][:len(table["data"]) // 2]))
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="нужен node")
+def test_js_table_decoder(solved, tmp_path):
+    solver = solved("classic")
+    module = tmp_path / "table.js"
+    with open(module, "w", encoding="utf-8") as out:
+        calc.print_packed_rule_table(solver, out)
+    states = list(range(0, len(solver), 97))
+    cases = [[color, *map(list, solver.state_at(idx)[:2]), *(list(ban) if ban else None for ban in solver.state_at(idx)[2:])]
+             for idx in states for color in (calc.COLOR_RED, calc.COLOR_BLACK)]
+    decoded = run_node("""
+        const { MILL_TABLE, decodeMillTable } = require(process.argv[1]);
+        const table = decodeMillTable(MILL_TABLE);
+        const cases = JSON.parse(require("fs").readFileSync(0, "utf8"));
+        console.log(JSON.stringify(cases.map((c) => [table.stateIndex(...c.slice(1)), table.safeMoves(...c)])));
+    """, str(module), cases)
+    expected = {color: safe_moves_by_index(solver, color) for color in (calc.COLOR_RED, calc.COLOR_BLACK)}
+    for case, (idx, moves) in zip(cases, decoded):
+        assert idx == states[cases.index(case) // 2]
+        assert [tuple(move) for move in moves] == sorted(expected[case[0]].get(idx, []))
+
+
+@pytest.mark.parametrize("name", ["classic", "original"])
+def test_packed_status_round_trip(solved, name):
+    solver = solved(name)
+    status = solver.retro_status
+    table = calc.pack_status_table(status)
+    everything = range(len(solver))
+    for color in (calc.COLOR_RED, calc.COLOR_BLACK):
+        assert [table.get(idx, color) for idx in everything] == list(status[color])
+        assert list(table.get_many(list(everything), color)) == list(status[color])
+    for deflate in (True, False):
+        data = calc.serialize_status_table(table, solver.rules, deflate)
+        restored = calc.read_status_table(data, solver.rules)
+        assert restored.states == table.states and restored.data == table.data
+        payload = calc.build_status_payload(solver, deflate)
+        packed = base64.b64decode(payload["data"])
+        assert (zlib.decompress(packed) if deflate else packed) == bytes(table.data)
+    with pytest.raises(ValueError):
+        calc.read_status_table(data, RULESETS["classic-free" if name == "classic" else "classic"])
+    with pytest.raises(ValueError):
+        calc.read_status_table(b"NOTMILL!" + data[8:])
+    with pytest.raises(ValueError):
+        calc.read_status_table(data[:-1])
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="нужен node")
+@pytest.mark.parametrize("deflate", [True, False], ids=["deflate", "raw"])
+def test_js_status_decoder(solved, tmp_path, deflate):
+    solver = solved("original")
+    module = tmp_path / "status.js"
+    with open(module, "w", encoding="utf-8") as out:
+        calc.print_status_table(solver, out, deflate)
+    states = list(range(0, len(solver), 89))
+    cases = [[*map(list, solver.state_at(idx)[:2]), *(list(ban) if ban else None for ban in solver.state_at(idx)[2:])]
+             for idx in states]
+    decoded = run_node("""
+        const { MILL_STATUS, decodeMillStatus } = require(process.argv[1]);
+        const cases = JSON.parse(require("fs").readFileSync(0, "utf8"));
+        decodeMillStatus(MILL_STATUS).then((table) => {
+          const all = (color) => Array.from({ length: table.states }, (_, i) => table.statusAt(i, color));
+          console.log(JSON.stringify({ R: all("R"), B: all("B"), indexes: cases.map((c) => table.stateIndex(...c)) }));
+        });
+    """, str(module), cases)
+    assert decoded["indexes"] == states
+    for color in (calc.COLOR_RED, calc.COLOR_BLACK):
+        assert decoded[color] == list(solver.retro_status[color])
+
+
+@pytest.mark.parametrize("color", ["R", "B"])
+@pytest.mark.parametrize("group, pruned", [(True, False), (False, False), (True, True)],
+                         ids=["grouped", "per-position", "reachable"])
+def test_minimized_rules_expand_to_full_table(solved, color, group, pruned):
+    solver = solved("classic")
+    reachable = solver.reachable if pruned else None
+    minimized = list(calc.minimize_transition_rules(solver, color, group, reachable))
+    checked, mismatches = calc.verify_minimized_rules(solver, minimized, color, reachable)
+    assert checked == sum(1 for _ in calc.iter_transition_rules(solver, color, reachable))
+    assert mismatches == 0
+    # потерю правила с запретами проверка должна заметить
+    dropped = next(rule for rule in minimized if rule["deny"])
+    assert calc.verify_minimized_rules(solver, [rule for rule in minimized if rule is not dropped],
+                                       color, reachable)[1] > 0
+
+
+def test_minimized_rules_header_names_the_color():
+    for color, name in ((calc.COLOR_RED, "Красные"), (calc.COLOR_BLACK, "Чёрные")):
+        out = io.StringIO()
+        calc.print_minimized_rules([{"red": ["A1"], "black": ["B2"], "deny": [["A1", "A2"]]}], out, color)
+        assert out.getvalue().startswith(f"\n// {name}: исключения")
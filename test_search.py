@@ -0,0 +1,112 @@
+import pytest
+
+from calc import COLOR_BLACK, COLOR_RED, StateIndex, open_solve_dir
+from search import PartitionOracle, SearchEngine, TableOracle
+
+COLORS = (COLOR_RED, COLOR_BLACK)
+
+
+def decided(solver, max_distance, step):
+    """Каждая step-я решённая позиция (индекс, цвет) с исходом не дальше max_distance полуходов."""
+    found = []
+    for color in COLORS:
+        status, distance = solver.retro_status[color], solver.retro_distance[color]
+        found += [(index, color) for index in range(len(solver))
+                  if status[index] and 0 < distance[index] <= max_distance]
+    return found[::step]
+
+
+def assert_matches_table(solver, index, color, result):
+    opponent = COLOR_BLACK if color == COLOR_RED else COLOR_RED
+    status = solver.retro_status[color][index]
+    assert result["proven"] and result["status"] == status
+    if result["distance"] is not None:
+        assert result["distance"] == solver.retro_distance[color][index]
+    # ход ведёт к исходу, который таблица считает лучшим
+    move = result["move"]
+    assert move in solver.outgoing(color)[index]
+    if status == 1:
+        assert solver.retro_status[opponent][move] == -1
+        if result["distance"] is not None:
+            assert solver.retro_distance[opponent][move] == result["distance"] - 1
+
+
+@pytest.mark.parametrize("method", ["alphabeta", "pns"])
+def test_search_without_oracle_matches_table(solved, method):
+    solver = solved("classic")
+    engine = SearchEngine(solver.index)
+    for index, color in decided(solver, 7, 997):
+        assert_matches_table(solver, index, color, engine.search(index, color, method=method))
+
+
+@pytest.mark.parametrize("method", ["alphabeta", "pns"])
+def test_full_oracle_still_expands_root(solved, method):
+    solver = solved("classic")
+    engine = SearchEngine(solver.index, oracle=TableOracle.from_solver(solver))
+    for index, color in decided(solver, 12, 401):
+        result = engine.search(index, color, method=method)
+        assert result["nodes"] > 0
+        assert_matches_table(solver, index, color, result)
+
+
+def test_solver_is_accepted_as_oracle(solved):
+    solver = solved("classic")
+    result = SearchEngine(solver.index, oracle=solver).search(56, COLOR_RED, method="pns")
+    assert result["move"] == solver.best_move(56, COLOR_RED)
+
+
+def test_partial_oracle_cuts_only_known_positions(solved):
+    solver = solved("classic")
+    status, distance = solver.retro_status, solver.retro_distance
+    # известны только исходы не дальше 4 полуходов от конца
+    partial = TableOracle(solver.rules, (status[COLOR_RED], status[COLOR_BLACK]),
+                          (distance[COLOR_RED], distance[COLOR_BLACK]), complete=False, max_distance=4)
+    assert partial.probe(56, 0) is None
+    for index, color in decided(solver, 9, 211):
+        if distance[color][index] <= 4:
+            continue
+        plain = SearchEngine(solver.index).search(index, color)
+        cut = SearchEngine(solver.index, oracle=partial).search(index, color)
+        assert_matches_table(solver, index, color, cut)
+        assert cut["nodes"] <= plain["nodes"]
+    # ничья с частичной таблицей не доказывается: статус 0 там — «неизвестно»
+    draw = next(index for index in range(len(solver)) if not status[COLOR_RED][index])
+    result = SearchEngine(solver.index, oracle=partial).search(draw, COLOR_RED, max_depth=4)
+    assert result["status"] == 0 and not result["proven"]
+
+
+def test_interrupted_disk_solve_as_oracle(solved, tmp_path, interrupted_solve):
+    solver = solved("classic")
+    index = StateIndex(solver.rules)
+    interrupted_solve(index, str(tmp_path), layer=6, partition_states=4096, checkpoint_every=0)
+    store, layer, complete = open_solve_dir(index, str(tmp_path))
+    assert not complete and layer == 6
+    oracle = PartitionOracle(store, layer, complete)
+    known = 0
+    for side, color in enumerate(COLORS):
+        for state in range(len(solver)):
+            answer = oracle.probe(state, side)
+            if answer is not None:
+                known += 1
+                assert answer == (solver.retro_status[color][state], solver.retro_distance[color][state])
+    assert 0 < known < 2 * len(solver)
+    for state, color in decided(solver, 12, 503):
+        assert_matches_table(solver, state, color, SearchEngine(index, oracle=oracle).search(state, color))
+    store.close()
+
+
+def test_root_move_survives_table_clearing(solved):
+    solver = solved("classic")
+    for index, color in decided(solver, 9, 701):
+        result = SearchEngine(solver.index, table_size=8).search(index, color)
+        assert_matches_table(solver, index, color, result)
+
+
+def test_search_budget(solved):
+    solver = solved("classic")
+    index = next(index for index in range(len(solver))
+                 if not solver.retro_status[COLOR_RED][index] and solver.outgoing(COLOR_RED)[index])
+    result = SearchEngine(solver.index).search(index, COLOR_RED, node_limit=500)
+    assert not result["complete"] and result["nodes"] > 500 and not result["proven"]
+    with pytest.raises(ValueError):
+        SearchEngine(solver.index).search(index, COLOR_RED, method="mcts")
@@ -0,0 +1,85 @@
+import pytest
+
+from calc import COLOR_BLACK, COLOR_RED, iter_transition_rules
+
+np = pytest.importorskip("numpy")
+
+import selfplay  # noqa: E402
+from selfplay import SELFPLAY_POLICIES, build_play_tables, play_games, run_tournament  # noqa: E402
+
+COLORS = (COLOR_RED, COLOR_BLACK)
+
+
+@pytest.fixture(scope="module")
+def tables(solved):
+    return build_play_tables(solved("classic"))
+
+
+def test_play_tables_mirror_solver(solved, tables):
+    solver = solved("classic")
+    assert tables["start"] == solver.index.lookup_state_index(solver.rules.red_start, solver.rules.black_start)
+    for side, color in enumerate(COLORS):
+        moves = solver.outgoing(color)
+        offsets, targets, best = tables["offsets"][side], tables["targets"][side], tables["best"][side]
+        assert list(tables["status"][side]) == list(solver.retro_status[color])
+        assert list(tables["distance"][side]) == list(solver.retro_distance[color])
+        rule_offsets, rule_edges = tables["rule_offsets"][side], tables["rule_edges"][side]
+        for state in range(0, len(solver), 37):
+            assert list(targets[offsets[state]:offsets[state + 1]]) == list(moves[state])
+            move = solver.best_move(state, color)
+            assert (best[state] < 0 if move is None else targets[best[state]] == move)
+        rules = {rule["index"]: len(rule["transitions"]) for rule in iter_transition_rules(solver, color)}
+        counts = np.diff(rule_offsets)
+        assert {int(state): int(counts[state]) for state in np.flatnonzero(counts)} == rules
+        owners = np.searchsorted(offsets, rule_edges, side="right") - 1
+        assert np.array_equal(owners, np.repeat(np.arange(len(solver)), counts))
+
+
+def test_best_play_is_flawless(solved, tables):
+    result = play_games(tables, "best", "best", 64, seed=1)
+    start_status = solved("classic").retro_status[COLOR_RED][tables["start"]]
+    assert result["blunders"] == [0, 0] and result["disagreements"] == [0, 0] and result["gaps"] == [0, 0]
+    assert result["wins"][0] + result["wins"][1] + result["draws"] == 64
+    assert result["draws"] == (64 if start_status == 0 else 0)
+    assert int(result["lengths"].sum()) == 64
+
+
+def test_equivalent_moves_are_not_disagreements(tables, monkeypatch):
+    differs = [0]
+
+    def last_equivalent(tables, side, states, rng):
+        # последнее ребро позиции с тем же исходом и расстоянием, что у лучшего хода
+        status, distance = tables["status"][side ^ 1], tables["distance"][side ^ 1]
+        offsets, targets, best = tables["offsets"][side], tables["targets"][side], tables["best"][side]
+        edges = best[states].copy()
+        for row, state in enumerate(states):
+            chosen = targets[edges[row]]
+            for edge in range(offsets[state], offsets[state + 1]):
+                target = targets[edge]
+                if status[target] == status[chosen] and (not status[chosen] or distance[target] == distance[chosen]):
+                    edges[row] = edge
+        differs[0] += int(np.count_nonzero(edges != best[states]))
+        return edges
+
+    monkeypatch.setitem(SELFPLAY_POLICIES, "equivalent", last_equivalent)
+    result = play_games(tables, "equivalent", "equivalent", 16, max_plies=40, seed=2)
+    assert differs[0] > 0
+    assert result["disagreements"] == [0, 0] and result["blunders"] == [0, 0]
+    random = play_games(tables, "random", "random", 256, max_plies=40, seed=2)
+    assert 0 < random["disagreements"][0] <= random["moves"][0]
+    assert random["blunders"][0] <= random["disagreements"][0]
+
+
+def test_tournament_is_deterministic(tables):
+    options = dict(policies=("best", "random", "safe"), games=300, max_plies=60, batch=128, seed=5)
+    serial = run_tournament(tables, jobs=1, **options)
+    parallel = run_tournament(tables, jobs=2, **options)
+    assert [(entry["red"], entry["black"]) for entry in serial] == [(red, black) for red in options["policies"]
+                                                                     for black in options["policies"]]
+    for one, other in zip(serial, parallel):
+        assert one.keys() == other.keys()
+        for key in one:
+            assert np.array_equal(one[key], other[key]) if key == "lengths" else one[key] == other[key]
+        assert one["games"] == 300 and sum(one["wins"]) + one["draws"] == 300
+    report = selfplay.tournament_report(serial)
+    assert all(isinstance(entry["lengths"], list) for entry in report)
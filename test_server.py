@@ -0,0 +1,92 @@
+import json
+import threading
+from http.client import HTTPConnection
+
+import pytest
+
+from calc import COLOR_BLACK, COLOR_RED
+from server import PositionService, make_query_server
+
+
+@pytest.fixture(scope="module")
+def service(solved):
+    return PositionService(solved("classic"))
+
+
+@pytest.fixture(scope="module")
+def address(service):
+    server = make_query_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.server_address
+    server.shutdown()
+    server.server_close()
+
+
+def request(address, method, path, payload=None):
+    connection = HTTPConnection(*address, timeout=10)
+    body = None if payload is None else json.dumps(payload)
+    connection.request(method, path, body=body)
+    response = connection.getresponse()
+    result = response.status, json.loads(response.read())
+    connection.close()
+    return result
+
+
+def as_json(answer):
+    return json.loads(json.dumps(answer))
+
+
+def test_query_by_cells_and_index_agree(service):
+    solver = service.solver
+    index = 56
+    by_index = service.query({"index": index})
+    by_cells = service.query({key: by_index[key] for key in ("red", "black", "red_ban", "black_ban", "color")})
+    assert by_cells == by_index
+    assert by_index["status"] == solver.retro_status[COLOR_RED][index]
+    assert by_index["best"]["index"] == solver.best_move(index, COLOR_RED)
+
+
+@pytest.mark.parametrize("position", [
+    {"red": 5},
+    {"red": None, "black": ["B1"]},
+    {"red": ["A1", 7]},
+    {"red_ban": 7},
+    {"red": "A1,A2,Z9"},
+    {"red": "A1,A2,A3", "black": "B1,B2,C1", "color": "X"},
+    {"index": -1},
+    {"index": 10 ** 9},
+    {"index": "1"},
+    [],
+])
+def test_malformed_positions_get_an_error(service, position):
+    assert set(service.query(position)) == {"error"}
+
+
+def test_bool_index_does_not_alias_one(service):
+    assert "error" in service.query({"index": True})
+    index = service.query({"index": 1})["index"]
+    assert index == 1 and type(index) is int
+
+
+def test_batch_keeps_answers_around_bad_entries(address, service):
+    positions = [{"index": 1}, {"red": 5}, {"index": True}, {"index": 10 ** 9}, {"index": 2, "color": COLOR_BLACK}]
+    code, payload = request(address, "POST", "/batch", {"positions": positions})
+    assert code == 200
+    results = payload["results"]
+    assert len(results) == len(positions)
+    assert results[0] == as_json(service.query(positions[0]))
+    assert results[4] == as_json(service.query(positions[4]))
+    assert all(set(result) == {"error"} for result in results[1:4])
+
+
+def test_http_endpoints(address, service):
+    code, info = request(address, "GET", "/info")
+    assert code == 200 and info["states"] == len(service.solver)
+    code, answer = request(address, "GET", "/query?red=A1,A2,A3&black=B1,B2,C1&red_ban=A1,B1&black_ban=B2,C3")
+    assert code == 200 and answer == as_json(service.query({"index": 56}))
+    code, answer = request(address, "POST", "/query", {"index": 3})
+    assert code == 200 and answer["index"] == 3
+    assert request(address, "GET", "/query?index=abc")[1].keys() == {"error"}
+    assert request(address, "POST", "/batch", {"positions": 3}) == (400, {"error": "ожидается список позиций"})
+    assert request(address, "GET", "/nowhere")[0] == 404